@@ -0,0 +1,145 @@
+"""Running the test until a statistic of its timings is known within a confidence interval."""
+import math
+import statistics
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import List, Set, Tuple
+
+from apitest.fake import FakeTransport
+from apitest.histogram import Histogram
+from apitest.test import TestStats, test_everything
+
+STATISTICS = ('mean', 'median', 'p99')
+
+
+def t_quantile(p: float, df: int) -> float:
+    """Quantile of Student's t distribution, from the Cornish-Fisher expansion around the normal quantile.
+
+    Within 1% of the exact value from 3 degrees of freedom.
+    """
+    z = statistics.NormalDist().inv_cdf(p)
+    return (z + (z ** 3 + z) / (4 * df) + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2)
+            + (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * df ** 3)
+            + (79 * z ** 9 + 776 * z ** 7 + 1482 * z ** 5 - 1920 * z ** 3 - 945 * z) / (92160 * df ** 4))
+
+
+def mean_interval(values: List[float], confidence: float = 0.95) -> Tuple[float, float]:
+    """Confidence interval of the mean of the values, assuming the mean is normally distributed."""
+    if len(values) < 2:
+        return -math.inf, math.inf
+
+    mean = statistics.mean(values)
+    half_width = t_quantile(0.5 + confidence / 2, len(values) - 1) * statistics.stdev(values) / math.sqrt(len(values))
+    return mean - half_width, mean + half_width
+
+
+def rank_interval(n: int, quantile: float, confidence: float = 0.95) -> Tuple[int, int]:
+    """Ranks of the sorted values bounding a confidence interval of a quantile.
+
+    The number of values below the quantile is binomially distributed, which
+    is approximated with the normal distribution. No assumption is made
+    about the distribution of the values themselves. Ranks below 1 or above
+    n mean that there are too few values to bound the interval.
+    """
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+    spread = z * math.sqrt(n * quantile * (1 - quantile))
+    return math.floor(n * quantile - spread), math.ceil(n * quantile + spread) + 1
+
+
+def quantile_interval(values: List[float], quantile: float, confidence: float = 0.95) -> Tuple[float, float]:
+    values = sorted(values)
+    low, high = rank_interval(len(values), quantile, confidence)
+    return values[low - 1] if low >= 1 else -math.inf, values[high - 1] if high <= len(values) else math.inf
+
+
+def histogram_quantile_interval(histogram: Histogram, quantile: float,
+                                confidence: float = 0.95) -> Tuple[float, float]:
+    """Confidence interval of a quantile of a histogram, within the bucket precision."""
+    n = histogram.count
+    low, high = rank_interval(n, quantile, confidence)
+    return (histogram.value_at_quantile(low / n) if low >= 1 else -math.inf,
+            histogram.value_at_quantile(high / n) if high <= n else math.inf)
+
+
+@dataclass
+class AdaptiveResult:
+    statistic: str
+    endpoint: str = None
+    warmup_seconds: List[float] = field(default_factory=list)
+    run_seconds: List[float] = field(default_factory=list)
+    total: TestStats = field(default_factory=TestStats)
+    elapsed_seconds: float = 0
+    estimate: float = 0
+    interval: Tuple[float, float] = (-math.inf, math.inf)
+    converged: bool = False
+
+    @property
+    def relative_width(self) -> float:
+        """Width of the confidence interval relative to the estimate."""
+        return (self.interval[1] - self.interval[0]) / self.estimate if self.estimate else math.inf
+
+
+def selected_endpoints(only: List[str] = (), skip: List[str] = ()) -> Set[str]:
+    """The endpoints requested by the selected suites, found by running them once against the in-memory fake."""
+    stats = test_everything('http://fake', logging=False, transport=FakeTransport(), only=only or (), skip=skip or ())
+    return {f'{method} {template}' for method, template in stats.endpoint_latencies()}
+
+
+def _estimate(result: AdaptiveResult, confidence: float) -> Tuple[float, Tuple[float, float]]:
+    if result.statistic == 'mean':
+        return statistics.mean(result.run_seconds), mean_interval(result.run_seconds, confidence)
+    if result.statistic == 'median':
+        return statistics.median(result.run_seconds), quantile_interval(result.run_seconds, 0.5, confidence)
+
+    method, template = result.endpoint.split(' ', 1)
+    histogram = result.total.endpoint_latencies().get((method, template))
+    if not histogram:
+        raise ValueError(f'No requests to {result.endpoint} in the test')
+
+    return histogram.value_at_quantile(0.99), histogram_quantile_interval(histogram, 0.99, confidence)
+
+
+def run_adaptive(url: str, warmup: int = 2, width: float = 0.05, max_seconds: float = 300, statistic: str = 'mean',
+                 endpoint: str = None, confidence: float = 0.95, min_runs: int = 5, **options) -> AdaptiveResult:
+    """Run the test until the confidence interval of a statistic is narrow enough, or the time is up.
+
+    The first warmup runs are not counted. The statistic is the mean or
+    median run time in seconds, or the p99 latency of an endpoint such as
+    'GET /posts/{id}' in microseconds. The test stops after at least
+    min_runs counted runs when the width of the interval is at most width
+    times the estimate, or when max_seconds have passed since the start.
+
+    When only some suites are run, users are created once and shared by
+    every run. The endpoint is checked against the selected suites before
+    the first run.
+    """
+    if statistic == 'p99' and not endpoint:
+        raise ValueError('The p99 statistic requires an endpoint')
+    if statistic == 'p99':
+        endpoints = selected_endpoints(options.get('only'), options.get('skip'))
+        if endpoint not in endpoints:
+            raise ValueError(f'No requests to {endpoint} in the selected suites, expected one of: '
+                             f'{", ".join(sorted(endpoints))}')
+
+    result = AdaptiveResult(statistic=statistic, endpoint=endpoint)
+    fixtures = {} if options.get('only') or options.get('skip') else None
+    started = perf_counter()
+    try:
+        while perf_counter() - started < max_seconds:
+            stats = test_everything(url, logging=False, fixtures=fixtures, **options)
+            if len(result.warmup_seconds) < warmup:
+                result.warmup_seconds.append(stats.elapsed_seconds)
+                continue
+
+            result.run_seconds.append(stats.elapsed_seconds)
+            result.total.merge(stats)
+            result.estimate, result.interval = _estimate(result, confidence)
+            if len(result.run_seconds) >= min_runs and result.relative_width <= width:
+                result.converged = True
+                break
+    finally:
+        if fixtures:
+            test_everything(url, logging=False, fixtures=fixtures, **dict(options, only=['teardown'], skip=[]))
+
+    result.elapsed_seconds = perf_counter() - started
+    return result
@@ -0,0 +1,322 @@
+"""Running the complete test as thousands of virtual users per process on an asyncio event loop.
+
+The steps, assertions and statistics are those of test_everything: its
+steps yield the requests to send, which are sent here without blocking on a
+pool of keep-alive connections shared by every virtual user. There is no
+async HTTP client among the dependencies, so requests are sent with a small
+HTTP/1.1 client on asyncio streams.
+"""
+import argparse
+import asyncio
+import json
+import ssl
+import statistics
+from datetime import datetime
+from functools import partial
+from json import dumps
+from time import perf_counter
+from typing import List, Callable, Generator, Iterable, Iterator
+from urllib.parse import urlsplit, urlencode
+
+from apitest.fake import start_server
+from apitest.load import LoadResult, run_concurrent
+from apitest.test import TestStats, Observer, Request, build_scenario, select_steps, observed_run, shares_resources
+from apitest.transport import Decoder, Transport
+
+
+class AsyncResponse:
+    """A completely read response, with the parts of the interface of requests.Response used by the test."""
+
+    def __init__(self, status_code: int, headers: dict, content: bytes, phases: dict, sizes: dict):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.phases = phases
+        self.sizes = sizes
+
+    @property
+    def text(self) -> str:
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size: int = 1) -> Iterator[bytes]:
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class AsyncTransport:
+    """Sends requests on a pool of keep-alive connections shared by every coroutine on the event loop.
+
+    At most limit requests are in flight at the same time, and the others
+    wait for a free slot, so the number of connections stays bounded however
+    many virtual users there are. The time waiting for a slot counts in the
+    latency of a request, but not in any of its phases.
+
+    on_response is called with the method, URL, keyword arguments and
+    response of every request, e.g. RegistryTransport.register.
+    Compressed responses are only asked for with accept_encoding.
+    in_flight is called with 1 when a request is sent and -1 when it has
+    been answered, e.g. MetricsObserver.sending.
+    Connecting, and reading the status line and the rest of the response,
+    each raise asyncio.TimeoutError after timeout seconds.
+    """
+
+    def __init__(self, limit: int = 100, keep_alive: bool = True, on_response: Callable = None,
+                 accept_encoding: str = 'identity', in_flight: Callable[[int], None] = None, timeout: float = 30):
+        self.limit = limit
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.on_response = on_response
+        self.accept_encoding = accept_encoding
+        self.in_flight = in_flight
+        self.semaphore = asyncio.Semaphore(limit)
+        # Idle connections by (host, port, TLS)
+        self.idle = {}
+        self.ssl_context = None
+
+    def __repr__(self):
+        return f'AsyncTransport(limit={self.limit}, keep_alive={self.keep_alive})'
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _connect(self, host: str, port: int, tls: bool):
+        if tls and self.ssl_context is None:
+            self.ssl_context = ssl.create_default_context()
+
+        return await asyncio.wait_for(asyncio.open_connection(host, port, ssl=self.ssl_context if tls else None),
+                                      self.timeout)
+
+    @staticmethod
+    async def _read_response(reader: asyncio.StreamReader, status_line: bytes, method: str):
+        version, status, *_ = status_line.decode('latin-1').split(' ', 2)
+        status = int(status)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        if method == 'HEAD' or status in (204, 304) or status < 200:
+            content = b''
+        elif 'chunked' in headers.get('transfer-encoding', ''):
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if not size:
+                    # Skip the trailers
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            content = b''.join(chunks)
+        elif 'content-length' in headers:
+            content = await reader.readexactly(int(headers['content-length']))
+        else:
+            content = await reader.read()
+            keep_alive = False
+
+        return status, headers, content, keep_alive
+
+    async def request(self, method: str, url: str, headers: dict = None, json: object = None, data: dict = None,
+                      stream: bool = False) -> AsyncResponse:
+        """Send a request and read the whole response, also when streaming is asked for."""
+        parts = urlsplit(url)
+        tls = parts.scheme == 'https'
+        key = (parts.hostname, parts.port or (443 if tls else 80), tls)
+        target = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+
+        body = b''
+        fields = {'Host': parts.netloc, 'Accept-Encoding': self.accept_encoding,
+                  'Connection': 'keep-alive' if self.keep_alive else 'close'}
+        if json is not None:
+            body = dumps(json).encode()
+            fields['Content-Type'] = 'application/json'
+        elif data is not None:
+            body = urlencode(data).encode()
+            fields['Content-Type'] = 'application/x-www-form-urlencoded'
+        # Given headers replace the defaults, whatever their case
+        for name, value in (headers or {}).items():
+            fields = {k: v for k, v in fields.items() if k.lower() != name.lower()}
+            fields[name] = value
+        fields['Content-Length'] = str(len(body))
+        head = f'{method} {target} HTTP/1.1\r\n' + ''.join(f'{k}: {v}\r\n' for k, v in fields.items()) + '\r\n'
+
+        async with self.semaphore:
+            if self.in_flight:
+                self.in_flight(1)
+            try:
+                # A pooled connection may have been closed by the server, then the request is sent again on a new one
+                for attempt in range(2):
+                    started = perf_counter()
+                    reused = bool(self.idle.get(key))
+                    reader, writer = self.idle[key].pop() if reused else await self._connect(*key)
+                    connected = perf_counter()
+                    try:
+                        writer.write(head.encode('latin-1') + body)
+                        status_line = await asyncio.wait_for(reader.readline(), self.timeout)
+                        if not status_line:
+                            raise ConnectionResetError('Connection closed by the server')
+                        first_byte = perf_counter()
+                        status, response_headers, content, keep_alive = await asyncio.wait_for(
+                            self._read_response(reader, status_line, method), self.timeout)
+                    except asyncio.TimeoutError:
+                        # The connection may still get the late response, so it cannot be reused
+                        writer.close()
+                        raise
+                    except (ConnectionError, asyncio.IncompleteReadError):
+                        writer.close()
+                        if reused and not attempt:
+                            continue
+                        raise
+                    break
+            finally:
+                if self.in_flight:
+                    self.in_flight(-1)
+
+            if keep_alive and self.keep_alive:
+                self.idle.setdefault(key, []).append((reader, writer))
+            else:
+                writer.close()
+
+        downloaded = perf_counter()
+        decoder = Decoder(response_headers.get('content-encoding'))
+        decoded = decoder.decompress(content) + decoder.flush()
+        response = AsyncResponse(status, response_headers, decoded, {
+            'connect': connected - started,
+            'ttfb': first_byte - connected,
+            'download': downloaded - first_byte,
+            'decompress': perf_counter() - downloaded,
+        }, {'request': len(body), 'response': len(content), 'decoded': len(decoded)})
+        if self.on_response:
+            self.on_response(method, url, {'headers': headers, 'json': json, 'data': data}, response)
+
+        return response
+
+    async def close(self):
+        for connections in self.idle.values():
+            for _, writer in connections:
+                writer.close()
+        self.idle.clear()
+
+
+async def send_requests_async(requests: List[Request], transport: AsyncTransport, concurrent_probes: bool = False):
+    """Send the requests yielded by a step, with the authorization tests alongside the request when asked to."""
+
+    async def send(request: Request):
+        request.started = perf_counter()
+        request.response = await transport.request(request.method, request.url, **request.kwargs)
+        request.seconds = perf_counter() - request.started
+
+    if concurrent_probes:
+        await asyncio.gather(*map(send, requests))
+        return
+
+    for probe in requests[1:]:
+        await send(probe)
+    await send(requests[0])
+
+
+async def run_step_async(func: Callable[[], Generator], transport: AsyncTransport, concurrent_probes: bool = False):
+    """Run a step of test_everything, sending the requests it yields with the async transport."""
+    step = func()
+    if not isinstance(step, Generator):
+        return step
+
+    try:
+        requests = next(step)
+        while True:
+            await send_requests_async(requests, transport, concurrent_probes)
+            requests = step.send(None)
+    except StopIteration as e:
+        return e.value
+
+
+async def test_everything_async(url: str, transport: AsyncTransport, logging: bool = False, workers: int = 1,
+                                observers: Iterable[Observer] = (), only: Iterable[str] = (),
+                                skip: Iterable[str] = (), fixtures: dict = None) -> TestStats:
+    """Perform all tests like test_everything, on the running event loop.
+
+    With more than one worker, the independent steps of the run and the
+    authorization tests of every request are sent at the same time.
+    """
+    stats = TestStats()
+    scenario = build_scenario(url, stats, logging, observers, fixtures,
+                              share_resources=fixtures is not None and shares_resources(only, skip))
+    steps, done = select_steps(scenario, only, skip, fixtures)
+    completed = set()
+    with observed_run(stats, observers, scenario, done, completed):
+        await scenario.run_async(partial(run_step_async, transport=transport, concurrent_probes=workers > 1),
+                                 workers, steps, completed)
+
+    return stats
+
+
+def run_async_users(url: str, users: int, runs_per_user: int = 1, limit: int = 100, keep_alive: bool = True,
+                    on_response: Callable = None, accept_encoding: str = 'identity',
+                    in_flight: Callable[[int], None] = None, timeout: float = 30, **options) -> LoadResult:
+    """Run the complete test as users virtual users at the same time on one event loop.
+
+    Every virtual user runs the test runs_per_user times in a row, and all
+    users start together. At most limit requests are in flight at the same
+    time, and every request times out as described in AsyncTransport. The
+    options are passed on to test_everything_async.
+    """
+
+    async def run() -> LoadResult:
+        result = LoadResult(concurrency=users)
+        async with AsyncTransport(limit, keep_alive, on_response, accept_encoding, in_flight, timeout) as transport:
+            async def virtual_user():
+                for _ in range(runs_per_user):
+                    result.add(await test_everything_async(url, transport, **options))
+
+            started = datetime.now()
+            await asyncio.gather(*(virtual_user() for _ in range(users)))
+            result.elapsed_seconds = (datetime.now() - started).total_seconds()
+
+        return result
+
+    return asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare running the complete test as virtual users on an asyncio '
+                                                 'event loop and on threads.')
+    parser.add_argument('url', nargs='?', help='The base URL of the API, or a local fake API when not given.')
+    parser.add_argument('--users', type=lambda s: [int(users) for users in s.split(',')], default=[10, 100, 1000],
+                        help='Comma separated numbers of virtual users to compare at.')
+    parser.add_argument('--runs', type=int, default=1, help='Number of runs per virtual user.')
+    parser.add_argument('--limit', type=int, default=100,
+                        help='Maximum number of requests in flight, and of pooled connections for threads.')
+    parser.add_argument('--max-threads', type=int, default=1000,
+                        help='Largest number of virtual users to run on threads.')
+    args = parser.parse_args()
+
+    url = args.url or start_server().url
+    print(f'Comparing asyncio and threaded virtual users with {args.runs} runs each on {url}')
+    print(f'\t{"engine":<10}{"users":>8}{"runs/sec":>12}{"requests/sec":>15}{"median run":>13}{"max run":>10}')
+    for users in args.users:
+        results = [('asyncio', run_async_users(url, users, args.runs, args.limit))]
+        if users <= args.max_threads:
+            with Transport(pool_size=args.limit) as transport:
+                results.append(('threads', run_concurrent(url, users, runs_per_user=args.runs, transport=transport)))
+
+        for engine, result in results:
+            print(f'\t{engine:<10}{users:>8}{result.scenarios_per_second:>12.2f}{result.requests_per_second:>15.2f}'
+                  f'{statistics.median(result.run_seconds):>13.2f}{max(result.run_seconds):>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
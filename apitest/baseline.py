@@ -0,0 +1,101 @@
+"""Saving latency baselines and comparing later runs against them."""
+import json
+import math
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List
+
+from apitest.histogram import Histogram
+from apitest.test import TestStats
+
+
+def baseline_path(directory: str, name: str) -> str:
+    return os.path.join(directory, f'{name}.json')
+
+
+def save_baseline(directory: str, name: str, stats: TestStats, url: str = None):
+    """Save the latency histograms of the stats as a named baseline."""
+    os.makedirs(directory, exist_ok=True)
+    with open(baseline_path(directory, name), 'w', encoding='utf-8') as f:
+        json.dump({'name': name, 'created': datetime.now().isoformat(), 'url': url, 'stats': stats.to_dict()}, f)
+
+
+def load_baseline(directory: str, name: str) -> TestStats:
+    with open(baseline_path(directory, name), encoding='utf-8') as f:
+        return TestStats.from_dict(json.load(f)['stats'])
+
+
+def mann_whitney(baseline: Histogram, current: Histogram) -> float:
+    """One-sided Mann-Whitney U test of whether current is slower than baseline.
+
+    Values in the same histogram bucket are treated as ties. Returns the
+    p-value from the normal approximation with tie correction.
+    """
+    n1, n2 = baseline.count, current.count
+    n = n1 + n2
+    if not n1 or not n2:
+        return 1.0
+
+    baseline_counts = dict(baseline.buckets())
+    current_counts = dict(current.buckets())
+    rank = 0
+    rank_sum = 0
+    ties = 0
+    for value in sorted(set(baseline_counts) | set(current_counts)):
+        tied = baseline_counts.get(value, 0) + current_counts.get(value, 0)
+        rank_sum += current_counts.get(value, 0) * (rank + (tied + 1) / 2)
+        rank += tied
+        ties += tied ** 3 - tied
+
+    u = rank_sum - n2 * (n2 + 1) / 2
+    variance = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1) if n > 1 else 1))
+    if variance <= 0:
+        return 1.0
+
+    z = (u - n1 * n2 / 2) / math.sqrt(variance)
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+@dataclass
+class Comparison:
+    method: str
+    endpoint: str
+    baseline: Histogram
+    current: Histogram
+    p_value: float
+    threshold: float
+    significance: float
+
+    @staticmethod
+    def _change(baseline: int, current: int) -> float:
+        return (current - baseline) / baseline if baseline else 0
+
+    @property
+    def p50_change(self) -> float:
+        return self._change(self.baseline.value_at_quantile(0.5), self.current.value_at_quantile(0.5))
+
+    @property
+    def p99_change(self) -> float:
+        return self._change(self.baseline.value_at_quantile(0.99), self.current.value_at_quantile(0.99))
+
+    @property
+    def regressed(self) -> bool:
+        """Whether the endpoint is significantly slower, and p50 or p99 grew more than the threshold."""
+        return self.p_value < self.significance and max(self.p50_change, self.p99_change) > self.threshold
+
+
+def compare_to_baseline(baseline: TestStats, current: TestStats, threshold: float = 0.1,
+                        significance: float = 0.01) -> List[Comparison]:
+    """Compare the latency of every endpoint found in both the baseline and the current stats."""
+    baseline_endpoints = baseline.endpoint_latencies()
+    comparisons = []
+    for (method, template), histogram in sorted(current.endpoint_latencies().items()):
+        if (method, template) not in baseline_endpoints:
+            continue
+
+        baseline_histogram = baseline_endpoints[method, template]
+        comparisons.append(Comparison(method, template, baseline_histogram, histogram,
+                                      mann_whitney(baseline_histogram, histogram), threshold, significance))
+
+    return comparisons
@@ -0,0 +1,143 @@
+"""Latency budgets per endpoint that a test has to stay within.
+
+A budget file is JSON with a list of budgets, such as:
+
+    {"budgets": [
+        {"endpoint": "GET /posts/{id}", "quantile": "p99", "ms": 40},
+        {"endpoint": "POST /auth/token", "status": 200, "quantile": "p95", "ms": 150}
+    ]}
+
+Endpoints are templates as in the latency report. Without a status, the
+budget covers the requests of every expected status. Quantiles are pNN,
+such as p50 or p99.9, or max.
+"""
+import json
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import List, Optional
+
+from apitest.histogram import Histogram
+from apitest.test import TestStats, Observer
+
+
+@dataclass
+class Budget:
+    method: str
+    endpoint: str
+    quantile: str
+    ms: float
+    status: Optional[int] = None
+
+    def __str__(self):
+        status = f' {self.status}' if self.status else ''
+        return f'{self.method} {self.endpoint}{status} {self.quantile} < {self.ms:g} ms'
+
+    def value(self, histogram: Histogram) -> int:
+        """The value of the budgeted quantile of the histogram in microseconds."""
+        if self.quantile == 'max':
+            return histogram.max or 0
+
+        return histogram.value_at_quantile(float(self.quantile[1:]) / 100)
+
+    def histogram(self, stats: TestStats) -> Optional[Histogram]:
+        if self.status:
+            return stats.latencies.get((self.method, self.endpoint, self.status))
+
+        return stats.endpoint_latencies().get((self.method, self.endpoint))
+
+
+def load_budgets(path: str) -> List[Budget]:
+    with open(path, encoding='utf-8') as f:
+        budgets = json.load(f)['budgets']
+
+    result = []
+    for budget in budgets:
+        method, endpoint = budget['endpoint'].split(' ', 1)
+        quantile = budget['quantile']
+        if quantile != 'max' and not (quantile.startswith('p') and 0 < float(quantile[1:]) <= 100):
+            raise ValueError(f'{path}: invalid quantile {quantile}, use e.g. p50, p99.9 or max')
+        result.append(Budget(method.upper(), endpoint.rstrip('/'), quantile, budget['ms'], budget.get('status')))
+
+    return result
+
+
+@dataclass
+class BudgetCheck:
+    budget: Budget
+    # The latencies of the budgeted requests, of the worst window when checked by window
+    histogram: Histogram = field(default_factory=Histogram)
+    # The number of windows that went over the budget, out of all windows
+    breached_windows: int = 0
+    windows: int = 0
+
+    @property
+    def value_ms(self) -> float:
+        return self.budget.value(self.histogram) / 1000
+
+    @property
+    def breached(self) -> bool:
+        return self.breached_windows > 0
+
+    @property
+    def unmatched(self) -> bool:
+        """Whether no request was budgeted, e.g. because of a typo in the endpoint."""
+        return not self.histogram.count
+
+
+def check_budgets(budgets: List[Budget], stats: TestStats) -> List[BudgetCheck]:
+    """Check the budgets over all requests of the stats.
+
+    Budgets of endpoints without requests in the stats are not breached,
+    but unmatched.
+    """
+    checks = []
+    for budget in budgets:
+        histogram = budget.histogram(stats)
+        check = BudgetCheck(budget, windows=1)
+        if histogram:
+            check.histogram = histogram
+            check.breached_windows = int(budget.value(histogram) > budget.ms * 1000)
+        checks.append(check)
+
+    return checks
+
+
+class BudgetObserver(Observer):
+    """Checks the budgets over every window of consecutive completed runs.
+
+    Runs are counted in the order they complete, also when they run at the
+    same time. A last window with fewer runs is checked by finish().
+    """
+
+    def __init__(self, budgets: List[Budget], window: int):
+        self.budgets = budgets
+        self.window = window
+        self.checks = [BudgetCheck(budget) for budget in budgets]
+        self.current = TestStats()
+        self.runs = 0
+        self.lock = Lock()
+
+    def run(self, stats: TestStats, error: Exception = None):
+        with self.lock:
+            self.current.merge(stats)
+            self.runs += 1
+            if self.runs == self.window:
+                self._check_window()
+
+    def _check_window(self):
+        for check, window in zip(self.checks, check_budgets(self.budgets, self.current)):
+            check.windows += 1
+            check.breached_windows += window.breached_windows
+            # Keep the worst window
+            if window.histogram.count and (not check.histogram.count or window.value_ms > check.value_ms):
+                check.histogram = window.histogram
+
+        self.current = TestStats()
+        self.runs = 0
+
+    def finish(self) -> List[BudgetCheck]:
+        with self.lock:
+            if self.runs:
+                self._check_window()
+
+            return self.checks
@@ -0,0 +1,157 @@
+"""Stress testing votes on a single post or comment from many users at the same time."""
+import argparse
+import random
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from threading import Barrier, Lock
+from time import perf_counter
+from typing import List, Dict
+
+from apitest.histogram import Histogram
+from apitest.schemas import Comment
+from apitest.seed import Seeder
+from apitest.transport import Transport
+
+
+@dataclass
+class ContentionResult:
+    target: str
+    users: int
+    votes: int = 0
+    elapsed_seconds: float = 0
+    latency: Histogram = field(default_factory=Histogram)
+    expected: int = 0
+    actual: int = None
+    anomalies: List[str] = field(default_factory=list)
+
+    @property
+    def votes_per_second(self) -> float:
+        return self.votes / self.elapsed_seconds if self.elapsed_seconds else 0
+
+
+def vote_contention(seeder: Seeder, users: int = 200, votes_per_user: int = 5, target: str = 'post',
+                    seed: int = None) -> ContentionResult:
+    """Have every user vote on the same post or comment at the same time.
+
+    Every user sends votes_per_user random votes of -1, 0 or 1 in a row, so
+    users repeat and change their votes while other users are voting. The
+    expected total is the sum of the last vote of every user, and is
+    compared with the votes of the target afterwards. Every user then sends
+    its last vote once more, one user at a time, which must not change the
+    total.
+
+    The users, resub and post are created with the seeder, and deleted
+    again with seeder.delete_all().
+    """
+    rng = random.Random(seed)
+    created = seeder.create_users(users)
+    resub, = seeder.create_resubs(created, 1)
+    post, = seeder.create_posts([resub], created, 1)
+    path = f'/posts/{post.id}'
+    comment = None
+    if target == 'comment':
+        comment = Comment(author_username=created[0].username, parent_resub_name=resub.name, parent_post_id=post.id)
+        comment.id = seeder.request('POST', f'/posts/{post.id}/comments/', 201, username=comment.author_username,
+                                    json=comment.create).json()['id']
+        path = f'/comments/{comment.id}'
+
+    def current_votes() -> int:
+        if comment is None:
+            return seeder.request('GET', path, 200).json()['votes']
+
+        # Comments can only be read through their post
+        comments = seeder.request('GET', f'/posts/{post.id}/comments/', 200).json()
+        return next(c['votes'] for c in comments if c['id'] == comment.id)
+
+    plans: Dict[str, List[int]] = {user.username: [rng.choice((-1, 0, 1)) for _ in range(votes_per_user)]
+                                   for user in created}
+    result = ContentionResult(target=target, users=users,
+                              expected=sum(votes[-1] for votes in plans.values()))
+    lock = Lock()
+    barrier = Barrier(min(seeder.concurrency, users))
+
+    def vote(username: str, value: int, contended: bool = True) -> int:
+        """Send a vote, and count it in the result when sent while other users vote."""
+        started = perf_counter()
+        votes = seeder.request('PATCH', f'{path}/vote/{value}', 200, username=username).json()['votes']
+        with lock:
+            if contended:
+                result.latency.record(round((perf_counter() - started) * 1_000_000))
+                result.votes += 1
+            if abs(votes) > users:
+                result.anomalies.append(f'{username} voted {value} and got a total of {votes} votes from only '
+                                        f'{users} users')
+
+        return votes
+
+    def voter(i: int, username: str):
+        # The users that get a thread first start together, so the votes contend from the start
+        if i < barrier.parties:
+            barrier.wait()
+
+        for value in plans[username]:
+            vote(username, value)
+
+    started = perf_counter()
+    with ThreadPoolExecutor(max_workers=seeder.concurrency) as executor:
+        for future in [executor.submit(voter, i, username) for i, username in enumerate(plans)]:
+            future.result()
+    result.elapsed_seconds = perf_counter() - started
+
+    result.actual = current_votes()
+    if result.actual > result.expected:
+        result.anomalies.append(f'Double counted votes: expected {result.expected} votes, got {result.actual}')
+    elif result.actual < result.expected:
+        result.anomalies.append(f'Lost updates: expected {result.expected} votes, got {result.actual}')
+
+    # Repeating the last vote of a user must leave the total as it is
+    for username, votes in plans.items():
+        total = vote(username, votes[-1], contended=False)
+        if total != result.actual:
+            result.anomalies.append(f'{username} repeated the vote {votes[-1]} and the total changed from '
+                                    f'{result.actual} to {total}')
+            result.actual = total
+
+    return result
+
+
+def print_contention(result: ContentionResult):
+    print(f'Sent {result.votes} votes from {result.users} users on one {result.target} in '
+          f'{result.elapsed_seconds:.2f} seconds ({result.votes_per_second:.2f} votes/sec)')
+    print(f'Latency (ms): p50 {result.latency.value_at_quantile(0.5) / 1000:.2f}, '
+          f'p99 {result.latency.value_at_quantile(0.99) / 1000:.2f}, max {(result.latency.max or 0) / 1000:.2f}')
+    print(f'Expected {result.expected} votes, got {result.actual}')
+    if result.anomalies:
+        print(f'\n{len(result.anomalies)} anomalies:')
+        for anomaly in result.anomalies:
+            print(f'\t{anomaly}')
+    else:
+        print('No anomalies')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Have many users vote on the same post or comment at the same '
+                                                 'time, and check that no votes are lost or counted twice.')
+    parser.add_argument('url', help='The base URL of the API.')
+    parser.add_argument('--users', type=int, default=200, help='Number of users voting.')
+    parser.add_argument('--votes-per-user', type=int, default=5, help='Number of votes every user sends in a row.')
+    parser.add_argument('--target', choices=('post', 'comment'), default='post', help='What to vote on.')
+    parser.add_argument('--concurrency', type=int, default=64, help='Number of requests to send at the same time.')
+    parser.add_argument('--seed', type=int, help='Random seed for the votes.')
+    args = parser.parse_args()
+
+    with Transport(pool_size=args.concurrency) as transport:
+        seeder = Seeder(args.url, transport, concurrency=args.concurrency)
+        try:
+            result = vote_contention(seeder, args.users, args.votes_per_user, args.target, args.seed)
+        finally:
+            seeder.delete_all()
+
+    print_contention(result)
+    if result.anomalies:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+def endpoint_template(endpoint: str) -> str:
+    """Replace the resource identifiers in an endpoint with placeholders.
+
+    For example, /posts/12/vote/-1 becomes /posts/{id}/vote/{vote}. Trailing
+    slashes are removed, so both forms of an endpoint share a template.
+    """
+    parts = endpoint.rstrip('/').split('/')
+    for i in range(1, len(parts)):
+        previous = parts[i - 1]
+        if previous == 'users' and parts[i] != 'me':
+            parts[i] = '{username}'
+        elif previous == 'resubs':
+            parts[i] = '{name}'
+        elif previous in ('posts', 'comments'):
+            parts[i] = '{id}'
+        elif previous == 'vote':
+            parts[i] = '{vote}'
+
+    return '/'.join(parts) or '/'
@@ -0,0 +1,562 @@
+"""An in-memory stand-in for the Repost API.
+
+The fake implements every endpoint used by the complete test, and can either
+be served over HTTP or be used directly as a transport without any network
+access. It is meant for benchmarking and profiling the test client itself,
+not for verifying the real API.
+"""
+import argparse
+import gzip
+import json
+import re
+import secrets
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import perf_counter, sleep
+from urllib.parse import urlsplit, urlencode, parse_qsl
+from typing import Iterator
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class FakeError(Exception):
+    def __init__(self, status: int, detail: str):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+def _now() -> str:
+    return datetime.now().isoformat()
+
+
+class FakeRepost:
+    """In-memory implementation of the Repost API endpoints.
+
+    Every request can be delayed by a number of seconds to simulate the
+    latency of a remote API.
+    """
+
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.lock = Lock()
+        self.users = {}
+        self.passwords = {}
+        self.tokens = {}
+        self.resubs = {}
+        self.posts = {}
+        self.comments = {}
+        self.votes = {}
+        self.next_id = 1
+
+        self.routes = []
+        for method, pattern, handler in (
+                ('POST', r'/users', self.create_user),
+                ('GET', r'/users/me', self.get_current_user),
+                ('PATCH', r'/users/me', self.edit_current_user),
+                ('DELETE', r'/users/me', self.delete_current_user),
+                ('GET', r'/users/(?P<username>[^/]+)', self.get_user),
+                ('GET', r'/users/(?P<username>[^/]+)/resubs', self.get_user_resubs),
+                ('GET', r'/users/(?P<username>[^/]+)/posts', self.get_user_posts),
+                ('GET', r'/users/(?P<username>[^/]+)/comments', self.get_user_comments),
+                ('POST', r'/auth/token', self.login),
+                ('GET', r'/resubs', self.get_resubs),
+                ('POST', r'/resubs', self.create_resub),
+                ('GET', r'/resubs/(?P<name>[^/]+)', self.get_resub),
+                ('PATCH', r'/resubs/(?P<name>[^/]+)', self.edit_resub),
+                ('DELETE', r'/resubs/(?P<name>[^/]+)', self.delete_resub),
+                ('GET', r'/resubs/(?P<name>[^/]+)/posts', self.get_resub_posts),
+                ('POST', r'/resubs/(?P<name>[^/]+)/posts', self.create_post),
+                ('GET', r'/resubs/(?P<name>[^/]+)/posts/(?P<id>[^/]+)', self.get_resub_post),
+                ('GET', r'/resubs/(?P<name>[^/]+)/posts/(?P<id>[^/]+)/comments', self.get_resub_post_comments),
+                ('GET', r'/posts/(?P<id>[^/]+)', self.get_post),
+                ('PATCH', r'/posts/(?P<id>[^/]+)', self.edit_post),
+                ('DELETE', r'/posts/(?P<id>[^/]+)', self.delete_post),
+                ('PATCH', r'/posts/(?P<id>[^/]+)/vote/(?P<vote>[^/]+)', self.vote_post),
+                ('GET', r'/posts/(?P<id>[^/]+)/comments', self.get_post_comments),
+                ('POST', r'/posts/(?P<id>[^/]+)/comments', self.create_comment),
+                ('POST', r'/comments/(?P<id>[^/]+)', self.create_reply),
+                ('PATCH', r'/comments/(?P<id>[^/]+)', self.edit_comment),
+                ('DELETE', r'/comments/(?P<id>[^/]+)', self.delete_comment),
+                ('PATCH', r'/comments/(?P<id>[^/]+)/vote/(?P<vote>[^/]+)', self.vote_comment)):
+            self.routes.append((method, re.compile(f'/api{pattern}/?'), handler))
+
+    def handle(self, method: str, path: str, headers: dict, body: bytes) -> (int, bytes):
+        """Handle a request and return the status code and the encoded response."""
+        for route_method, pattern, handler in self.routes:
+            match = pattern.fullmatch(path)
+            if match and route_method == method:
+                break
+        else:
+            return 404, json.dumps({'detail': 'Not Found'}).encode()
+
+        if self.delay:
+            sleep(self.delay)
+
+        headers = {k.lower(): v for k, v in headers.items()}
+        with self.lock:
+            try:
+                status, obj = handler(headers=headers, body=body, **match.groupdict())
+            except FakeError as e:
+                status, obj = e.status, {'detail': e.detail}
+
+            # Encode while locked, as the objects may be changed by other requests
+            return status, b'' if obj is None else json.dumps(obj).encode()
+
+    # Helpers
+
+    def _authorize(self, headers: dict) -> str:
+        authorization = headers.get('authorization', '')
+        if not authorization.startswith('Bearer '):
+            raise FakeError(401, 'Not authenticated')
+
+        username = self.tokens.get(authorization[len('Bearer '):])
+        if username not in self.users:
+            raise FakeError(401, 'Could not validate credentials')
+
+        return username
+
+    @staticmethod
+    def _json(body: bytes, required: tuple = (), not_null: tuple = ()) -> dict:
+        try:
+            fields = json.loads(body or b'{}')
+        except ValueError:
+            raise FakeError(422, 'Invalid JSON')
+
+        if not isinstance(fields, dict):
+            raise FakeError(422, 'Expected an object')
+
+        for name in required:
+            if name not in fields:
+                raise FakeError(422, f'Field {name} is required')
+
+        for name in required + not_null:
+            if name in fields and fields[name] is None:
+                raise FakeError(422, f'Field {name} cannot be null')
+
+        return fields
+
+    def _get(self, collection: dict, key, name: str):
+        if collection is self.posts or collection is self.comments:
+            try:
+                key = int(key)
+            except ValueError:
+                raise FakeError(422, f'Invalid {name} id')
+
+        if key not in collection:
+            raise FakeError(404, f'{name} not found')
+
+        return collection[key]
+
+    def _id(self) -> int:
+        self.next_id += 1
+        return self.next_id - 1
+
+    @staticmethod
+    def _vote(vote: str) -> int:
+        try:
+            vote = int(vote)
+        except ValueError:
+            raise FakeError(422, 'Invalid vote')
+
+        if vote not in (-1, 0, 1):
+            raise FakeError(422, 'Vote must be -1, 0 or 1')
+
+        return vote
+
+    def _set_vote(self, kind: str, entity: dict, username: str, vote: int) -> dict:
+        votes = self.votes.setdefault((kind, entity['id']), {})
+        votes[username] = vote
+        entity['votes'] = sum(votes.values())
+        return entity
+
+    def _remove_comments(self, comment_ids: list):
+        """Remove comments along with every reply to them."""
+        removed = set()
+        pending = set(comment_ids)
+        while pending:
+            removed |= pending
+            pending = {c['id'] for c in self.comments.values()
+                       if c['parent_comment_id'] in pending and c['id'] not in removed}
+
+        for comment_id in removed:
+            self.comments.pop(comment_id, None)
+            self.votes.pop(('comment', comment_id), None)
+
+    def _remove_posts(self, post_ids: list):
+        """Remove posts along with all their comments."""
+        post_ids = set(post_ids)
+        for post_id in post_ids:
+            del self.posts[post_id]
+            self.votes.pop(('post', post_id), None)
+
+        self._remove_comments([c['id'] for c in self.comments.values() if c['parent_post_id'] in post_ids])
+
+    # Users
+
+    def create_user(self, headers, body):
+        fields = self._json(body, required=('username', 'password'))
+        if fields['username'] in self.users:
+            raise FakeError(400, 'Username is taken')
+
+        user = {'username': fields['username'], 'bio': None, 'avatar_url': None, 'created': _now()}
+        self.users[user['username']] = user
+        self.passwords[user['username']] = fields['password']
+        return 201, user
+
+    def get_current_user(self, headers, body):
+        return 200, self.users[self._authorize(headers)]
+
+    def edit_current_user(self, headers, body):
+        user = self.users[self._authorize(headers)]
+        fields = self._json(body)
+        for name in ('bio', 'avatar_url'):
+            if name in fields:
+                user[name] = fields[name]
+
+        return 200, user
+
+    def delete_current_user(self, headers, body):
+        username = self._authorize(headers)
+        for name in [name for name, resub in self.resubs.items() if resub['owner_username'] == username]:
+            self._delete_resub(name)
+        self._remove_posts([p['id'] for p in self.posts.values() if p['author_username'] == username])
+        self._remove_comments([c['id'] for c in self.comments.values() if c['author_username'] == username])
+
+        del self.users[username]
+        del self.passwords[username]
+        return 204, None
+
+    def get_user(self, headers, body, username):
+        return 200, self._get(self.users, username, 'User')
+
+    def get_user_resubs(self, headers, body, username):
+        self._get(self.users, username, 'User')
+        return 200, [r for r in self.resubs.values() if r['owner_username'] == username]
+
+    def get_user_posts(self, headers, body, username):
+        self._get(self.users, username, 'User')
+        return 200, [p for p in self.posts.values() if p['author_username'] == username]
+
+    def get_user_comments(self, headers, body, username):
+        self._get(self.users, username, 'User')
+        return 200, [c for c in self.comments.values() if c['author_username'] == username]
+
+    def login(self, headers, body):
+        fields = dict(parse_qsl(body.decode()))
+        username = fields.get('username')
+        if username not in self.users or self.passwords[username] != fields.get('password'):
+            raise FakeError(400, 'Incorrect username or password')
+
+        token = secrets.token_hex(16)
+        self.tokens[token] = username
+        return 200, {'access_token': token, 'token_type': 'bearer'}
+
+    # Resubs
+
+    def get_resubs(self, headers, body):
+        return 200, list(self.resubs.values())
+
+    def create_resub(self, headers, body):
+        username = self._authorize(headers)
+        fields = self._json(body, required=('name',))
+        if fields['name'] in self.resubs:
+            raise FakeError(400, 'Resub name is taken')
+
+        resub = {'name': fields['name'], 'description': fields.get('description'), 'owner_username': username,
+                 'created': _now()}
+        self.resubs[resub['name']] = resub
+        return 201, resub
+
+    def get_resub(self, headers, body, name):
+        return 200, self._get(self.resubs, name, 'Resub')
+
+    def edit_resub(self, headers, body, name):
+        username = self._authorize(headers)
+        fields = self._json(body, not_null=('new_owner_username',))
+        resub = self._get(self.resubs, name, 'Resub')
+        if resub['owner_username'] != username:
+            raise FakeError(403, 'Only the owner can edit the resub')
+
+        if 'new_owner_username' in fields:
+            resub['owner_username'] = self._get(self.users, fields['new_owner_username'], 'User')['username']
+        if 'description' in fields:
+            resub['description'] = fields['description']
+
+        return 200, resub
+
+    def _delete_resub(self, name: str):
+        del self.resubs[name]
+        self._remove_posts([p['id'] for p in self.posts.values() if p['parent_resub_name'] == name])
+
+    def delete_resub(self, headers, body, name):
+        username = self._authorize(headers)
+        if self._get(self.resubs, name, 'Resub')['owner_username'] != username:
+            raise FakeError(403, 'Only the owner can delete the resub')
+
+        self._delete_resub(name)
+        return 204, None
+
+    # Posts
+
+    def get_resub_posts(self, headers, body, name):
+        self._get(self.resubs, name, 'Resub')
+        return 200, [p for p in self.posts.values() if p['parent_resub_name'] == name]
+
+    def create_post(self, headers, body, name):
+        username = self._authorize(headers)
+        fields = self._json(body, required=('title',))
+        self._get(self.resubs, name, 'Resub')
+
+        post = {'id': self._id(), 'title': fields['title'], 'url': fields.get('url'),
+                'content': fields.get('content'), 'votes': 0, 'author_username': username,
+                'parent_resub_name': name, 'created': _now()}
+        self.posts[post['id']] = post
+        return 201, post
+
+    def _get_resub_post(self, name: str, post_id: str) -> dict:
+        self._get(self.resubs, name, 'Resub')
+        post = self._get(self.posts, post_id, 'Post')
+        if post['parent_resub_name'] != name:
+            raise FakeError(404, 'Post not found')
+
+        return post
+
+    def get_resub_post(self, headers, body, name, id):
+        return 200, self._get_resub_post(name, id)
+
+    def get_resub_post_comments(self, headers, body, name, id):
+        post = self._get_resub_post(name, id)
+        return 200, [c for c in self.comments.values() if c['parent_post_id'] == post['id']]
+
+    def get_post(self, headers, body, id):
+        return 200, self._get(self.posts, id, 'Post')
+
+    def edit_post(self, headers, body, id):
+        username = self._authorize(headers)
+        fields = self._json(body, not_null=('title',))
+        post = self._get(self.posts, id, 'Post')
+        if post['author_username'] != username:
+            raise FakeError(403, 'Only the author can edit the post')
+
+        for name in ('title', 'url', 'content'):
+            if name in fields:
+                post[name] = fields[name]
+
+        return 200, post
+
+    def delete_post(self, headers, body, id):
+        username = self._authorize(headers)
+        post = self._get(self.posts, id, 'Post')
+        if username not in (post['author_username'], self.resubs[post['parent_resub_name']]['owner_username']):
+            raise FakeError(403, 'Only the author or resub owner can delete the post')
+
+        self._remove_posts([post['id']])
+        return 204, None
+
+    def vote_post(self, headers, body, id, vote):
+        username = self._authorize(headers)
+        vote = self._vote(vote)
+        return 200, self._set_vote('post', self._get(self.posts, id, 'Post'), username, vote)
+
+    # Comments
+
+    def get_post_comments(self, headers, body, id):
+        post = self._get(self.posts, id, 'Post')
+        return 200, [c for c in self.comments.values() if c['parent_post_id'] == post['id']]
+
+    def _create_comment(self, username: str, body: bytes, post: dict, parent_comment_id: int = None):
+        fields = self._json(body, required=('content',))
+        comment = {'id': self._id(), 'content': fields['content'], 'votes': 0, 'author_username': username,
+                   'parent_resub_name': post['parent_resub_name'], 'parent_post_id': post['id'],
+                   'parent_comment_id': parent_comment_id, 'created': _now()}
+        self.comments[comment['id']] = comment
+        return 201, comment
+
+    def create_comment(self, headers, body, id):
+        username = self._authorize(headers)
+        return self._create_comment(username, body, self._get(self.posts, id, 'Post'))
+
+    def create_reply(self, headers, body, id):
+        username = self._authorize(headers)
+        parent = self._get(self.comments, id, 'Comment')
+        return self._create_comment(username, body, self.posts[parent['parent_post_id']], parent['id'])
+
+    def edit_comment(self, headers, body, id):
+        username = self._authorize(headers)
+        fields = self._json(body, required=('content',))
+        comment = self._get(self.comments, id, 'Comment')
+        if comment['author_username'] != username:
+            raise FakeError(403, 'Only the author can edit the comment')
+
+        comment['content'] = fields['content']
+        return 200, comment
+
+    def delete_comment(self, headers, body, id):
+        username = self._authorize(headers)
+        comment = self._get(self.comments, id, 'Comment')
+        if username not in (comment['author_username'],
+                            self.resubs[comment['parent_resub_name']]['owner_username']):
+            raise FakeError(403, 'Only the author or resub owner can delete the comment')
+
+        self._remove_comments([comment['id']])
+        return 204, None
+
+    def vote_comment(self, headers, body, id, vote):
+        username = self._authorize(headers)
+        vote = self._vote(vote)
+        return 200, self._set_vote('comment', self._get(self.comments, id, 'Comment'), username, vote)
+
+
+class FakeResponse:
+    """The subset of requests.Response used by the test."""
+
+    def __init__(self, status_code: int, content: bytes):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {'content-type': 'application/json', 'content-length': str(len(self.content))}
+
+    @property
+    def text(self) -> str:
+        return self.content.decode()
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size: int = 1) -> Iterator[bytes]:
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class FakeTransport:
+    """A transport that sends requests directly to a FakeRepost without any network access.
+
+    Request bodies and responses are still encoded and decoded, so the client
+    side cost of a request is the same as with a real transport.
+    """
+
+    def __init__(self, app: FakeRepost = None):
+        self.app = app or FakeRepost()
+
+    def __repr__(self):
+        return 'FakeTransport()'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def request(self, method: str, url: str, headers: dict = None, **kwargs) -> FakeResponse:
+        body = b''
+        if kwargs.get('json') is not None:
+            body = json.dumps(kwargs['json']).encode()
+        elif kwargs.get('data') is not None:
+            body = urlencode(kwargs['data']).encode()
+
+        started = perf_counter()
+        status, content = self.app.handle(method, urlsplit(url).path, headers or {}, body)
+        response = FakeResponse(status, content)
+        response.phases = {'connect': 0, 'ttfb': perf_counter() - started}
+        response.sizes = {'request': len(body), 'response': len(content), 'decoded': len(content)}
+        if not kwargs.get('stream'):
+            response.phases['download'] = 0
+
+        return response
+
+    def close(self):
+        pass
+
+
+class FakeRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    app: FakeRepost = None
+    # Compress responses of at least this many bytes when the client accepts it, or never when None
+    compress_min_size: int = None
+
+    def _content_encoding(self, content: bytes) -> str:
+        if self.compress_min_size is None or len(content) < self.compress_min_size:
+            return None
+
+        accepted = {coding.split(';')[0].strip().lower()
+                    for coding in self.headers.get('Accept-Encoding', '').split(',')}
+        if 'br' in accepted and brotli is not None:
+            return 'br'
+        if 'gzip' in accepted:
+            return 'gzip'
+
+        return None
+
+    def handle_request(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        status, content = self.app.handle(self.command, urlsplit(self.path).path, dict(self.headers), body)
+
+        self.send_response(status)
+        if content:
+            self.send_header('Content-Type', 'application/json')
+        encoding = self._content_encoding(content)
+        if encoding:
+            content = brotli.compress(content) if encoding == 'br' else gzip.compress(content)
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PATCH = do_DELETE = handle_request
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(host: str = '127.0.0.1', port: int = 0, app: FakeRepost = None,
+                 compress_min_size: int = None) -> ThreadingHTTPServer:
+    """Serve a FakeRepost over HTTP in a background thread.
+
+    With compress_min_size, responses of at least that many bytes are
+    compressed with gzip, or brotli when installed, if the client accepts it.
+    The base URL of the server is available as server.url. Call
+    server.shutdown() to stop it.
+    """
+    server = create_server(host, port, app, compress_min_size)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Thousands of virtual users may connect at the same time
+    request_queue_size = 1024
+
+
+def create_server(host: str, port: int, app: FakeRepost = None, compress_min_size: int = None) -> ThreadingHTTPServer:
+    handler = type('Handler', (FakeRequestHandler,), {'app': app or FakeRepost(),
+                                                      'compress_min_size': compress_min_size})
+    server = FakeServer((host, port), handler)
+    server.url = f'http://{server.server_address[0]}:{server.server_address[1]}'
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve an in-memory fake of the Repost API.')
+    parser.add_argument('--host', default='127.0.0.1', help='The address to serve on.')
+    parser.add_argument('--port', type=int, default=8000, help='The port to serve on.')
+    parser.add_argument('--delay', type=float, default=0, help='Seconds to delay every request.')
+    parser.add_argument('--compress', type=int, metavar='MIN_SIZE',
+                        help='Compress responses of at least this many bytes when the client accepts it.')
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port, FakeRepost(delay=args.delay), args.compress)
+    print(f'Serving fake Repost API on {server.url}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
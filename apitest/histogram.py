@@ -0,0 +1,118 @@
+from typing import Dict, Iterator, Tuple
+
+
+class Histogram:
+    """A mergeable log-linear histogram of non-negative integer values.
+
+    Values are counted in buckets in the style of HDR histograms: values
+    below 2 ** precision_bits are counted exactly, and larger values are
+    counted in buckets with a relative width of at most 2 ** (1 - precision_bits),
+    i.e. below 1% with the default precision. Only buckets in use are stored,
+    so the memory used is bounded by the range of values and not by the
+    number of recorded values.
+    """
+
+    def __init__(self, precision_bits: int = 8):
+        self.precision_bits = precision_bits
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def __repr__(self):
+        return f'Histogram(count={self.count}, min={self.min}, max={self.max})'
+
+    def _index(self, value: int) -> int:
+        shift = value.bit_length() - self.precision_bits
+        if shift <= 0:
+            return value
+
+        return shift * (1 << self.precision_bits - 1) + (value >> shift)
+
+    def _bounds(self, index: int) -> (int, int):
+        half = 1 << self.precision_bits - 1
+        if index < 2 * half:
+            return index, index
+
+        shift = index // half - 1
+        mantissa = index - shift * half
+        return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+    def record(self, value: int, count: int = 1):
+        value = int(value)
+        if value < 0:
+            raise ValueError(f'Histogram values must be non-negative, got {value}')
+
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other: 'Histogram'):
+        """Add all values recorded in another histogram to this one."""
+        if other.precision_bits != self.precision_bits:
+            raise ValueError('Cannot merge histograms with different precision')
+
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0
+
+    def value_at_quantile(self, quantile: float) -> int:
+        """Return the value at the given quantile (0 to 1) within the bucket precision."""
+        if not self.count:
+            return 0
+
+        rank = max(1, round(quantile * self.count))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                low, high = self._bounds(index)
+                return min(max((low + high) // 2, self.min), self.max)
+
+        return self.max
+
+    def buckets(self) -> Iterator[Tuple[int, int]]:
+        """Yield the (value, count) of every bucket in use in order of value.
+
+        The value of a bucket is the middle of its range.
+        """
+        for index in sorted(self.counts):
+            low, high = self._bounds(index)
+            yield (low + high) // 2, self.counts[index]
+
+    def to_dict(self) -> dict:
+        return {
+            'precision_bits': self.precision_bits,
+            'counts': self.counts,
+            'count': self.count,
+            'total': self.total,
+            'min': self.min,
+            'max': self.max
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'Histogram':
+        histogram = cls(d['precision_bits'])
+        # JSON object keys are always strings
+        histogram.counts = {int(index): count for index, count in d['counts'].items()}
+        histogram.count = d['count']
+        histogram.total = d['total']
+        histogram.min = d['min']
+        histogram.max = d['max']
+        return histogram
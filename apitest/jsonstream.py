@@ -0,0 +1,113 @@
+"""Incremental parsing of JSON array responses."""
+import codecs
+import json
+import re
+from typing import Iterable, Iterator, List
+
+_whitespace = re.compile(r'[ \t\n\r]*')
+_decoder = json.JSONDecoder()
+
+
+def iter_json_array(chunks: Iterable[bytes]) -> Iterator[object]:
+    """Yield the elements of a JSON array as the chunks of the document arrive.
+
+    Only the element being parsed is kept in memory, so the memory used does
+    not depend on the length of the array.
+    """
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer = ''
+    pos = 0
+    started = False
+    expect_element = True
+    done = False
+    after_comma = False
+
+    def more() -> bool:
+        nonlocal buffer, pos
+        for chunk in chunks:
+            buffer = buffer[pos:] + utf8.decode(chunk)
+            pos = 0
+            return True
+
+        buffer = buffer[pos:] + utf8.decode(b'', final=True)
+        pos = 0
+        return False
+
+    while True:
+        pos = _whitespace.match(buffer, pos).end()
+        if pos == len(buffer):
+            if not more():
+                break
+            continue
+
+        if done:
+            raise ValueError('Unexpected data after the end of the JSON array')
+
+        if not started:
+            if buffer[pos] != '[':
+                raise ValueError('Expected a JSON array')
+            started = True
+            pos += 1
+            continue
+
+        if buffer[pos] == ']':
+            if expect_element and after_comma:
+                raise ValueError('Unexpected ] after , in JSON array')
+            done = True
+            pos += 1
+            continue
+
+        if not expect_element:
+            if buffer[pos] != ',':
+                raise ValueError(f'Expected , or ] in JSON array, got {buffer[pos]!r}')
+            expect_element = True
+            after_comma = True
+            pos += 1
+            continue
+
+        # An element that is not followed by , or ] may be incomplete (e.g. a
+        # number split between chunks), so it is parsed again with more data
+        try:
+            element, end = _decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            end = None
+        after = end if end is None else _whitespace.match(buffer, end).end()
+        if end is None or after == len(buffer) or buffer[after] not in ',]':
+            if more():
+                continue
+            if end is None:
+                raise ValueError('Incomplete JSON array')
+
+        yield element
+        pos = end
+        expect_element = False
+        after_comma = False
+
+    if not done:
+        raise ValueError('Incomplete JSON array')
+
+
+def find_models(chunks: Iterable[bytes], models: list) -> List[bool]:
+    """Return whether every model is found in a JSON array of objects.
+
+    The models are indexed by their index_key once, so every element of the
+    array is only compared to the models with the same key, and elements are
+    discarded as soon as they are checked.
+    """
+    index = {}
+    for i, model in enumerate(models):
+        index.setdefault((model.index_key, getattr(model, model.index_key)), []).append(i)
+
+    keys = {key for key, _ in index}
+    found = [False] * len(models)
+    for element in iter_json_array(chunks):
+        if not isinstance(element, dict):
+            continue
+
+        for key in keys:
+            for i in index.get((key, element.get(key)), ()):
+                if not found[i] and models[i].compare(element):
+                    found[i] = True
+
+    return found
@@ -0,0 +1,362 @@
+import multiprocessing
+import statistics
+import traceback
+from queue import Empty
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from threading import Barrier, Lock
+from time import perf_counter, sleep, time
+from typing import List, Dict, Callable, Iterable
+
+from apitest.histogram import Histogram
+from apitest.test import TestStats, Observer, test_everything
+from apitest.transport import TRANSPORT_ERRORS, Transport
+
+
+@dataclass
+class LoadResult:
+    concurrency: int
+    elapsed_seconds: float = 0
+    run_seconds: List[float] = field(default_factory=list)
+    total: TestStats = field(default_factory=TestStats)
+
+    def add(self, stats: TestStats):
+        """Merge the stats of a completed run into the result."""
+        self.run_seconds.append(stats.elapsed_seconds)
+        self.total.merge(stats)
+
+    @property
+    def scenarios_per_second(self) -> float:
+        return len(self.run_seconds) / self.elapsed_seconds
+
+    @property
+    def requests_per_second(self) -> float:
+        return self.total.count / self.elapsed_seconds
+
+    @property
+    def mean_run_seconds(self) -> float:
+        return statistics.mean(self.run_seconds)
+
+
+def run_concurrent(url: str, concurrency: int, runs_per_user: int = 1, **options) -> LoadResult:
+    """Run the complete test as concurrency virtual users at the same time.
+
+    Every virtual user runs the test runs_per_user times in a row, and all
+    users start together. Each run keeps its own TestStats, which are
+    merged into the returned LoadResult. The options are passed on to
+    test_everything.
+    """
+    result = LoadResult(concurrency=concurrency)
+    barrier = Barrier(concurrency + 1)
+
+    def virtual_user():
+        barrier.wait()
+        return [test_everything(url, logging=False, **options) for _ in range(runs_per_user)]
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(virtual_user) for _ in range(concurrency)]
+        barrier.wait()
+        started = datetime.now()
+
+        for future in futures:
+            for stats in future.result():
+                result.add(stats)
+
+        result.elapsed_seconds = (datetime.now() - started).total_seconds()
+
+    return result
+
+
+def find_degradation(results: List[LoadResult], min_gain: float = 0.1) -> LoadResult:
+    """Return the first ramp step where throughput stopped scaling.
+
+    A step is degraded when its requests per second grew by less than
+    min_gain times the relative increase in users, e.g. doubling the users
+    with min_gain 0.1 must give at least 10% more requests per second.
+    Returns None if every step scaled.
+    """
+    for previous, current in zip(results, results[1:]):
+        user_ratio = current.concurrency / previous.concurrency
+        gain = current.requests_per_second / previous.requests_per_second
+        if gain - 1 < min_gain * (user_ratio - 1):
+            return current
+
+    return None
+
+
+class Pacer:
+    """Hands out send times at a constant rate for a fixed duration."""
+
+    def __init__(self, rate: float, duration: float):
+        self.interval = 1 / rate
+        self.duration = duration
+        self.started = None
+        self.sent = 0
+        self.lock = Lock()
+
+    def start(self):
+        self.started = perf_counter()
+
+    @property
+    def finished(self) -> bool:
+        return perf_counter() >= self.started + self.duration
+
+    def next_send_time(self) -> float:
+        """Return the perf_counter time of the next request, or None when the duration has passed."""
+        with self.lock:
+            planned = self.started + self.sent * self.interval
+            if planned >= self.started + self.duration:
+                return None
+
+            self.sent += 1
+            return planned
+
+
+class PacedTransport:
+    """Wraps a transport so requests are sent at the times given by a pacer.
+
+    Latency is measured from the planned send time rather than the actual
+    one. When no virtual user is ready to send a request at its planned time,
+    the time spent waiting for one counts towards the latency, which corrects
+    for coordinated omission. How late requests were sent is recorded as lag.
+    The planned send time is kept in response.planned, so the test measures
+    and records the latencies from it, by expected status like in every
+    other mode.
+    """
+
+    def __init__(self, transport, pacer: Pacer, url: str, late_seconds: float = 0.001,
+                 observers: Iterable[Observer] = ()):
+        self.transport = transport
+        self.pacer = pacer
+        self.url = url
+        self.late_seconds = late_seconds
+        self.observers = observers
+        self.sent = 0
+        self.lag = Histogram()
+        self.late = 0
+        self.lock = Lock()
+
+    def request(self, method: str, url: str, **kwargs):
+        planned = self.pacer.next_send_time()
+        if planned is None:
+            # Requests of runs still in progress after the duration are not paced
+            return self.transport.request(method, url, **kwargs)
+
+        lag = perf_counter() - planned
+        if lag < 0:
+            sleep(-lag)
+
+        with self.lock:
+            self.sent += 1
+            self.lag.record(round(max(lag, 0) * 1_000_000))
+            if lag > self.late_seconds:
+                self.late += 1
+        for observer in self.observers:
+            observer.lag(max(lag, 0))
+
+        response = self.transport.request(method, url, **kwargs)
+        response.planned = planned
+        return response
+
+
+class RunStats(Observer):
+    """Merges the stats of every run, whether it passed or failed."""
+
+    def __init__(self):
+        self.stats = TestStats()
+        self.lock = Lock()
+
+    def run(self, stats: TestStats, error: Exception = None):
+        with self.lock:
+            self.stats.merge(stats)
+
+
+@dataclass
+class OpenLoopResult:
+    rate: float
+    users: int
+    elapsed_seconds: float = 0
+    runs: LoadResult = None
+    failed_runs: int = 0
+    # Failed runs by the name of the error, such as AssertionError or ReadTimeout
+    errors: Dict[str, int] = field(default_factory=dict)
+    paced: PacedTransport = None
+    # The requests of every run, passed or failed
+    stats: TestStats = None
+
+    @property
+    def requests_per_second(self) -> float:
+        return self.paced.sent / self.elapsed_seconds
+
+
+def run_open_loop(url: str, rate: float, duration: float, users: int, transport: Transport,
+                  **options) -> OpenLoopResult:
+    """Send the requests of the complete test at a constant rate.
+
+    The given number of virtual users run the test over and over, but every
+    request waits for the next send time of a shared Pacer, so requests are
+    started at the given rate whether or not earlier requests have finished.
+    Enough users are needed for one to always be ready to send a request;
+    otherwise requests are sent late, which shows up as lag.
+
+    Runs that fail, on an assertion or on an error of the transport such as
+    a timeout, are counted and the virtual user starts a new run. No new runs
+    are started after the duration, and the runs in progress are completed
+    without pacing. The options are passed on to test_everything.
+    """
+    pacer = Pacer(rate, duration)
+    paced = PacedTransport(transport, pacer, url, observers=options.get('observers', ()))
+    run_stats = RunStats()
+    options = dict(options, observers=[*options.get('observers', ()), run_stats])
+    result = OpenLoopResult(rate=rate, users=users, runs=LoadResult(concurrency=users), paced=paced,
+                            stats=run_stats.stats)
+    lock = Lock()
+
+    def virtual_user():
+        while not pacer.finished:
+            try:
+                stats = test_everything(url, logging=False, transport=paced, **options)
+            except (AssertionError, *TRANSPORT_ERRORS) as e:
+                with lock:
+                    result.failed_runs += 1
+                    result.errors[type(e).__name__] = result.errors.get(type(e).__name__, 0) + 1
+                continue
+
+            with lock:
+                result.runs.add(stats)
+
+    pacer.start()
+    with ThreadPoolExecutor(max_workers=users) as executor:
+        futures = [executor.submit(virtual_user) for _ in range(users)]
+        for future in futures:
+            future.result()
+
+    result.elapsed_seconds = duration
+    result.runs.elapsed_seconds = perf_counter() - pacer.started
+    return result
+
+
+@dataclass
+class ProcessLoadResult(LoadResult):
+    processes: int = 1
+    failed_runs: int = 0
+    runs_by_process: Dict[int, int] = field(default_factory=dict)
+
+
+def _process_worker(index: int, url: str, users: range, total_users: int, runs_per_user: int, duration: float,
+                    ramp_seconds: float, transport_factory: Callable[[], Transport], options: dict,
+                    start: multiprocessing.Event, start_time: multiprocessing.Value, stop: multiprocessing.Event,
+                    queue: multiprocessing.Queue):
+    """Run the virtual users of one process, and put every run on the queue as it completes."""
+    try:
+        transport = transport_factory()
+        queue.put(('ready', index, None))
+        start.wait()
+        started = start_time.value
+        deadline = started + duration if duration else None
+
+        def virtual_user(user: int):
+            # Users start evenly spread over the ramp, counted over all processes
+            sleep(max(started + ramp_seconds * user / total_users - time(), 0))
+            runs = 0
+            while runs_per_user is None or runs < runs_per_user:
+                if stop.is_set() or (deadline is not None and time() >= deadline):
+                    return
+
+                try:
+                    stats = test_everything(url, logging=False, transport=transport, **options)
+                except AssertionError as e:
+                    queue.put(('failed', index, str(e)))
+                else:
+                    queue.put(('run', index, stats.to_dict()))
+                runs += 1
+
+        with transport, ThreadPoolExecutor(max_workers=len(users)) as executor:
+            for future in [executor.submit(virtual_user, user) for user in users]:
+                future.result()
+    except BaseException:
+        queue.put(('error', index, traceback.format_exc()))
+        raise
+
+    queue.put(('done', index, None))
+
+
+def run_processes(url: str, processes: int, concurrency: int, runs_per_user: int = 1, duration: float = None,
+                  ramp_seconds: float = 0, transport_factory: Callable[[], Transport] = Transport,
+                  observers: Iterable[Observer] = (), **options) -> ProcessLoadResult:
+    """Run concurrency virtual users of the complete test spread over multiple processes.
+
+    Every process creates its own transport with transport_factory, so each
+    has its own connection pool and interpreter lock. All processes start
+    at the same time, and the users are started evenly over ramp_seconds.
+    Every user runs the test runs_per_user times, or until duration seconds
+    have passed when runs_per_user is None.
+
+    The stats of every run are sent to this process as the run completes,
+    merged into the result and passed on to the observers. Only completed
+    runs are sent, so observers do not receive single requests. The options
+    are passed on to test_everything, and must be picklable.
+    """
+    processes = min(processes, concurrency)
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    start, stop = context.Event(), context.Event()
+    start_time = context.Value('d', 0)
+    result = ProcessLoadResult(concurrency=concurrency, processes=processes,
+                               runs_by_process={index: 0 for index in range(processes)})
+
+    children = []
+    for index in range(processes):
+        users = range(index * concurrency // processes, (index + 1) * concurrency // processes)
+        children.append(context.Process(
+            target=_process_worker, daemon=True,
+            args=(index, url, users, concurrency, runs_per_user, duration, ramp_seconds, transport_factory, options,
+                  start, start_time, stop, queue)))
+
+    for child in children:
+        child.start()
+
+    try:
+        running = processes
+        ready = 0
+        while running:
+            try:
+                kind, index, value = queue.get(timeout=1)
+            except Empty:
+                if any(child.exitcode not in (None, 0) for child in children):
+                    raise RuntimeError('A load process exited unexpectedly')
+                continue
+
+            if kind == 'ready':
+                ready += 1
+                if ready == processes:
+                    # Give every process time to see the start before the first user begins
+                    start_time.value = time() + 0.1
+                    start.set()
+            elif kind == 'run':
+                stats = TestStats.from_dict(value)
+                result.add(stats)
+                result.runs_by_process[index] += 1
+                for observer in observers:
+                    observer.run(stats)
+            elif kind == 'failed':
+                result.failed_runs += 1
+                for observer in observers:
+                    observer.run(TestStats(), error=AssertionError(value))
+            elif kind == 'done':
+                running -= 1
+            elif kind == 'error':
+                raise RuntimeError(f'Load process {index} failed:\n{value}')
+    finally:
+        stop.set()
+        start.set()
+        # Processes only exit once everything they put on the queue is read
+        while any(child.is_alive() for child in children):
+            try:
+                queue.get(timeout=0.1)
+            except Empty:
+                pass
+
+    result.elapsed_seconds = time() - start_time.value
+    return result
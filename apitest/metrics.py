@@ -0,0 +1,208 @@
+"""Live metrics of a running test, served over HTTP in the Prometheus text format.
+
+While the test runs, GET /metrics on the metrics server returns:
+
+* apitest_requests_total: requests by method, endpoint template and status
+* apitest_unexpected_responses_total: requests that did not have the expected status
+* apitest_request_duration_seconds: a latency histogram by method and endpoint template
+* apitest_requests_in_flight: requests sent but not yet answered
+* apitest_runs_total: completed runs by result, passed or failed
+* apitest_generator_lag_seconds: how late paced requests were sent, with --rps and replays at a rate
+
+The metrics start at zero when the test starts. Requests sent by other
+processes, with --processes, are counted from the stats of their runs as
+the runs complete, by expected status, so none of them count as unexpected.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Dict, Tuple, List
+
+from apitest.endpoints import endpoint_template
+from apitest.test import TestStats, Observer
+
+# Upper bounds of the histogram buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LAG_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Buckets:
+    """A Prometheus histogram: counts of observations up to every bound, their sum and their count."""
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float, count: int = 1):
+        for i, bound in enumerate(self.bounds):
+            if seconds <= bound:
+                self.counts[i] += count
+                break
+        self.sum += seconds * count
+        self.count += count
+
+    def lines(self, name: str, labels: str = '') -> List[str]:
+        separator = ',' if labels else ''
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{separator}le="{bound:g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}{separator}le="+Inf"}} {self.count}')
+        braces = f'{{{labels}}}' if labels else ''
+        lines.append(f'{name}_sum{braces} {self.sum:.6f}')
+        lines.append(f'{name}_count{braces} {self.count}')
+        return lines
+
+
+def _labels(**labels) -> str:
+    def escape(value) -> str:
+        return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+    return ','.join(f'{name}="{escape(value)}"' for name, value in labels.items())
+
+
+class MetricsObserver(Observer):
+    """Counts every request and run of the test for the metrics server."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.requests: Dict[Tuple[str, str, int], int] = {}
+        self.unexpected: Dict[Tuple[str, str], int] = {}
+        self.latencies: Dict[Tuple[str, str], Buckets] = {}
+        self.runs = {'passed': 0, 'failed': 0}
+        self.generator_lag = Buckets(LAG_BUCKETS)
+        self.in_flight = 0
+        # Whether requests are observed one by one, or only in the stats of runs
+        self.observed_requests = False
+
+    def request(self, method: str, endpoint: str, status: int, expected_status: int, seconds: float):
+        endpoint = endpoint_template(endpoint)
+        with self.lock:
+            self.observed_requests = True
+            key = (method, endpoint, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if status != expected_status:
+                self.unexpected[method, endpoint] = self.unexpected.get((method, endpoint), 0) + 1
+            self.latencies.setdefault((method, endpoint), Buckets(LATENCY_BUCKETS)).observe(seconds)
+
+    def run(self, stats: TestStats, error: Exception = None):
+        with self.lock:
+            self.runs['passed' if error is None else 'failed'] += 1
+            if self.observed_requests:
+                return
+
+            # The run was sent by another process, with latencies in microseconds
+            for (method, endpoint, status), histogram in stats.latencies.items():
+                self.requests[method, endpoint, status] = self.requests.get((method, endpoint, status), 0) + \
+                    histogram.count
+                buckets = self.latencies.setdefault((method, endpoint), Buckets(LATENCY_BUCKETS))
+                for value, count in histogram.buckets():
+                    buckets.observe(value / 1_000_000, count)
+
+    def lag(self, seconds: float):
+        with self.lock:
+            self.generator_lag.observe(seconds)
+
+    def sending(self, change: int):
+        """Count requests as in flight while they are sent, by 1 before and -1 after."""
+        with self.lock:
+            self.in_flight += change
+
+    def text(self) -> str:
+        """All metrics in the Prometheus text format."""
+        with self.lock:
+            lines = ['# HELP apitest_requests_total Requests sent by the test.',
+                     '# TYPE apitest_requests_total counter']
+            for (method, endpoint, status), count in sorted(self.requests.items()):
+                lines.append(f'apitest_requests_total{{{_labels(method=method, endpoint=endpoint, status=status)}}} '
+                             f'{count}')
+
+            lines += ['# HELP apitest_unexpected_responses_total Requests that did not have the expected status.',
+                      '# TYPE apitest_unexpected_responses_total counter']
+            for (method, endpoint), count in sorted(self.unexpected.items()):
+                lines.append(f'apitest_unexpected_responses_total{{{_labels(method=method, endpoint=endpoint)}}} '
+                             f'{count}')
+
+            lines += ['# HELP apitest_request_duration_seconds Latency of the requests sent by the test.',
+                      '# TYPE apitest_request_duration_seconds histogram']
+            for (method, endpoint), buckets in sorted(self.latencies.items()):
+                lines += buckets.lines('apitest_request_duration_seconds', _labels(method=method, endpoint=endpoint))
+
+            lines += ['# HELP apitest_requests_in_flight Requests sent but not yet answered.',
+                      '# TYPE apitest_requests_in_flight gauge',
+                      f'apitest_requests_in_flight {self.in_flight}',
+                      '# HELP apitest_runs_total Completed runs of the test.',
+                      '# TYPE apitest_runs_total counter']
+            for result, count in self.runs.items():
+                lines.append(f'apitest_runs_total{{{_labels(result=result)}}} {count}')
+
+            lines += ['# HELP apitest_generator_lag_seconds How late paced requests were sent after their planned '
+                      'time.',
+                      '# TYPE apitest_generator_lag_seconds histogram']
+            lines += self.generator_lag.lines('apitest_generator_lag_seconds')
+
+        return '\n'.join(lines) + '\n'
+
+
+class InFlightTransport:
+    """Wraps a transport to count its requests in flight for the metrics."""
+
+    def __init__(self, transport, metrics: MetricsObserver):
+        self.transport = transport
+        self.metrics = metrics
+
+    def __enter__(self):
+        self.transport.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.transport.__exit__(*exc_info)
+
+    def close(self):
+        self.transport.close()
+
+    def request(self, method: str, url: str, **kwargs):
+        self.metrics.sending(1)
+        try:
+            return self.transport.request(method, url, **kwargs)
+        finally:
+            self.metrics.sending(-1)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    metrics: MetricsObserver = None
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        body = self.metrics.text().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+def serve_metrics(metrics: MetricsObserver, host: str = '127.0.0.1', port: int = 0) -> MetricsServer:
+    """Serve the metrics at /metrics in a background thread.
+
+    The URL of the metrics is available as server.url. Call
+    server.shutdown() to stop it.
+    """
+    handler = type('Handler', (MetricsRequestHandler,), {'metrics': metrics})
+    server = MetricsServer((host, port), handler)
+    server.url = f'http://{server.server_address[0]}:{server.server_address[1]}/metrics'
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
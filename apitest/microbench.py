@@ -0,0 +1,73 @@
+"""Micro-benchmark of the schema models against plain dataclasses with reflective methods."""
+import argparse
+import tracemalloc
+from dataclasses import asdict, field, fields, make_dataclass
+from timeit import timeit
+
+from apitest.schemas import User, Resub, Post, Comment
+
+
+def _legacy_compare(self, json_object: dict, update: bool = False):
+    if update:
+        for k, v in self.update_fields.items():
+            setattr(self, k, json_object[v])
+
+    return all(v == json_object[k] for k, v in asdict(self).items() if k in json_object)
+
+
+def legacy_model(model: type) -> type:
+    """A plain dataclass with the fields of model, which compares using asdict on every call."""
+    return make_dataclass(f'Legacy{model.__name__}',
+                          [(f.name, f.type, field(default=f.default, default_factory=f.default_factory))
+                           for f in fields(model)],
+                          namespace={'compare': _legacy_compare, 'update_fields': {}})
+
+
+# Field values of every model, and an API response to compare the model with
+SAMPLES = {
+    User: dict(username='user', password='password', bio='bio', avatar_url=None),
+    Resub: dict(owner_username='user', name='resub', description='description'),
+    Post: dict(author_username='user', parent_resub_name='resub', title='title', url=None, content='content',
+               id=1, votes=3),
+    Comment: dict(author_username='user', parent_resub_name='resub', parent_post_id=1, parent_comment_id=None,
+                  content='content', id=2, votes=-1)
+}
+
+
+def bytes_per_object(model: type, kwargs: dict, count: int = 10000) -> float:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [model(**kwargs) for _ in range(count)]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del objects
+    return used / count
+
+
+def benchmark(model: type, kwargs: dict, number: int) -> dict:
+    response = {**{k: v for k, v in kwargs.items() if k != 'password'}, 'created': '2020-01-01T00:00:00'}
+    obj = model(**kwargs)
+    assert obj.compare(response)
+    return {
+        'created_per_second': number / timeit(lambda: model(**kwargs), number=number),
+        'compared_per_second': number / timeit(lambda: obj.compare(response), number=number),
+        'bytes_per_object': bytes_per_object(model, kwargs)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare creating and comparing the schema models with plain '
+                                                 'dataclasses that use asdict.')
+    parser.add_argument('--number', type=int, default=100000, help='Number of calls to time per benchmark.')
+    args = parser.parse_args()
+
+    print(f'{"model":<16}{"created/s":>14}{"compared/s":>14}{"bytes/object":>14}')
+    for model, kwargs in SAMPLES.items():
+        for cls in (legacy_model(model), model):
+            result = benchmark(cls, kwargs, args.number)
+            print(f'{cls.__name__:<16}{result["created_per_second"]:>14.0f}{result["compared_per_second"]:>14.0f}'
+                  f'{result["bytes_per_object"]:>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+"""Tracking every resource created by a test in a file, so resources left over by failed or aborted runs can be deleted.
+
+The registry is a JSON lines file that is only appended to, with one event
+per line:
+
+* create: a user with its password, a resub with its owner, or a post or
+  comment with its author and resub
+* owner: the new owner of a resub
+* delete: a resource that was deleted
+
+Every event holds the session that created the resource, so a test can
+delete what it left behind without touching resources of other tests
+running at the same time. Running this module deletes every resource still
+in the registry, from any session.
+
+After a test, the events of the resources it deleted are dropped from the
+registry, so it only grows with the resources that are left over.
+"""
+import argparse
+import json
+import os
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from threading import Lock
+from typing import Dict, Callable
+
+from apitest.schemas import User
+from apitest.transport import Transport
+
+# Resources are deleted in this order, so nothing is deleted before what belongs to it
+KINDS = ('comment', 'post', 'resub', 'user')
+_endpoints = {'comment': '/comments/{}', 'post': '/posts/{}', 'resub': '/resubs/{}', 'user': '/users/me'}
+
+
+class Registry:
+    """Appends events about resources of a session to a registry file.
+
+    Events are flushed as they are written, so the registry is complete
+    even when the process is killed.
+    """
+
+    def __init__(self, path: str, session: str = None):
+        self.path = path
+        self.session = session or f'{datetime.now():%Y%m%d%H%M%S}-{secrets.token_hex(4)}'
+        self.file = None
+        self.lock = Lock()
+
+    def _replaced(self) -> bool:
+        """Whether the open registry file has been replaced by compacting it in another process."""
+        try:
+            return os.stat(self.path).st_ino != os.fstat(self.file.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def _write(self, event: dict):
+        with self.lock:
+            if self.file is not None and self._replaced():
+                self.file.close()
+                self.file = None
+            if self.file is None:
+                self.file = open(self.path, 'a', encoding='utf-8')
+            self.file.write(json.dumps(event, separators=(',', ':')) + '\n')
+            self.file.flush()
+
+    def created(self, kind: str, key, **fields):
+        self._write({'op': 'create', 'session': self.session, 'kind': kind, 'key': key, **fields})
+
+    def changed_owner(self, name: str, owner: str):
+        self._write({'op': 'owner', 'session': self.session, 'kind': 'resub', 'key': name, 'owner': owner})
+
+    def deleted(self, kind: str, key, session: str = None):
+        self._write({'op': 'delete', 'session': session or self.session, 'kind': kind, 'key': key})
+
+    def events(self):
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                # The last line may be incomplete if a process was killed while writing it
+                if line.endswith('\n'):
+                    yield json.loads(line)
+
+    def live(self, session: str = None) -> Dict[str, Dict[object, dict]]:
+        """Return the create events of the resources that were not deleted, by kind and key.
+
+        Deleting a user, resub, post or comment also deletes everything that
+        belongs to it, as in the API. Only resources of the given session
+        are returned, or of every session if no session is given. The owner
+        of every resub is the last owner it was given.
+        """
+        created = {kind: {} for kind in KINDS}
+        deleted = {kind: set() for kind in KINDS}
+        for event in self.events():
+            kind, key = event['kind'], event['key']
+            if event['op'] == 'create':
+                created[kind][key] = event
+            elif event['op'] == 'delete':
+                deleted[kind].add(key)
+            elif event['op'] == 'owner' and key in created[kind]:
+                created[kind][key]['owner'] = event['owner']
+
+        users = {key: e for key, e in created['user'].items() if key not in deleted['user']}
+        resubs = {key: e for key, e in created['resub'].items()
+                  if key not in deleted['resub'] and e['owner'] not in deleted['user']}
+        posts = {key: e for key, e in created['post'].items()
+                 if key not in deleted['post'] and e['author'] not in deleted['user'] and e['resub'] in resubs}
+        comments = {}
+        # Replies are always created after the comment they reply to
+        for key, e in sorted(created['comment'].items()):
+            if key not in deleted['comment'] and e['author'] not in deleted['user'] and e['post'] in posts \
+                    and (e['parent'] is None or e['parent'] in comments):
+                comments[key] = e
+
+        resources = {'comment': comments, 'post': posts, 'resub': resubs, 'user': users}
+        if session:
+            resources = {kind: {key: e for key, e in events.items() if e['session'] == session}
+                         for kind, events in resources.items()}
+
+        return resources
+
+    def compact(self, session: str = None):
+        """Rewrite the registry with only the resources that were not deleted.
+
+        With a session, only the events of that session are rewritten, and
+        the events of other sessions are kept as they are. Registries of
+        other processes reopen the file when they next write to it, but an
+        event written at the very moment it is replaced may be lost.
+        """
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            if not os.path.exists(self.path):
+                return
+
+            # Start over when other processes append to the registry while it is rewritten
+            while True:
+                size = os.path.getsize(self.path)
+                kept = [event for event in self.events() if session and event['session'] != session]
+                live = [event for resources in self.live(session).values() for event in resources.values()]
+                with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+                    for event in kept + [dict(event, op='create') for event in live]:
+                        f.write(json.dumps(event, separators=(',', ':')) + '\n')
+                if os.path.getsize(self.path) == size:
+                    os.replace(self.path + '.tmp', self.path)
+                    return
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class RegistryTransport:
+    """Wraps a transport to register every resource created and deleted through it.
+
+    Resources are recognized by the responses of successful requests, so
+    this works for the test as well as the seeder and the benchmarks.
+    """
+
+    def __init__(self, transport, registry: Registry, url: str):
+        self.transport = transport
+        self.registry = registry
+        self.url = url
+        # The username by access token, to know who deleted themselves
+        self.tokens = {}
+        self.lock = Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def request(self, method: str, url: str, **kwargs):
+        response = self.transport.request(method, url, **kwargs)
+        self.register(method, url, kwargs, response)
+        return response
+
+    def register(self, method: str, url: str, kwargs: dict, response):
+        """Register what a request created or deleted from its response."""
+        status = response.status_code
+        # Only successful requests changing something can create or delete resources
+        if status not in (200, 201, 204) or method == 'GET':
+            return
+
+        path = url[len(f'{self.url}/api'):].rstrip('/')
+        parts = path.split('/')[1:]
+        if method == 'POST' and status == 201:
+            obj = response.json()
+            if path == '/users':
+                self.registry.created('user', obj['username'], password=kwargs['json']['password'])
+            elif path == '/resubs':
+                self.registry.created('resub', obj['name'], owner=obj['owner_username'])
+            elif 'parent_post_id' in obj:
+                self.registry.created('comment', obj['id'], author=obj['author_username'],
+                                      resub=obj['parent_resub_name'], post=obj['parent_post_id'],
+                                      parent=obj['parent_comment_id'])
+            else:
+                self.registry.created('post', obj['id'], author=obj['author_username'],
+                                      resub=obj['parent_resub_name'])
+        elif method == 'POST' and path == '/auth/token':
+            with self.lock:
+                self.tokens[response.json()['access_token']] = kwargs['data']['username']
+        elif method == 'PATCH' and parts[0] == 'resubs' and len(parts) == 2:
+            if (kwargs.get('json') or {}).get('new_owner_username'):
+                self.registry.changed_owner(parts[1], response.json()['owner_username'])
+        elif method == 'DELETE' and status == 204:
+            if path == '/users/me':
+                token = kwargs['headers']['Authorization'][len('Bearer '):]
+                with self.lock:
+                    username = self.tokens.pop(token, None)
+                    # Forget every other login of the deleted user too
+                    self.tokens = {t: u for t, u in self.tokens.items() if u != username}
+                if username is not None:
+                    self.registry.deleted('user', username)
+            elif len(parts) == 2:
+                kind = parts[0][:-1]
+                self.registry.deleted(kind, parts[1] if kind == 'resub' else int(parts[1]))
+
+    def close(self):
+        """Close the registry and the wrapped transport."""
+        self.registry.close()
+        self.transport.close()
+
+
+def registered_transport(transport_factory: Callable[..., Transport], path: str, url: str, session: str,
+                         **options) -> RegistryTransport:
+    """Create a transport registering resources in the given session, e.g. in another process.
+
+    The options are passed on to the transport factory.
+    """
+    return RegistryTransport(transport_factory(**options), Registry(path, session), url)
+
+
+def reap(url: str, transport: Transport, registry: Registry, session: str = None,
+         concurrency: int = 16) -> Dict[str, int]:
+    """Delete every resource left in the registry, and return the number of deleted resources by outcome.
+
+    Only resources of the given session are deleted, or of every session if
+    no session is given. Every kind of resource is deleted concurrently, one
+    kind after the other from comments to users. Posts and comments are
+    deleted by their author, or else by the owner of their resub.
+    Resources that no longer exist are counted as gone.
+    """
+    resources = registry.live(session)
+    every_session = registry.live() if session else resources
+    passwords = {e['key']: e['password'] for e in registry.events() if e['op'] == 'create' and e['kind'] == 'user'}
+    owners = {name: event['owner'] for name, event in every_session['resub'].items()}
+
+    def candidates(kind: str, key, event: dict) -> list:
+        if kind == 'user':
+            return [key]
+        if kind == 'resub':
+            return [event['owner']]
+
+        return [event['author'], owners.get(event['resub'])]
+
+    # Log in every user that may delete something
+    usernames = {username for kind in KINDS for key, event in resources[kind].items()
+                 for username in candidates(kind, key, event) if username in passwords}
+    tokens = {}
+
+    def login(username: str):
+        r = transport.request('POST', f'{url}/api/auth/token',
+                              data=User(username=username, password=passwords[username]).login)
+        if r.status_code == 200:
+            tokens[username] = r.json()['access_token']
+        elif r.status_code in (400, 401):
+            # The user no longer exists
+            tokens[username] = None
+
+    outcomes = {'deleted': 0, 'gone': 0, 'failed': 0}
+    lock = Lock()
+
+    def delete(kind: str, key, event: dict):
+        usernames = [username for username in candidates(kind, key, event) if username in tokens]
+        outcome = 'failed'
+        if usernames and all(tokens[username] is None for username in usernames):
+            # Deleted along with the users that could delete it
+            outcome = 'gone'
+            registry.deleted(kind, key, session=event['session'])
+
+        for username in usernames:
+            if tokens[username] is None:
+                continue
+
+            r = transport.request('DELETE', f'{url}/api' + _endpoints[kind].format(key),
+                                  headers={'Authorization': 'Bearer ' + tokens[username]})
+            if r.status_code in (204, 404):
+                outcome = 'deleted' if r.status_code == 204 else 'gone'
+                registry.deleted(kind, key, session=event['session'])
+                break
+
+        with lock:
+            outcomes[outcome] += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(login, usernames))
+        for kind in KINDS:
+            list(executor.map(lambda item: delete(kind, *item), resources[kind].items()))
+
+    return outcomes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Delete the resources left in a registry by failed or aborted '
+                                                 'test runs.')
+    parser.add_argument('url', help='The base URL of the API.')
+    parser.add_argument('--registry', default='.apitest-registry.jsonl', help='The registry file.')
+    parser.add_argument('--session', help='Only delete the resources of this session.')
+    parser.add_argument('--concurrency', type=int, default=16, help='Number of requests to send at the same time.')
+    args = parser.parse_args()
+
+    registry = Registry(args.registry)
+    left = sum(len(resources) for resources in registry.live(args.session).values())
+    print(f'Deleting {left} resources left in {args.registry}')
+    with Transport(pool_size=args.concurrency) as transport:
+        outcomes = reap(args.url, transport, registry, args.session, args.concurrency)
+    registry.compact()
+
+    print(f'Deleted {outcomes["deleted"]} resources, {outcomes["gone"]} were already gone, '
+          f'{outcomes["failed"]} could not be deleted')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+"""Recording the requests of test runs, and replaying them as load without the test logic.
+
+A recording is a JSON lines file. The first line describes the recording,
+and every other line is a request with the keys:
+
+* t: seconds since the start of the recording when the request was sent
+* m: the method
+* p: the path below /api
+* h: the headers, if any
+* j or d: the JSON or form body, if any
+* s: the status the test expected
+* x: values to save from the JSON response, as {field: variable}
+
+Values that differ between runs are replaced with ${variable} in paths,
+headers and bodies: the random strings of the models, the ids of created
+posts and comments, and access tokens. Every replay of the requests uses new
+random strings, and the ids and tokens returned by the API.
+"""
+import json
+import re
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from threading import Lock
+from time import perf_counter, sleep
+from typing import List, Iterable
+
+from apitest.load import Pacer
+from apitest.test import TestStats, Observer
+from apitest.transport import Transport
+
+# The random strings of the models are 16 hexadecimal characters
+_random_string = re.compile(r'\b[0-9a-f]{16}\b')
+_variable = re.compile(r'\$\{(\w+)}')
+
+
+class RecordingTransport:
+    """Wraps a transport to append every request and its expected status to a recording.
+
+    The expected status is taken from the status of the response, so only
+    passing runs should be recorded.
+    """
+
+    def __init__(self, transport, path: str, url: str):
+        self.transport = transport
+        self.url = url
+        self.file = open(path, 'w', encoding='utf-8')
+        self.lock = Lock()
+        self.started = perf_counter()
+        # Variable names by random string, by access token and by (collection, id)
+        self.strings = {}
+        self.tokens = {}
+        self.ids = {}
+        self._write({'type': 'recording', 'url': url, 'created': datetime.now().isoformat()})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _write(self, obj: dict):
+        self.file.write(json.dumps(obj, separators=(',', ':')) + '\n')
+
+    @staticmethod
+    def _variable(variables: dict, key, prefix: str) -> str:
+        if key not in variables:
+            variables[key] = f'{prefix}{len(variables)}'
+
+        return variables[key]
+
+    def _substitute(self, value):
+        if isinstance(value, dict):
+            return {k: self._substitute(v) for k, v in value.items()}
+        if not isinstance(value, str):
+            return value
+
+        if value in self.tokens:
+            return '${' + self.tokens[value] + '}'
+
+        return _random_string.sub(lambda m: '${' + self._variable(self.strings, m.group(), 's') + '}', value)
+
+    def _substitute_path(self, path: str) -> str:
+        parts = path.split('/')
+        for i in range(1, len(parts)):
+            if (parts[i - 1], parts[i]) in self.ids:
+                parts[i] = '${' + self.ids[parts[i - 1], parts[i]] + '}'
+            else:
+                parts[i] = self._substitute(parts[i])
+
+        return '/'.join(parts)
+
+    def request(self, method: str, url: str, **kwargs):
+        sent = perf_counter() - self.started
+        response = self.transport.request(method, url, **kwargs)
+
+        with self.lock:
+            line = {'t': round(sent, 6), 'm': method, 'p': self._substitute_path(url[len(f'{self.url}/api'):])}
+            headers = kwargs.get('headers')
+            if headers:
+                line['h'] = {k: 'Bearer ' + self._substitute(v[len('Bearer '):]) if k == 'Authorization'
+                             else self._substitute(v) for k, v in headers.items()}
+            if kwargs.get('json') is not None:
+                line['j'] = self._substitute(kwargs['json'])
+            elif kwargs.get('data') is not None:
+                line['d'] = self._substitute(kwargs['data'])
+            line['s'] = response.status_code
+
+            # Streamed responses are lists, which never hold new tokens or ids
+            if response.status_code in (200, 201) and not kwargs.get('stream'):
+                obj = response.json()
+                if isinstance(obj, dict) and 'access_token' in obj:
+                    line['x'] = {'access_token': self._variable(self.tokens, obj['access_token'], 'token')}
+                elif response.status_code == 201 and isinstance(obj, dict) and isinstance(obj.get('id'), int):
+                    # Posts and comments are numbered separately
+                    collection = 'comments' if 'parent_post_id' in obj else 'posts'
+                    line['x'] = {'id': self._variable(self.ids, (collection, str(obj['id'])), 'id')}
+
+            self._write(line)
+
+        return response
+
+    def close(self):
+        """Close the recording and the wrapped transport."""
+        self.file.close()
+        self.transport.close()
+
+
+def load_recording(path: str) -> List[dict]:
+    """Read the requests of a recording."""
+    with open(path, encoding='utf-8') as f:
+        lines = [json.loads(line) for line in f]
+
+    if not lines or lines[0].get('type') != 'recording':
+        raise ValueError(f'{path} is not a recording')
+
+    return lines[1:]
+
+
+def _fill(value, variables: dict):
+    if isinstance(value, dict):
+        return {k: _fill(v, variables) for k, v in value.items()}
+    if not isinstance(value, str):
+        return value
+
+    def variable(m):
+        name = m.group(1)
+        if name not in variables:
+            # Random strings are new in every replay, tokens and ids come from responses
+            variables[name] = secrets.token_hex(8)
+
+        return variables[name]
+
+    return _variable.sub(variable, value)
+
+
+@dataclass
+class ReplayResult:
+    sequences: int = 0
+    elapsed_seconds: float = 0
+    errors: int = 0
+    stats: TestStats = field(default_factory=TestStats)
+
+    @property
+    def requests_per_second(self) -> float:
+        return self.stats.count / self.elapsed_seconds if self.elapsed_seconds else 0
+
+
+def replay(url: str, requests: List[dict], transport: Transport, iterations: int = 1, concurrency: int = 1,
+           speed: float = 1, rate: float = None, check_status: bool = True,
+           observers: Iterable[Observer] = ()) -> ReplayResult:
+    """Send the recorded requests iterations times, on concurrency threads at the same time.
+
+    Every iteration sends the requests in order with new variables. Requests
+    are sent at speed times the recorded pace, or at a fixed rate shared by
+    all threads when a rate is given. A request is never sent before the
+    previous request of the iteration has completed.
+
+    Responses are only decoded to save the tokens and ids used by later
+    requests. With check_status, responses with another status than
+    recorded are counted as errors. Without, only those that had values to
+    save are.
+    """
+    result = ReplayResult()
+    lock = Lock()
+    pacer = Pacer(rate, float('inf')) if rate else None
+
+    def iteration():
+        variables = {}
+        stats = TestStats()
+        errors = 0
+        started = perf_counter()
+        for request in requests:
+            if pacer:
+                planned = pacer.next_send_time()
+            else:
+                planned = started + request['t'] / speed
+            delay = planned - perf_counter()
+            if delay > 0:
+                sleep(delay)
+            elif pacer:
+                for observer in observers:
+                    observer.lag(-delay)
+
+            path = _fill(request['p'], variables)
+            kwargs = {'headers': _fill(request.get('h', {}), variables)}
+            if 'j' in request:
+                kwargs['json'] = _fill(request['j'], variables)
+            elif 'd' in request:
+                kwargs['data'] = _fill(request['d'], variables)
+
+            sent = perf_counter()
+            r = transport.request(request['m'], f'{url}/api{path}', **kwargs)
+            seconds = perf_counter() - sent
+            stats.count += 1
+            stats.record(request['m'], path, request['s'], seconds)
+            for observer in observers:
+                observer.request(request['m'], path, r.status_code, request['s'], seconds)
+
+            if r.status_code != request['s']:
+                # Values to save are missing from other responses, which breaks the later requests
+                if check_status or 'x' in request:
+                    errors += 1
+            elif 'x' in request:
+                obj = r.json()
+                for key, name in request['x'].items():
+                    variables[name] = str(obj[key])
+
+        stats.elapsed_seconds = perf_counter() - started
+        for observer in observers:
+            observer.run(stats, error=AssertionError(f'{errors} requests failed') if errors else None)
+        with lock:
+            result.sequences += 1
+            result.errors += errors
+            result.stats.merge(stats)
+
+    if pacer:
+        pacer.start()
+    started = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(iteration) for _ in range(iterations)]:
+            future.result()
+
+    result.elapsed_seconds = perf_counter() - started
+    return result
@@ -0,0 +1,155 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Tuple, List, Set, Awaitable
+
+
+@dataclass
+class Step:
+    name: str
+    func: Callable[[], None]
+    requires: Tuple[str, ...] = ()
+    tags: Tuple[str, ...] = ()
+    cleanup: bool = False
+
+
+class Scenario:
+    """Named steps with explicit dependencies between them.
+
+    A step may only require steps added before it, so the steps always form
+    a DAG and the order they were added in is a valid order to run them in.
+
+    Steps can be tagged, so that only some of them are run. Cleanup steps
+    always run after every other step of a run.
+    """
+
+    def __init__(self):
+        self.steps: Dict[str, Step] = {}
+
+    def add(self, name: str, func: Callable[[], None], requires: Iterable[str] = (), tags: Iterable[str] = (),
+            cleanup: bool = False):
+        if name in self.steps:
+            raise ValueError(f'Step {name} already exists')
+
+        requires = tuple(requires)
+        for required in requires:
+            if required not in self.steps:
+                raise ValueError(f'Step {name} requires unknown step {required}')
+
+        self.steps[name] = Step(name, func, requires, tuple(tags), cleanup)
+
+    def step(self, requires: Iterable[str] = (), tags: Iterable[str] = (), cleanup: bool = False):
+        """Decorator that adds a function as a step named after the function."""
+
+        def decorator(func):
+            self.add(func.__name__, func, requires, tags, cleanup)
+            return func
+
+        return decorator
+
+    def select(self, only: Iterable[str] = (), skip: Iterable[str] = (), done: Iterable[str] = ()) -> List[str]:
+        """Return the names of the steps to run for the given tags, in the order they were added.
+
+        Steps with any of the tags in only (or all steps when only is empty)
+        are selected, except steps with any of the tags in skip. The steps
+        they require are included as well, even when skipped, unless they
+        are in done. Cleanup steps are included when every step they require
+        is included or done, and they are not skipped.
+        """
+        only, skip, done = set(only), set(skip), set(done)
+        pending = [name for name, step in self.steps.items()
+                   if not step.cleanup and (not only or only & set(step.tags)) and not skip & set(step.tags)]
+        included = set()
+        while pending:
+            name = pending.pop()
+            if name not in included and name not in done:
+                included.add(name)
+                pending.extend(self.steps[name].requires)
+
+        for name, step in self.steps.items():
+            if step.cleanup and not skip & set(step.tags) and all(r in included or r in done for r in step.requires):
+                included.add(name)
+
+        return [name for name in self.steps if name in included]
+
+    def run(self, workers: int = 1, steps: Iterable[str] = None, completed: Set[str] = None,
+            runner: Callable[[Callable], object] = None):
+        """Run all steps, or only the named steps.
+
+        Steps required by the named steps that are not named themselves are
+        considered done. The names of completed steps are added to completed.
+
+        With a single worker the steps run in the order they were added.
+        Otherwise every step runs on a pool of workers as soon as all steps it
+        requires are done. The first failing step stops any further steps
+        from starting, and its exception is raised.
+
+        Every step function is called by the runner when given, e.g. to
+        drive steps that are generators.
+        """
+        runner = runner or (lambda func: func())
+        steps = list(self.steps) if steps is None else list(steps)
+        completed = set() if completed is None else completed
+        others = {name for name in steps if not self.steps[name].cleanup}
+
+        if workers <= 1:
+            for name in sorted(steps, key=lambda name: self.steps[name].cleanup):
+                runner(self.steps[name].func)
+                completed.add(name)
+            return
+
+        waiting_for = {name: set(self.steps[name].requires) & others | (others if self.steps[name].cleanup else set())
+                       for name in steps}
+        running = {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while waiting_for or running:
+                for name in [name for name, requires in waiting_for.items() if not requires]:
+                    del waiting_for[name]
+                    running[executor.submit(runner, self.steps[name].func)] = name
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    future.result()
+                    completed.add(name)
+                    for requires in waiting_for.values():
+                        requires.discard(name)
+
+    async def run_async(self, runner: Callable[[Callable], Awaitable], workers: int = 1, steps: Iterable[str] = None,
+                        completed: Set[str] = None):
+        """Run the steps like run, as asyncio tasks on the running event loop.
+
+        Every step function is called and awaited by the runner. With more
+        than one worker, every step starts as soon as all steps it requires
+        are done, however many steps that are.
+        """
+        steps = list(self.steps) if steps is None else list(steps)
+        completed = set() if completed is None else completed
+        others = {name for name in steps if not self.steps[name].cleanup}
+
+        if workers <= 1:
+            for name in sorted(steps, key=lambda name: self.steps[name].cleanup):
+                await runner(self.steps[name].func)
+                completed.add(name)
+            return
+
+        waiting_for = {name: set(self.steps[name].requires) & others | (others if self.steps[name].cleanup else set())
+                       for name in steps}
+        running = {}
+        try:
+            while waiting_for or running:
+                for name in [name for name, requires in waiting_for.items() if not requires]:
+                    del waiting_for[name]
+                    running[asyncio.ensure_future(runner(self.steps[name].func))] = name
+
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = running.pop(task)
+                    task.result()
+                    completed.add(name)
+                    for requires in waiting_for.values():
+                        requires.discard(name)
+        finally:
+            # Like the thread pool of run, steps that already started are finished
+            if running:
+                await asyncio.wait(running)
@@ -1,42 +1,57 @@
 import secrets
-from dataclasses import dataclass, field, asdict
+from dataclasses import dataclass, field
 from functools import partial
 
 random_string = partial(secrets.token_hex, 8)
 
 
-def property_to_dict(**fields):
-    @property
-    def create(self):
-        return {v: getattr(self, k) for k, v in fields.items()}
+def _create_function(name: str, args: str, body: list, namespace: dict = None):
+    """Compile a function from the lines of its body.
+
+    Models are created and compared for every request, so their methods are
+    generated once for their fields instead of looking the fields up on
+    every call, the same way dataclasses generates __init__.
+    """
+    source = f'def {name}({args}):\n' + ''.join(f'    {line}\n' for line in body)
+    namespace = dict(namespace or {})
+    exec(source, namespace)
+    return namespace[name]
 
-    return create
+
+def property_to_dict(**fields):
+    items = ', '.join(f'{v!r}: self.{k}' for k, v in fields.items())
+    return property(_create_function('create', 'self', [f'return {{{items}}}']))
 
 
 def method_edit(**editable_fields):
-    def edit(self, apply: bool = True, **fields):
-        if apply:
-            for k, v in editable_fields.items():
-                if v in fields:
-                    setattr(self, k, fields[v])
+    body = ['if apply:']
+    for k, v in editable_fields.items():
+        body += [f'    if {v!r} in fields:', f'        self.{k} = fields[{v!r}]']
 
-        return fields
+    return _create_function('edit', 'self, apply=True, **fields', body + ['return fields'])
 
-    return edit
 
+class method_compare:
+    """Generates the compare method of a model for the fields of its class.
 
-def method_compare(**update_fields):
-    def compare(self, json_object: dict, update: bool = False):
-        if update:
-            for k, v in update_fields.items():
-                setattr(self, k, json_object[v])
+    Every field found in the JSON object must be equal to the field of the
+    model. With update=True, the update fields are first set from the JSON
+    object.
+    """
 
-        return all(v == json_object[k] for k, v in asdict(self).items() if k in json_object)
+    def __init__(self, **update_fields):
+        self.update_fields = update_fields
 
-    return compare
+    def __set_name__(self, owner, name):
+        body = ['if update:'] if self.update_fields else []
+        body += [f'    self.{k} = json_object[{v!r}]' for k, v in self.update_fields.items()]
+        checks = ' and '.join(f'({k!r} not in json_object or self.{k} == json_object[{k!r}])'
+                              for k in owner.__annotations__)
+        body.append(f'return {checks or True}')
+        setattr(owner, name, _create_function(name, 'self, json_object, update=False', body))
 
 
-@dataclass
+@dataclass(slots=True)
 class User:
     username: str = field(default_factory=random_string)
     password: str = field(default_factory=random_string)
@@ -46,6 +61,8 @@ class User:
     create = property_to_dict(username='username', password='password')
     edit = method_edit(bio='bio', avatar_url='avatar_url')
     compare = method_compare()
+    # The field identifying the model in list responses
+    index_key = 'username'
 
     @property
     def login(self):
@@ -58,7 +75,7 @@ class User:
         }
 
 
-@dataclass
+@dataclass(slots=True)
 class Resub:
     owner_username: str
     name: str = field(default_factory=random_string)
@@ -67,9 +84,10 @@ class Resub:
     create = property_to_dict(name='name', description='description')
     edit = method_edit(description='description', owner_username='new_owner_username')
     compare = method_compare()
+    index_key = 'name'
 
 
-@dataclass
+@dataclass(slots=True)
 class Post:
     author_username: str
     parent_resub_name: str
@@ -82,9 +100,10 @@ class Post:
     create = property_to_dict(title='title', url='url', content='content')
     edit = method_edit(title='title', url='url', content='content')
     compare = method_compare(id='id')
+    index_key = 'id'
 
 
-@dataclass
+@dataclass(slots=True)
 class Comment:
     author_username: str
     parent_resub_name: str
@@ -97,3 +116,4 @@ class Comment:
     create = property_to_dict(content='content')
     edit = method_edit(content='content')
     compare = method_compare(id='id')
+    index_key = 'id'
@@ -0,0 +1,251 @@
+"""Bulk seeding of test data, and benchmarking list endpoints against the amount of data."""
+import argparse
+import math
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from time import perf_counter
+from typing import List, Callable
+
+from apitest.histogram import Histogram
+from apitest.registry import Registry, RegistryTransport
+from apitest.schemas import User, Resub, Post, Comment
+from apitest.transport import Transport
+
+
+class Seeder:
+    """Creates users, resubs, posts and comments concurrently.
+
+    Requests are sent on a pool of concurrency threads, in batches of at
+    most batch_size requests so the number of pending requests is bounded.
+    Only the status code of every request is checked.
+    """
+
+    def __init__(self, url: str, transport: Transport, concurrency: int = 16, batch_size: int = 1000):
+        self.url = url
+        self.transport = transport
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.tokens = {}
+        self.users: List[User] = []
+        self.resubs: List[Resub] = []
+
+    def request(self, method: str, endpoint: str, status: int, username: str = None, **kwargs):
+        headers = {}
+        if username:
+            headers['Authorization'] = 'Bearer ' + self.tokens[username]['access_token']
+
+        r = self.transport.request(method, f'{self.url}/api{endpoint}', headers=headers, **kwargs)
+        assert r.status_code == status, f'{method} {endpoint}\nGot: {r.status_code}\nExpected: {status}\n' \
+                                        f'Response: {r.text}'
+        return r
+
+    def map(self, func: Callable[[int], object], count: int) -> list:
+        """Call func with every number below count on the thread pool and return the results."""
+        results = []
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for start in range(0, count, self.batch_size):
+                results.extend(executor.map(func, range(start, min(start + self.batch_size, count))))
+
+        return results
+
+    def create_users(self, count: int) -> List[User]:
+        def create(_):
+            user = User()
+            self.request('POST', '/users/', 201, json=user.create)
+            self.tokens[user.username] = self.request('POST', '/auth/token', 200, data=user.login).json()
+            return user
+
+        users = self.map(create, count)
+        self.users.extend(users)
+        return users
+
+    def create_resubs(self, owners: List[User], count: int) -> List[Resub]:
+        def create(i):
+            resub = Resub(owner_username=owners[i % len(owners)].username)
+            self.request('POST', '/resubs/', 201, username=resub.owner_username, json=resub.create)
+            return resub
+
+        resubs = self.map(create, count)
+        self.resubs.extend(resubs)
+        return resubs
+
+    def create_posts(self, resubs: List[Resub], authors: List[User], count: int) -> List[Post]:
+        def create(i):
+            post = Post(author_username=authors[i % len(authors)].username,
+                        parent_resub_name=resubs[i % len(resubs)].name)
+            post.id = self.request('POST', f'/resubs/{post.parent_resub_name}/posts/', 201,
+                                   username=post.author_username, json=post.create).json()['id']
+            return post
+
+        return self.map(create, count)
+
+    def create_comments(self, posts: List[Post], authors: List[User], count: int) -> int:
+        """Create comments without keeping them, as there may be millions of them."""
+
+        def create(i):
+            post = posts[i % len(posts)]
+            comment = Comment(author_username=authors[i % len(authors)].username,
+                              parent_resub_name=post.parent_resub_name, parent_post_id=post.id)
+            self.request('POST', f'/posts/{post.id}/comments/', 201, username=comment.author_username,
+                         json=comment.create)
+
+        self.map(create, count)
+        return count
+
+    def delete_all(self):
+        """Delete every resub and user created by the seeder, along with their posts and comments."""
+        self.map(lambda i: self.request('DELETE', f'/resubs/{self.resubs[i].name}', 204,
+                                        username=self.resubs[i].owner_username), len(self.resubs))
+        self.map(lambda i: self.request('DELETE', '/users/me', 204, username=self.users[i].username),
+                 len(self.users))
+        self.resubs.clear()
+        self.users.clear()
+
+
+def seed(seeder: Seeder, users: int, resubs: int, posts: int, comments: int):
+    """Create the given number of every resource, spread evenly over the resources they belong to."""
+
+    def timed(name: str, count: int, func: Callable[[], object]):
+        started = perf_counter()
+        result = func()
+        elapsed = perf_counter() - started
+        print(f'Created {count} {name} in {elapsed:.2f} seconds ({count / elapsed if elapsed else 0:.2f}/sec)')
+        return result
+
+    created_users = timed('users', users, lambda: seeder.create_users(users))
+    created_resubs = timed('resubs', resubs, lambda: seeder.create_resubs(created_users, resubs))
+    created_posts = timed('posts', posts, lambda: seeder.create_posts(created_resubs, created_users, posts))
+    if comments:
+        timed('comments', comments, lambda: seeder.create_comments(created_posts, created_users, comments))
+
+
+@dataclass
+class ScalePoint:
+    size: int
+    latency: Histogram = field(default_factory=Histogram)
+    response_bytes: int = 0
+
+
+def growth_exponent(points: List[ScalePoint], value: Callable[[ScalePoint], float]) -> float:
+    """Least squares slope of log(value) against log(size).
+
+    A value that grows linearly with the size has an exponent close to 1,
+    and a value independent of the size has an exponent close to 0.
+    """
+    xs = [math.log(p.size) for p in points if value(p) > 0]
+    ys = [math.log(value(p)) for p in points if value(p) > 0]
+    if len(xs) < 2:
+        return 0
+
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance if variance else 0
+
+
+def benchmark_scaling(seeder: Seeder, sizes: List[int], samples: int = 20) -> dict:
+    """Measure the latency and response size of every list endpoint as the data grows.
+
+    For every size N, a single user owns N resubs, and has N posts in one of
+    them and N comments on one of the posts. Data is added between sizes, so
+    sizes should be increasing. Returns the ScalePoints of every endpoint.
+    """
+    user, = seeder.create_users(1)
+    resub, = seeder.create_resubs([user], 1)
+    post, = seeder.create_posts([resub], [user], 1)
+    resubs, posts, comments = 1, 1, 0
+
+    endpoints = {
+        'GET /resubs/': '/resubs/',
+        'GET /resubs/{name}/posts/': f'/resubs/{resub.name}/posts/',
+        'GET /posts/{id}/comments/': f'/posts/{post.id}/comments/',
+        'GET /users/{username}/posts': f'/users/{user.username}/posts',
+        'GET /users/{username}/comments/': f'/users/{user.username}/comments/'
+    }
+    results = {name: [] for name in endpoints}
+
+    for size in sorted(sizes):
+        seeder.create_resubs([user], max(size - resubs, 0))
+        seeder.create_posts([resub], [user], max(size - posts, 0))
+        seeder.create_comments([post], [user], max(size - comments, 0))
+        resubs, posts, comments = max(size, resubs), max(size, posts), max(size, comments)
+
+        for name, endpoint in endpoints.items():
+            point = ScalePoint(size)
+            for _ in range(samples):
+                started = perf_counter()
+                r = seeder.request('GET', endpoint, 200)
+                point.latency.record(round((perf_counter() - started) * 1_000_000))
+                point.response_bytes = len(r.content)
+
+            results[name].append(point)
+
+    return results
+
+
+def print_scaling(results: dict):
+    print(f'\n{"endpoint":<34}{"N":>9}{"p50 ms":>10}{"p99 ms":>10}{"bytes":>12}')
+    for name, points in results.items():
+        for point in points:
+            print(f'{name:<34}{point.size:>9}{point.latency.value_at_quantile(0.5) / 1000:>10.2f}'
+                  f'{point.latency.value_at_quantile(0.99) / 1000:>10.2f}{point.response_bytes:>12}')
+
+    print('\nGrowth with N (latency ~ N^k):')
+    for name, points in results.items():
+        exponent = growth_exponent(points, lambda p: p.latency.value_at_quantile(0.5))
+        size_exponent = growth_exponent(points, lambda p: p.response_bytes)
+        warning = '  WARNING: grows with the amount of data, consider pagination' if exponent > 0.5 else ''
+        print(f'\t{name:<34} latency k={exponent:.2f}, response size k={size_exponent:.2f}{warning}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Seed a Repost API with data, or benchmark list endpoints '
+                                                 'against the amount of data.')
+    parser.add_argument('url', help='The base URL of the API.')
+    parser.add_argument('--concurrency', type=int, default=16, help='Number of requests to send at the same time.')
+    parser.add_argument('--registry', default='.apitest-registry.jsonl',
+                        help='File registering the created data, so it can be deleted with apitest.registry.')
+    parser.add_argument('--no-registry', action='store_true', help='Do not register the created data.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = subparsers.add_parser('seed', help='Create data and keep it.')
+    seed_parser.add_argument('--users', type=int, default=100)
+    seed_parser.add_argument('--resubs', type=int, default=10)
+    seed_parser.add_argument('--posts', type=int, default=1000)
+    seed_parser.add_argument('--comments', type=int, default=10000)
+
+    scale_parser = subparsers.add_parser('scale', help='Benchmark list endpoints at increasing amounts of data.')
+    scale_parser.add_argument('--sizes', type=lambda s: [int(size) for size in s.split(',')],
+                              default=[10, 100, 1000], help='Comma separated amounts of data, e.g. 10,100,1000.')
+    scale_parser.add_argument('--samples', type=int, default=20, help='Requests per endpoint and size.')
+    scale_parser.add_argument('--keep', action='store_true', help='Keep the created data.')
+    args = parser.parse_args()
+
+    registry = None if args.no_registry else Registry(args.registry)
+    with Transport(pool_size=args.concurrency) as transport:
+        if registry:
+            transport = RegistryTransport(transport, registry, args.url)
+        seeder = Seeder(args.url, transport, concurrency=args.concurrency)
+        started = datetime.now()
+        try:
+            if args.command == 'seed':
+                seed(seeder, args.users, args.resubs, args.posts, args.comments)
+                print(f'Seeded {args.url} in {(datetime.now() - started).total_seconds()} seconds')
+                return
+
+            try:
+                print_scaling(benchmark_scaling(seeder, args.sizes, args.samples))
+            finally:
+                if not args.keep:
+                    seeder.delete_all()
+        finally:
+            if registry:
+                registry.compact(registry.session)
+                registry.close()
+                if any(registry.live(registry.session).values()):
+                    print(f'Registered the data in {args.registry} as session {registry.session}, delete it with '
+                          f'python -m apitest.registry {args.url} --session {registry.session}')
+
+
+if __name__ == '__main__':
+    main()
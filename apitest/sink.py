@@ -0,0 +1,190 @@
+"""Streaming results of long running tests to an append-only JSON lines file.
+
+Every line is a JSON object with a type:
+
+* request: a single request, unless the sink was created with requests=False
+* run: a completed or failed run
+* second: a rollup of all requests and runs completed during one second,
+  including its latency histogram in microseconds
+
+The file can be read while the test is still running, and everything up to
+the last rollup is kept if the test crashes.
+"""
+import argparse
+import json
+from datetime import datetime
+from threading import Lock
+from time import time
+from typing import Iterator
+
+from apitest.endpoints import endpoint_template
+from apitest.histogram import Histogram
+from apitest.test import Observer, TestStats
+
+
+class ResultSink(Observer):
+    """Writes requests, runs and per-second rollups to a file as they happen.
+
+    Memory use is bounded by a single second of results, regardless of how
+    long the test runs for.
+    """
+
+    def __init__(self, path: str, requests: bool = True):
+        self.path = path
+        self.requests = requests
+        self.file = open(path, 'a', encoding='utf-8')
+        self.lock = Lock()
+        self._new_second(int(time()))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _new_second(self, second: int):
+        self.second = second
+        self.histogram = Histogram()
+        self.errors = 0
+        self.runs = 0
+        self.failed_runs = 0
+
+    def _write(self, obj: dict):
+        self.file.write(json.dumps(obj, separators=(',', ':')) + '\n')
+
+    def _roll_up(self, now: float):
+        second = int(now)
+        if second == self.second:
+            return
+
+        if self.histogram.count or self.runs or self.failed_runs:
+            self._write({
+                'type': 'second',
+                'time': self.second,
+                'requests': self.histogram.count,
+                'errors': self.errors,
+                'runs': self.runs,
+                'failed_runs': self.failed_runs,
+                'p50': self.histogram.value_at_quantile(0.5),
+                'p90': self.histogram.value_at_quantile(0.9),
+                'p99': self.histogram.value_at_quantile(0.99),
+                'max': self.histogram.max,
+                'histogram': self.histogram.to_dict()
+            })
+            self.file.flush()
+
+        self._new_second(second)
+
+    def request(self, method: str, endpoint: str, status: int, expected_status: int, seconds: float):
+        now = time()
+        microseconds = round(seconds * 1_000_000)
+        with self.lock:
+            self._roll_up(now)
+            self.histogram.record(microseconds)
+            if status != expected_status:
+                self.errors += 1
+
+            if self.requests:
+                self._write({'type': 'request', 'time': round(now, 6), 'method': method,
+                             'endpoint': endpoint_template(endpoint), 'status': status, 'expected': expected_status,
+                             'us': microseconds})
+
+    def run(self, stats: TestStats, error: Exception = None):
+        now = time()
+        with self.lock:
+            self._roll_up(now)
+            if error is None:
+                self.runs += 1
+            else:
+                self.failed_runs += 1
+
+            self._write({'type': 'run', 'time': round(now, 6), 'count': stats.count,
+                         'elapsed_seconds': stats.elapsed_seconds, 'error': None if error is None else str(error)})
+
+    def close(self):
+        with self.lock:
+            # Force the last second to be written
+            self._roll_up(self.second + 1)
+            self.file.close()
+
+
+def read_results(path: str) -> Iterator[dict]:
+    """Read the lines of a results file one at a time."""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            # The last line may be incomplete if the test crashed while writing
+            try:
+                yield json.loads(line)
+            except ValueError:
+                pass
+
+
+def summarize(path: str, interval: int = 60):
+    """Print a timeline of a results file in intervals of seconds, followed by the totals."""
+    total = Histogram()
+    endpoints = {}
+    totals = {'requests': 0, 'errors': 0, 'runs': 0, 'failed_runs': 0}
+    window = None
+
+    def print_window():
+        start, histogram, counts = window
+        print(f'{datetime.fromtimestamp(start).isoformat(sep=" ")}'
+              f'{counts["requests"] / interval:>12.2f}{counts["errors"]:>8}{counts["runs"]:>6}'
+              f'{counts["failed_runs"]:>8}'
+              f'{histogram.value_at_quantile(0.5) / 1000:>10.2f}{histogram.value_at_quantile(0.99) / 1000:>10.2f}'
+              f'{(histogram.max or 0) / 1000:>10.2f}')
+
+    print(f'{"time":<19}{"requests/s":>12}{"errors":>8}{"runs":>6}{"failed":>8}{"p50 ms":>10}{"p99 ms":>10}'
+          f'{"max ms":>10}')
+    for result in read_results(path):
+        if result['type'] == 'request':
+            key = f'{result["method"]} {result["endpoint"]}'
+            if key not in endpoints:
+                endpoints[key] = Histogram()
+            endpoints[key].record(result['us'])
+            continue
+
+        if result['type'] != 'second':
+            continue
+
+        start = result['time'] - result['time'] % interval
+        if window and window[0] != start:
+            print_window()
+            window = None
+        if window is None:
+            window = (start, Histogram(), {name: 0 for name in totals})
+
+        histogram = Histogram.from_dict(result['histogram'])
+        window[1].merge(histogram)
+        total.merge(histogram)
+        for name in totals:
+            window[2][name] += result[name]
+            totals[name] += result[name]
+
+    if window:
+        print_window()
+
+    print(f'\nTotal: {totals["requests"]} requests, {totals["errors"]} errors, {totals["runs"]} runs, '
+          f'{totals["failed_runs"]} failed runs')
+    print(f'Latency (ms): p50 {total.value_at_quantile(0.5) / 1000:.2f}, '
+          f'p90 {total.value_at_quantile(0.9) / 1000:.2f}, p99 {total.value_at_quantile(0.99) / 1000:.2f}, '
+          f'p99.9 {total.value_at_quantile(0.999) / 1000:.2f}, max {(total.max or 0) / 1000:.2f}')
+
+    if endpoints:
+        print(f'\n{"endpoint":<50}{"count":>8}{"p50":>9}{"p99":>9}{"max":>9}')
+        for key, histogram in sorted(endpoints.items()):
+            print(f'{key:<50}{histogram.count:>8}{histogram.value_at_quantile(0.5) / 1000:>9.2f}'
+                  f'{histogram.value_at_quantile(0.99) / 1000:>9.2f}{histogram.max / 1000:>9.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize a results file written with --output.')
+    parser.add_argument('path', help='The results file.')
+    parser.add_argument('--interval', type=int, default=60, help='Seconds per line in the timeline.')
+    args = parser.parse_args()
+
+    summarize(args.path, args.interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,61 +1,441 @@
 import random
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from copy import copy
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Union
+from functools import partial
+from threading import Lock
+from time import perf_counter
+from typing import Union, Dict, Tuple, Iterable, Iterator, Generator, List, Set, Callable
 
 from requests import get, post, patch, delete
 
+from apitest.endpoints import endpoint_template
+from apitest.histogram import Histogram
+from apitest.jsonstream import find_models
+from apitest.scenario import Scenario
 from apitest.schemas import User, Resub, Post, Comment
+from apitest.transport import Transport, iter_decoded
+
+
+# The tags of the steps of test_everything that can be selected. Steps tagged
+# fixture create and log in users, or create resub1 and the posts and comments
+# in it, and steps tagged teardown delete the users
+SUITES = ('users', 'auth', 'resubs', 'posts', 'votes', 'comments', 'deletion')
+
+# The phases of a request: opening a connection, waiting for the server to
+# respond, reading the body, decompressing it, decoding it and checking it in the test
+PHASES = ('connect', 'ttfb', 'download', 'decompress', 'decode', 'verify')
+
+# The sizes of a request in bytes: the request body, the response body as
+# received, maybe compressed, and the decompressed response body
+SIZES = ('request', 'response', 'decoded')
 
 
 @dataclass
 class TestStats:
     count: int = 0
     elapsed_seconds: int = 0
+    # Latency in microseconds by (method, endpoint template, expected status)
+    latencies: Dict[Tuple[str, str, int], Histogram] = field(default_factory=dict)
+    # Time in microseconds by (method, endpoint template, phase)
+    phases: Dict[Tuple[str, str, str], Histogram] = field(default_factory=dict)
+    # Size in bytes by (method, endpoint template, size)
+    sizes: Dict[Tuple[str, str, str], Histogram] = field(default_factory=dict)
+
+    def record(self, method: str, endpoint: str, status: int, seconds: float):
+        """Record the latency of a request."""
+        key = (method, endpoint_template(endpoint), status)
+        if key not in self.latencies:
+            self.latencies[key] = Histogram()
+
+        self.latencies[key].record(round(seconds * 1_000_000))
+
+    def record_phases(self, method: str, endpoint: str, phases: Dict[str, float]):
+        """Record the seconds spent in every phase of a request."""
+        template = endpoint_template(endpoint)
+        for phase, seconds in phases.items():
+            key = (method, template, phase)
+            if key not in self.phases:
+                self.phases[key] = Histogram()
+
+            self.phases[key].record(round(seconds * 1_000_000))
+
+    def record_sizes(self, method: str, endpoint: str, sizes: Dict[str, int]):
+        """Record the sizes in bytes of a request and its response."""
+        template = endpoint_template(endpoint)
+        for size, value in sizes.items():
+            key = (method, template, size)
+            if key not in self.sizes:
+                self.sizes[key] = Histogram()
+
+            self.sizes[key].record(value)
+
+    def merge(self, other: 'TestStats'):
+        """Add the results of another run to these stats."""
+        self.count += other.count
+        self.elapsed_seconds += other.elapsed_seconds
+        for key, histogram in other.latencies.items():
+            if key not in self.latencies:
+                self.latencies[key] = Histogram(histogram.precision_bits)
+
+            self.latencies[key].merge(histogram)
+
+        for key, histogram in other.phases.items():
+            if key not in self.phases:
+                self.phases[key] = Histogram(histogram.precision_bits)
+
+            self.phases[key].merge(histogram)
+
+        for key, histogram in other.sizes.items():
+            if key not in self.sizes:
+                self.sizes[key] = Histogram(histogram.precision_bits)
+
+            self.sizes[key].merge(histogram)
+
+    def endpoint_latencies(self) -> Dict[Tuple[str, str], Histogram]:
+        """Latency histograms by (method, endpoint template) for all statuses."""
+        endpoints = {}
+        for (method, template, _), histogram in self.latencies.items():
+            if (method, template) not in endpoints:
+                endpoints[method, template] = Histogram(histogram.precision_bits)
+
+            endpoints[method, template].merge(histogram)
+
+        return endpoints
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'elapsed_seconds': self.elapsed_seconds,
+            'latencies': [{'method': method, 'endpoint': template, 'status': status, 'histogram': histogram.to_dict()}
+                          for (method, template, status), histogram in self.latencies.items()],
+            'phases': [{'method': method, 'endpoint': template, 'phase': phase, 'histogram': histogram.to_dict()}
+                       for (method, template, phase), histogram in self.phases.items()],
+            'sizes': [{'method': method, 'endpoint': template, 'size': size, 'histogram': histogram.to_dict()}
+                      for (method, template, size), histogram in self.sizes.items()]
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'TestStats':
+        return cls(count=d['count'], elapsed_seconds=d['elapsed_seconds'],
+                   latencies={(latency['method'], latency['endpoint'], latency['status']):
+                                  Histogram.from_dict(latency['histogram']) for latency in d['latencies']},
+                   # Stats saved before phases were recorded have none
+                   phases={(phase['method'], phase['endpoint'], phase['phase']): Histogram.from_dict(phase['histogram'])
+                           for phase in d.get('phases', [])},
+                   sizes={(size['method'], size['endpoint'], size['size']): Histogram.from_dict(size['histogram'])
+                          for size in d.get('sizes', [])})
+
+
+def timed_chunks(chunks: Iterable[bytes], seconds: list) -> Iterator[bytes]:
+    """Yield the chunks while adding the time spent reading them to seconds[0]."""
+    chunks = iter(chunks)
+    while True:
+        started = perf_counter()
+        chunk = next(chunks, None)
+        seconds[0] += perf_counter() - started
+        if chunk is None:
+            return
+
+        yield chunk
+
+
+@dataclass
+class Request:
+    """A request of a test step, with the response and timing filled in when it has been sent."""
+    method: str
+    url: str
+    kwargs: dict
+    response: object = None
+    # perf_counter() when the request was sent, and the seconds until the response
+    started: float = 0
+    seconds: float = 0
+
+
+def send_requests(requests: List[Request], transport: Transport, probe_executor: ThreadPoolExecutor = None):
+    """Send the requests yielded by a step.
+
+    The first request is the request being tested, and the others are its
+    authorization tests, which are sent alongside it on the probe executor.
+    """
+
+    def send(request: Request):
+        request.started = perf_counter()
+        request.response = transport.request(request.method, request.url, **request.kwargs)
+        # Paced requests count from their planned send time, see PacedTransport
+        request.started = getattr(request.response, 'planned', request.started)
+        request.seconds = perf_counter() - request.started
+
+    futures = []
+    for probe in requests[1:]:
+        if probe_executor:
+            futures.append(probe_executor.submit(send, probe))
+        else:
+            send(probe)
+
+    send(requests[0])
+    for future in futures:
+        future.result()
+
+
+def run_step(func: Callable[[], Generator], transport: Transport, probe_executor: ThreadPoolExecutor = None):
+    """Run a step of test_everything, sending the requests it yields with the transport."""
+    step = func()
+    if not isinstance(step, Generator):
+        return step
+
+    try:
+        requests = next(step)
+        while True:
+            send_requests(requests, transport, probe_executor)
+            requests = step.send(None)
+    except StopIteration as e:
+        return e.value
+
+
+class Observer:
+    """Receives every request and run of test_everything as it happens.
+
+    Observers may be shared by runs on multiple threads.
+    """
+
+    def request(self, method: str, endpoint: str, status: int, expected_status: int, seconds: float):
+        pass
+
+    def run(self, stats: TestStats, error: Exception = None):
+        pass
+
+    def lag(self, seconds: float):
+        """How late a paced request was sent after its planned send time."""
+        pass
+
+    def close(self):
+        pass
+
+
+def test_everything(url: str, logging: bool = True, transport: Transport = None, workers: int = 1,
+                    observers: Iterable[Observer] = (), only: Iterable[str] = (), skip: Iterable[str] = (),
+                    fixtures: dict = None) -> TestStats:
+    """Perform all tests and return statistics when passed.
+
+    The given transport is used for every request, which lets multiple runs
+    share the same connection pool. When no transport is given, a pooled
+    transport is created for this run only.
+
+    The tests are steps of a Scenario, and with more than one worker, steps
+    that do not depend on each other run at the same time. The authorization
+    tests of a request are then also sent alongside the request itself.
+
+    Every request and the completed (or failed) run is passed on to the
+    given observers.
+
+    Only the steps of the suites in only (see SUITES), except those in skip,
+    are run along with the steps they require. Passing the same fixtures dict
+    to repeated runs shares the users between them: the fixture steps that
+    create and log in users only run once, and the users are only deleted by
+    a final run with only=['teardown']. Unless the resubs or deletion suites
+    run, see shares_resources, resub1 and the posts and comments in it are
+    shared as well.
+    """
+    if transport is None:
+        with Transport() as transport:
+            return test_everything(url, logging=logging, transport=transport, workers=workers, observers=observers,
+                                   only=only, skip=skip, fixtures=fixtures)
+
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=2 * workers) as probe_executor:
+            return _test_everything(url, logging, transport, workers, observers, only, skip, fixtures, probe_executor)
 
+    return _test_everything(url, logging, transport, workers, observers, only, skip, fixtures, None)
 
-def test_everything(url: str, logging: bool = True) -> TestStats:
-    """Perform all tests and return statistics when passed."""
+
+def _test_everything(url: str, logging: bool, transport: Transport, workers: int, observers: Iterable[Observer],
+                     only: Iterable[str], skip: Iterable[str], fixtures: dict,
+                     probe_executor: ThreadPoolExecutor) -> TestStats:
     stats = TestStats()
+    scenario = build_scenario(url, stats, logging, observers, fixtures,
+                              share_resources=fixtures is not None and shares_resources(only, skip))
+    steps, done = select_steps(scenario, only, skip, fixtures)
+    completed = set()
+    with observed_run(stats, observers, scenario, done, completed):
+        scenario.run(workers, steps, completed,
+                     runner=partial(run_step, transport=transport, probe_executor=probe_executor))
+
+    return stats
+
+
+def shares_resources(only: Iterable[str], skip: Iterable[str]) -> bool:
+    """Whether repeated runs of the selected suites can share resub1 and the posts and comments in it.
+
+    The resubs suite expects to create resub1 and transfers it to user2,
+    and the deletion suite deletes everything, so neither can run again on
+    the same resources.
+    """
+    suites = set(only or SUITES) - set(skip)
+    return not suites & {'resubs', 'deletion'}
+
+
+def select_steps(scenario: Scenario, only: Iterable[str], skip: Iterable[str],
+                 fixtures: dict) -> Tuple[List[str], Set[str]]:
+    """Return the steps of test_everything to run, and the set of fixture steps done by earlier runs."""
+    only, skip = list(only), list(skip)
+    if fixtures is not None and 'teardown' not in only:
+        # Shared users are only deleted when the fixtures are torn down
+        skip.append('teardown')
+
+    done = set() if fixtures is None else fixtures.setdefault('done', set())
+    return scenario.select(only, skip, done), done
+
+
+@contextmanager
+def observed_run(stats: TestStats, observers: Iterable[Observer], scenario: Scenario, done: Set[str],
+                 completed: Set[str]):
+    """Time the steps run in the block, and pass the completed or failed run on to the observers."""
     started = datetime.now()
+    try:
+        yield
+    except Exception as e:
+        stats.elapsed_seconds = (datetime.now() - started).total_seconds()
+        for observer in observers:
+            observer.run(stats, error=e)
+        raise
+    finally:
+        # Fixture steps are not run again with the same fixtures
+        done.update(name for name in completed if 'fixture' in scenario.steps[name].tags)
+
+    stats.elapsed_seconds = (datetime.now() - started).total_seconds()
+    for observer in observers:
+        observer.run(stats)
+
+
+def build_scenario(url: str, stats: TestStats, logging: bool = False, observers: Iterable[Observer] = (),
+                   fixtures: dict = None, share_resources: bool = False) -> Scenario:
+    """Create the steps of test_everything, recording every request in stats.
+
+    Every step is a generator function yielding lists of requests to send,
+    see run_step. With share_resources, the steps creating resub1 and the
+    posts and comments in it are fixtures too.
+    """
+    stats_lock = Lock()
 
     def log(*args):
         if logging:
             print(*args)
 
-    def test(method, endpoint: str, *, token=None, status: int, compare=None, skip_token_test: bool = False, **kwargs):
-        stats.count += 1
-        error_prefix = f'{method.__name__.upper()} {endpoint}'
-
+    def request(method_name: str, endpoint: str, token, kwargs: dict) -> Request:
         headers = {}
         if token:
             headers['Authorization'] = 'Bearer ' + token['access_token']
 
-        if method == patch:
+        if method_name == 'PATCH':
             headers['content-type'] = 'application/patch+json'
 
+        return Request(method_name, f'{url}/api{endpoint}', dict(kwargs, headers=headers))
+
+    def record(request: Request, endpoint: str, status: int, seconds: float):
+        with stats_lock:
+            stats.record(request.method, endpoint, status, seconds)
+        for observer in observers:
+            observer.request(request.method, endpoint, request.response.status_code, status, seconds)
+
+    def test(method, endpoint: str, *, token=None, status: int, compare=None, contains: Iterable = (),
+             excludes: Iterable = (), skip_token_test: bool = False, **kwargs):
+        """Send a request and check the response.
+
+        This is a generator yielding the requests to send once, so the same
+        steps can be run by a blocking or an asyncio driver. Its value is the
+        decoded response.
+        """
+        method_name = method.__name__.upper()
+        error_prefix = f'{method_name} {endpoint}'
+
         # Do extra authorization tests when token is provided
+        probes = []
         if token and not skip_token_test:
             log('\tWithout authorization')
-            test(method, endpoint, status=401, skip_token_test=True, **kwargs)
+            probes.append(request(method_name, endpoint, None, kwargs))
 
             log('\tWith invalid token')
-            test(method, endpoint, token={'access_token': 'not.a.token'}, status=401, skip_token_test=True, **kwargs)
-
-        r = method(f'{url}/api{endpoint}', headers=headers, **kwargs)
-        assert r.status_code == status, f'{error_prefix}\nGot: {r.status_code}\nExpected: {status}\nResponse: {r.text}'
+            probes.append(request(method_name, endpoint, {'access_token': 'not.a.token'}, kwargs))
+
+        with stats_lock:
+            stats.count += 1 + len(probes)
+
+        # Membership in list responses is checked while the response is
+        # downloaded, without keeping the whole list in memory
+        contains, excludes = list(contains), list(excludes)
+        models = contains + excludes
+        main = request(method_name, endpoint, token, dict(kwargs, stream=True) if models else kwargs)
+        yield [main] + probes
+
+        r = main.response
+        found = None
+        seconds = main.seconds
+        phases = dict(getattr(r, 'phases', {}))
+        try:
+            if models and r.status_code == status:
+                # Reading the chunks is the download, and the rest is decoding
+                # and checking the elements as they arrive
+                download = [0]
+                started_checking = perf_counter()
+                found = find_models(timed_chunks(iter_decoded(r, chunk_size=16384), download), models)
+                phases['download'] = download[0]
+                # Responses streamed from a socket are decompressed while reading the chunks
+                if 'decompress' not in phases:
+                    phases['decompress'] = getattr(r, 'phases', {}).get('decompress', 0)
+                    phases['download'] -= phases['decompress']
+                phases['decode'] = perf_counter() - started_checking - download[0]
+                # The latency ends when the body has been downloaded, like for responses that are not streamed
+                seconds += download[0]
+            record(main, endpoint, status, seconds)
+
+            for probe in probes:
+                record(probe, endpoint, 401, probe.seconds)
+                record_phases(method_name, endpoint, getattr(probe.response, 'phases', {}))
+            for probe in probes:
+                assert probe.response.status_code == 401, f'{error_prefix}\nGot: {probe.response.status_code}\n' \
+                                                          f'Expected: 401\nResponse: {probe.response.text}'
+
+            assert r.status_code == status, \
+                f'{error_prefix}\nGot: {r.status_code}\nExpected: {status}\nResponse: {r.text}'
+        finally:
+            # Release the connection of a streamed response that was not read to the end
+            if models:
+                r.close()
+
+        with stats_lock:
+            stats.record_sizes(method_name, endpoint, getattr(r, 'sizes', {}))
         if r.status_code >= 300 or r.status_code == 204:
+            record_phases(method_name, endpoint, phases)
             return
 
+        if found is not None:
+            for model, is_found in zip(contains, found):
+                assert is_found, f'{error_prefix} Failed list check:\nExpected to contain: {model}'
+            for model, is_found in zip(excludes, found[len(contains):]):
+                assert not is_found, f'{error_prefix} Failed list check:\nExpected not to contain: {model}'
+            record_phases(method_name, endpoint, phases)
+            return
+
+        started_decoding = perf_counter()
         obj = r.json()
+        started_verifying = perf_counter()
+        phases['decode'] = started_verifying - started_decoding
 
         if compare:
             assert compare.compare(obj,
                                    update=True), f'{error_prefix} Failed object check:\nGot: {obj}\nExpected: {compare}'
+        phases['verify'] = perf_counter() - started_verifying
 
+        record_phases(method_name, endpoint, phases)
         return obj
 
+    def record_phases(method_name: str, endpoint: str, phases: Dict[str, float]):
+        with stats_lock:
+            stats.record_phases(method_name, endpoint, phases)
+
     # NOTE:
     # some endpoints add a / at the end. This is because root endpoints
     # in FastAPI require this at the end. The server should redirect
@@ -63,390 +443,576 @@ def test_everything(url: str, logging: bool = True) -> TestStats:
     # should perhaps be considered to allow calls to endpoints with no
     # trailing /
 
-    random.seed()
-
-    user1 = User()
-
-    log('Test get user1 before creation')
-    test(get, f'/users/{user1.username}', status=404)
-
-    log('Test create user1')
-    test(post, '/users/', status=201, compare=user1, json=user1.create)
-
-    log('Test create user1 with same username')
-    test(post, '/users/', status=400, json=user1.create)
-
-    log('Test login nonexistent user')
-    test(post, '/auth/token', status=400, data=User().login)
-
-    log('Test login invalid user1 password')
-    test(post, '/auth/token', status=400, data=User(username=user1.username).login)
-
-    log('Test login user1')
-    user1_token = test(post, '/auth/token', status=200, data=user1.login)
-    assert 'access_token' in user1_token
-
-    log('Test get user1')
-    test(get, f'/users/{user1.username}', status=200, compare=user1)
-
-    log('Test get current user with user1 token')
-    test(get, '/users/me', token=user1_token, status=200, compare=user1)
-
-    log('Test edit current user bio only')
-    test(patch, '/users/me', token=user1_token, status=200, compare=user1, json=user1.edit(bio='Custom bio'))
-
-    log('Test edit current user avatar_url only')
-    test(patch, '/users/me', token=user1_token, status=200, compare=user1, json=user1.edit(avatar_url='Custom url'))
-
-    log('Test edit current user bio and avatar_url')
-    test(patch, '/users/me', token=user1_token, status=200, compare=user1,
-         json=user1.edit(bio='Custom bio 2', avatar_url='Custom url 2'))
-
-    log('Test get resubs is list')
-    response = test(get, '/resubs/', status=200)
-    assert type(response) is list
-
-    resub1 = Resub(owner_username=user1.username)
-
-    log('Test get resub1 before creation')
-    test(get, f'/resubs/{resub1.name}', status=404)
-
-    log('Test create resub1')
-    test(post, '/resubs/', status=201, token=user1_token, compare=resub1, json=resub1.create)
-
-    log('Test create resub1 with same name')
-    test(post, '/resubs/', status=400, token=user1_token, compare=resub1, json=resub1.create)
-
-    log('Test resub1 in get resubs')
-    resubs = test(get, '/resubs/', status=200)
-    assert any(resub1.compare(r) for r in resubs)
-
-    log('Test get resub1')
-    test(get, f'/resubs/{resub1.name}', status=200, compare=resub1)
-
-    log('Test get user1 resubs has resub1')
-    resubs = test(get, f'/users/{user1.username}/resubs', status=200)
-    assert any(resub1.compare(r) for r in resubs)
-
-    log('Test edit nonexistent resub description as user1')
-    test(patch, f'/resubs/{Resub(owner_username=user1.username).name}', status=404, token=user1_token,
-         json=resub1.edit(description='Nonexistent description', apply=False), skip_token_test=True)
-
-    log('Test edit resub1 description as user1')
-    test(patch, f'/resubs/{resub1.name}', status=200, token=user1_token, compare=resub1,
-         json=resub1.edit(description='User1 description'))
-
-    log('Test transfer resub1 ownership to nonexistent user')
-    test(patch, f'/resubs/{resub1.name}', status=404, token=user1_token,
-         json=resub1.edit(new_owner_username=User().username, apply=False))
-
-    user2 = User()
-
-    log('Test create user2')
-    test(post, '/users/', status=201, compare=user2, json=user2.create)
-
-    log('Test login user2')
-    user2_token = test(post, '/auth/token', status=200, data=user2.login)
-    assert 'access_token' in user2_token
-
-    log('Test edit resub1 description as user2')
-    test(patch, f'/resubs/{resub1.name}', status=403, token=user2_token,
-         json=resub1.edit(description='User2 description', apply=False))
-
-    log('Test get user2 resubs does not have resub1 before transfer ownership')
-    resubs = test(get, f'/users/{user2.username}/resubs', status=200)
-    assert not any(resub1.compare(r) for r in resubs)
-
-    log('Test transfer resub1 ownership to user2')
-    test(patch, f'/resubs/{resub1.name}', status=200, token=user1_token, compare=resub1,
-         json=resub1.edit(new_owner_username=user2.username))
-
-    log('Test edit resub1 description as user1 when user2 is owner')
-    test(patch, f'/resubs/{resub1.name}', status=403, token=user1_token,
-         json=resub1.edit(description='User1 description 2', apply=False))
-
-    log('Test edit resub1 description as user2 when user2 is owner')
-    test(patch, f'/resubs/{resub1.name}', status=200, token=user2_token, compare=resub1,
-         json=resub1.edit(description='User2 description 2'))
-
-    log('Test get user2 resubs has resub1 when user2 is owner')
-    resubs = test(get, f'/users/{user2.username}/resubs', status=200)
-    assert any(resub1.compare(r) for r in resubs)
-
-    log('Test get posts in resub1 is list')
-    posts = test(get, f'/resubs/{resub1.name}/posts/', status=200)
-    assert type(posts) is list
-
-    log('Test get posts in nonexistent resub')
-    test(get, f'/resubs/{Resub(owner_username=user1.username).name}/posts/', status=404)
-
-    post1 = Post(author_username=user1.username, parent_resub_name=resub1.name)
-
-    log('Test create post in resub1 as user1')
-    test(post, f'/resubs/{resub1.name}/posts/', status=201, token=user1_token, compare=post1, json=post1.create)
-
-    log('Test get post1')
-    test(get, f'/posts/{post1.id}', status=200, compare=post1)
-
-    post1_copy = copy(post1)
-
-    log('Test create same post in resub1 as user1')
-    test(post, f'/resubs/{resub1.name}/posts/', status=201, token=user1_token, compare=post1_copy,
-         json=post1_copy.create)
-
-    log('Test get post1_copy')
-    test(get, f'/posts/{post1_copy.id}', status=200, compare=post1_copy)
-
-    log('Test get posts in resub1 has both post1')
-    posts = test(get, f'/resubs/{resub1.name}/posts/', status=200)
-    assert any(post1.compare(p) for p in posts)
-    assert any(post1_copy.compare(p) for p in posts)
+    # NOTE:
+    # every step must require the steps that create what it uses, and the
+    # steps that must see a resource before it is changed by this step.
+    # Tokens are filled in when logging in, so steps can share them
 
+    random.seed()
+    scenario = Scenario()
+
+    shared = {} if fixtures is None else fixtures
+    user1 = shared.setdefault('user1', User())
+    user2 = shared.setdefault('user2', User())
+    user3 = shared.setdefault('user3', User())
+    user1_token = shared.setdefault('user1_token', {})
+    user2_token = shared.setdefault('user2_token', {})
+    user3_token = shared.setdefault('user3_token', {})
+    resources = shared if share_resources else {}
+    resource_fixture = ['fixture'] if share_resources else []
+    resub1 = resources.setdefault('resub1', Resub(owner_username=user1.username))
+    post1 = resources.setdefault('post1', Post(author_username=user1.username, parent_resub_name=resub1.name))
+    post1_copy = resources.setdefault('post1_copy', copy(post1))
     post2 = Post(author_username=user2.username, parent_resub_name=resub1.name)
-
-    log('Test create post in resub1 as user2')
-    test(post, f'/resubs/{resub1.name}/posts/', status=201, token=user2_token, compare=post2, json=post2.create)
-
-    log('Test get post2')
-    test(get, f'/posts/{post2.id}', status=200, compare=post2)
-
-    log('Test get nonexistent post in resub1')
-    test(get, f'/resubs/{resub1.name}/posts/9999999999', status=404)
-
-    log('Test get user1 posts has post1')
-    posts = test(get, f'/users/{user1.username}/posts', status=200)
-    assert any(post1.compare(p) for p in posts)
-
-    log('Test user1 edit post1 title')
-    test(patch, f'/posts/{post1.id}', status=200, token=user1_token, compare=post1,
-         json=post1.edit(title='Custom title'))
-
-    log('Test user1 add content to post1')
-    test(patch, f'/posts/{post1.id}', status=200, token=user1_token, compare=post1,
-         json=post1.edit(content='Custom content'))
-
-    log('Test user1 add url to post1 and remove content')
-    test(patch, f'/posts/{post1.id}', status=200, token=user1_token, compare=post1,
-         json=post1.edit(content=None, url='Custom url'))
-
-    log('Test user1 change post1 content and url')
-    test(patch, f'/posts/{post1.id}', status=200, token=user1_token, compare=post1,
-         json=post1.edit(content='Custom content 2', url='Custom url 2'))
-
-    log('Test user2 edit post1 title')
-    test(patch, f'/posts/{post1.id}', status=403, token=user2_token, json=post1.edit(title='User2 title', apply=False))
-
-    log('Test user1 set post1 title to null')
-    test(patch, f'/posts/{post1.id}', status=422, token=user1_token, json=post1.edit(title=None, apply=False))
+    comment1 = resources.get('comment1')
+    comment1_copy = resources.get('comment1_copy')
+    comment2 = comment1_reply = None
+    # The posts and comments voted on by earlier runs
+    voted = resources.setdefault('voted', set())
+
+    @scenario.step(tags=['users', 'fixture'])
+    def get_user1_before_creation():
+        log('Test get user1 before creation')
+        yield from test(get, f'/users/{user1.username}', status=404)
+
+    @scenario.step(requires=['get_user1_before_creation'], tags=['users', 'fixture'])
+    def create_user1():
+        log('Test create user1')
+        yield from test(post, '/users/', status=201, compare=user1, json=user1.create)
+
+    @scenario.step(requires=['create_user1'], tags=['users'])
+    def create_user1_again():
+        log('Test create user1 with same username')
+        yield from test(post, '/users/', status=400, json=user1.create)
+
+    @scenario.step(tags=['auth'])
+    def login_nonexistent_user():
+        log('Test login nonexistent user')
+        yield from test(post, '/auth/token', status=400, data=User().login)
+
+    @scenario.step(requires=['create_user1'], tags=['auth'])
+    def login_invalid_password():
+        log('Test login invalid user1 password')
+        yield from test(post, '/auth/token', status=400, data=User(username=user1.username).login)
+
+    @scenario.step(requires=['create_user1'], tags=['auth', 'fixture'])
+    def login_user1():
+        log('Test login user1')
+        user1_token.update((yield from test(post, '/auth/token', status=200, data=user1.login)))
+        assert 'access_token' in user1_token
+
+    @scenario.step(requires=['create_user1'], tags=['users'])
+    def get_user1():
+        log('Test get user1')
+        yield from test(get, f'/users/{user1.username}', status=200, compare=user1)
+
+    @scenario.step(requires=['login_user1'], tags=['users'])
+    def get_current_user1():
+        log('Test get current user with user1 token')
+        yield from test(get, '/users/me', token=user1_token, status=200, compare=user1)
+
+    @scenario.step(requires=['get_user1', 'get_current_user1'], tags=['users'])
+    def edit_user1():
+        log('Test edit current user bio only')
+        yield from test(patch, '/users/me', token=user1_token, status=200, compare=user1,
+                        json=user1.edit(bio='Custom bio'))
+
+        log('Test edit current user avatar_url only')
+        yield from test(patch, '/users/me', token=user1_token, status=200, compare=user1,
+                        json=user1.edit(avatar_url='Custom url'))
+
+        log('Test edit current user bio and avatar_url')
+        yield from test(patch, '/users/me', token=user1_token, status=200, compare=user1,
+             json=user1.edit(bio='Custom bio 2', avatar_url='Custom url 2'))
+
+    @scenario.step(tags=['resubs'])
+    def get_resubs():
+        log('Test get resubs is list')
+        response = yield from test(get, '/resubs/', status=200)
+        assert type(response) is list
+
+    @scenario.step(tags=['resubs'])
+    def get_resub1_before_creation():
+        log('Test get resub1 before creation')
+        yield from test(get, f'/resubs/{resub1.name}', status=404)
+
+    @scenario.step(requires=['login_user1', 'get_resub1_before_creation'], tags=['resubs', *resource_fixture])
+    def create_resub1():
+        log('Test create resub1')
+        yield from test(post, '/resubs/', status=201, token=user1_token, compare=resub1, json=resub1.create)
+
+    @scenario.step(requires=['create_resub1'], tags=['resubs'])
+    def create_resub1_again():
+        log('Test create resub1 with same name')
+        yield from test(post, '/resubs/', status=400, token=user1_token, compare=resub1, json=resub1.create)
+
+    @scenario.step(requires=['create_resub1'], tags=['resubs'])
+    def get_resubs_has_resub1():
+        log('Test resub1 in get resubs')
+        yield from test(get, '/resubs/', status=200, contains=[resub1])
+
+    @scenario.step(requires=['create_resub1'], tags=['resubs'])
+    def get_resub1():
+        log('Test get resub1')
+        yield from test(get, f'/resubs/{resub1.name}', status=200, compare=resub1)
+
+    @scenario.step(requires=['create_resub1'], tags=['resubs'])
+    def get_user1_resubs_has_resub1():
+        log('Test get user1 resubs has resub1')
+        yield from test(get, f'/users/{user1.username}/resubs', status=200, contains=[resub1])
+
+    @scenario.step(requires=['login_user1'], tags=['resubs'])
+    def edit_nonexistent_resub():
+        log('Test edit nonexistent resub description as user1')
+        yield from test(patch, f'/resubs/{Resub(owner_username=user1.username).name}', status=404, token=user1_token,
+             json=resub1.edit(description='Nonexistent description', apply=False), skip_token_test=True)
+
+    @scenario.step(requires=['get_resubs_has_resub1', 'get_resub1', 'get_user1_resubs_has_resub1'], tags=['resubs'])
+    def edit_resub1_as_user1():
+        log('Test edit resub1 description as user1')
+        yield from test(patch, f'/resubs/{resub1.name}', status=200, token=user1_token, compare=resub1,
+             json=resub1.edit(description='User1 description'))
+
+    @scenario.step(requires=['create_resub1'], tags=['resubs'])
+    def transfer_resub1_to_nonexistent_user():
+        log('Test transfer resub1 ownership to nonexistent user')
+        yield from test(patch, f'/resubs/{resub1.name}', status=404, token=user1_token,
+             json=resub1.edit(new_owner_username=User().username, apply=False))
+
+    @scenario.step(tags=['users', 'fixture'])
+    def create_user2():
+        log('Test create user2')
+        yield from test(post, '/users/', status=201, compare=user2, json=user2.create)
+
+    @scenario.step(requires=['create_user2'], tags=['auth', 'fixture'])
+    def login_user2():
+        log('Test login user2')
+        user2_token.update((yield from test(post, '/auth/token', status=200, data=user2.login)))
+        assert 'access_token' in user2_token
+
+    @scenario.step(requires=['create_resub1', 'login_user2'], tags=['resubs'])
+    def edit_resub1_as_user2():
+        log('Test edit resub1 description as user2')
+        yield from test(patch, f'/resubs/{resub1.name}', status=403, token=user2_token,
+             json=resub1.edit(description='User2 description', apply=False))
+
+    @scenario.step(requires=['create_resub1', 'create_user2'], tags=['resubs'])
+    def get_user2_resubs_before_transfer():
+        log('Test get user2 resubs does not have resub1 before transfer ownership')
+        yield from test(get, f'/users/{user2.username}/resubs', status=200, excludes=[resub1])
+
+    @scenario.step(requires=['edit_resub1_as_user1', 'transfer_resub1_to_nonexistent_user', 'edit_resub1_as_user2',
+                             'get_user2_resubs_before_transfer'], tags=['resubs'])
+    def transfer_resub1_to_user2():
+        log('Test transfer resub1 ownership to user2')
+        yield from test(patch, f'/resubs/{resub1.name}', status=200, token=user1_token, compare=resub1,
+             json=resub1.edit(new_owner_username=user2.username))
+
+    @scenario.step(requires=['transfer_resub1_to_user2'], tags=['resubs'])
+    def edit_resub1_as_previous_owner():
+        log('Test edit resub1 description as user1 when user2 is owner')
+        yield from test(patch, f'/resubs/{resub1.name}', status=403, token=user1_token,
+             json=resub1.edit(description='User1 description 2', apply=False))
+
+    @scenario.step(requires=['transfer_resub1_to_user2'], tags=['resubs'])
+    def edit_resub1_as_owner_user2():
+        log('Test edit resub1 description as user2 when user2 is owner')
+        yield from test(patch, f'/resubs/{resub1.name}', status=200, token=user2_token, compare=resub1,
+             json=resub1.edit(description='User2 description 2'))
+
+    @scenario.step(requires=['edit_resub1_as_owner_user2'], tags=['resubs'])
+    def get_user2_resubs_after_transfer():
+        log('Test get user2 resubs has resub1 when user2 is owner')
+        yield from test(get, f'/users/{user2.username}/resubs', status=200, contains=[resub1])
+
+    @scenario.step(requires=['create_resub1'], tags=['posts'])
+    def get_resub1_posts():
+        log('Test get posts in resub1 is list')
+        posts = yield from test(get, f'/resubs/{resub1.name}/posts/', status=200)
+        assert type(posts) is list
+
+    @scenario.step(tags=['posts'])
+    def get_posts_in_nonexistent_resub():
+        log('Test get posts in nonexistent resub')
+        yield from test(get, f'/resubs/{Resub(owner_username=user1.username).name}/posts/', status=404)
+
+    @scenario.step(requires=['create_resub1'], tags=['posts', *resource_fixture])
+    def create_post1():
+        log('Test create post in resub1 as user1')
+        yield from test(post, f'/resubs/{resub1.name}/posts/', status=201, token=user1_token, compare=post1,
+                        json=post1.create)
+
+    @scenario.step(requires=['create_post1'], tags=['posts'])
+    def get_post1():
+        log('Test get post1')
+        yield from test(get, f'/posts/{post1.id}', status=200, compare=post1)
+
+    @scenario.step(requires=['create_resub1'], tags=['posts', *resource_fixture])
+    def create_post1_copy():
+        log('Test create same post in resub1 as user1')
+        yield from test(post, f'/resubs/{resub1.name}/posts/', status=201, token=user1_token, compare=post1_copy,
+             json=post1_copy.create)
+
+    @scenario.step(requires=['create_post1_copy'], tags=['posts'])
+    def get_post1_copy():
+        log('Test get post1_copy')
+        yield from test(get, f'/posts/{post1_copy.id}', status=200, compare=post1_copy)
+
+    @scenario.step(requires=['create_post1', 'create_post1_copy'], tags=['posts'])
+    def get_resub1_posts_has_post1():
+        log('Test get posts in resub1 has both post1')
+        yield from test(get, f'/resubs/{resub1.name}/posts/', status=200, contains=[post1, post1_copy])
+
+    @scenario.step(requires=['create_resub1', 'login_user2'], tags=['posts'])
+    def create_post2():
+        log('Test create post in resub1 as user2')
+        yield from test(post, f'/resubs/{resub1.name}/posts/', status=201, token=user2_token, compare=post2,
+                        json=post2.create)
+
+    @scenario.step(requires=['create_post2'], tags=['posts'])
+    def get_post2():
+        log('Test get post2')
+        yield from test(get, f'/posts/{post2.id}', status=200, compare=post2)
+
+    @scenario.step(requires=['create_resub1'], tags=['posts'])
+    def get_nonexistent_post_in_resub1():
+        log('Test get nonexistent post in resub1')
+        yield from test(get, f'/resubs/{resub1.name}/posts/9999999999', status=404)
+
+    @scenario.step(requires=['create_post1'], tags=['posts'])
+    def get_user1_posts_has_post1():
+        log('Test get user1 posts has post1')
+        yield from test(get, f'/users/{user1.username}/posts', status=200, contains=[post1])
+
+    @scenario.step(requires=['get_post1', 'get_resub1_posts_has_post1', 'get_user1_posts_has_post1'], tags=['posts'])
+    def edit_post1():
+        log('Test user1 edit post1 title')
+        yield from test(patch, f'/posts/{post1.id}', status=200, token=user1_token, compare=post1,
+             json=post1.edit(title='Custom title'))
+
+        log('Test user1 add content to post1')
+        yield from test(patch, f'/posts/{post1.id}', status=200, token=user1_token, compare=post1,
+             json=post1.edit(content='Custom content'))
+
+        log('Test user1 add url to post1 and remove content')
+        yield from test(patch, f'/posts/{post1.id}', status=200, token=user1_token, compare=post1,
+             json=post1.edit(content=None, url='Custom url'))
+
+        log('Test user1 change post1 content and url')
+        yield from test(patch, f'/posts/{post1.id}', status=200, token=user1_token, compare=post1,
+             json=post1.edit(content='Custom content 2', url='Custom url 2'))
+
+    @scenario.step(requires=['create_post1', 'login_user2'], tags=['posts'])
+    def edit_post1_as_user2():
+        log('Test user2 edit post1 title')
+        yield from test(patch, f'/posts/{post1.id}', status=403, token=user2_token,
+             json=post1.edit(title='User2 title', apply=False))
+
+    @scenario.step(requires=['create_post1'], tags=['posts'])
+    def edit_post1_title_to_null():
+        log('Test user1 set post1 title to null')
+        yield from test(patch, f'/posts/{post1.id}', status=422, token=user1_token, json=post1.edit(title=None,
+                        apply=False))
 
     def test_vote_entity(path: str, entity_name: str, entity: Union[Post, Comment]):
+        if entity_name in voted:
+            log(f'Reset the votes of user2 on {entity_name} from an earlier run')
+            yield from test(patch, f'{path}/vote/0', status=200, token=user2_token, skip_token_test=True)
+            entity.votes = 0
+        voted.add(entity_name)
+
         log(f'Test user1 vote -2 {entity_name}')
-        test(patch, f'{path}/vote/-2', status=422, token=user1_token)
+        yield from test(patch, f'{path}/vote/-2', status=422, token=user1_token)
 
         log(f'Test user1 vote 2 {entity_name}')
-        test(patch, f'{path}/vote/2', status=422, token=user1_token)
+        yield from test(patch, f'{path}/vote/2', status=422, token=user1_token)
 
         log(f'Test user1 vote 0 {entity_name}')
-        test(patch, f'{path}/vote/0', status=200, token=user1_token, compare=entity)
+        yield from test(patch, f'{path}/vote/0', status=200, token=user1_token, compare=entity)
 
         log(f'Test user1 vote -1 {entity_name}')
         entity.votes = -1
-        test(patch, f'{path}/vote/-1', status=200, token=user1_token, compare=entity)
+        yield from test(patch, f'{path}/vote/-1', status=200, token=user1_token, compare=entity)
 
         log(f'Test user1 vote -1 {entity_name} again')
-        test(patch, f'{path}/vote/-1', status=200, token=user1_token, compare=entity)
+        yield from test(patch, f'{path}/vote/-1', status=200, token=user1_token, compare=entity)
 
         log(f'Test user2 vote -1 {entity_name}')
         entity.votes = -2
-        test(patch, f'{path}/vote/-1', status=200, token=user2_token, compare=entity)
+        yield from test(patch, f'{path}/vote/-1', status=200, token=user2_token, compare=entity)
 
         log(f'Test user1 vote 1 {entity_name}')
         entity.votes = 0
-        test(patch, f'{path}/vote/1', status=200, token=user1_token, compare=entity)
+        yield from test(patch, f'{path}/vote/1', status=200, token=user1_token, compare=entity)
 
         log(f'Test user2 vote 0 {entity_name}')
         entity.votes = 1
-        test(patch, f'{path}/vote/0', status=200, token=user2_token, compare=entity)
+        yield from test(patch, f'{path}/vote/0', status=200, token=user2_token, compare=entity)
 
         log(f'Test user2 vote 1 {entity_name}')
         entity.votes = 2
-        test(patch, f'{path}/vote/1', status=200, token=user2_token, compare=entity)
-
-    test_vote_entity(f'/posts/{post1.id}', 'post1', post1)
-
-    log('Test get post1 has correct votes')
-    test(get, f'/posts/{post1.id}', status=200, compare=post1)
-
-    log('Test get comments from post1 is list')
-    comments = test(get, f'/posts/{post1.id}/comments/', status=200)
-    assert type(comments) is list
-
-    log('Test get comments from nonexistent post')
-    test(get, f'/resubs/{resub1.name}/posts/9999999999/comments/', status=404)
-
-    comment1 = Comment(author_username=user1.username, parent_resub_name=resub1.name, parent_post_id=post1.id)
-
-    log('Test create comment in post1 from user1')
-    test(post, f'/posts/{post1.id}/comments/', status=201, token=user1_token, compare=comment1, json=comment1.create)
-
-    comment1_copy = copy(comment1)
-
-    log('Test create same comment in post1 from user1')
-    test(post, f'/posts/{post1.id}/comments/', status=201, token=user1_token, compare=comment1_copy,
-         json=comment1_copy.create)
-
-    log('Test get comments in post1 has both comment1')
-    comments = test(get, f'/posts/{post1.id}/comments/', status=200)
-    assert any(comment1.compare(c) for c in comments)
-    assert any(comment1_copy.compare(c) for c in comments)
-
-    log('Test get user1 comments has comment1')
-    comments = test(get, f'/users/{user1.username}/comments/', status=200)
-    assert any(comment1.compare(c) for c in comments)
-
-    comment2 = Comment(author_username=user2.username, parent_resub_name=resub1.name, parent_post_id=post1.id)
-
-    log('Test create comment in post1 as user2')
-    test(post, f'/posts/{post1.id}/comments/', status=201, token=user2_token, compare=comment2, json=comment2.create)
-
-    comment1_reply = Comment(author_username=user2.username, parent_resub_name=resub1.name, parent_post_id=post1.id,
-                             parent_comment_id=comment1.id)
-
-    log('Test create reply to comment1 as user2')
-    test(post, f'/comments/{comment1.id}', status=201, token=user2_token, compare=comment1_reply,
-         json=comment1_reply.create)
-
-    log('Test edit comment1 content as user1')
-    test(patch, f'/comments/{comment1.id}', status=200, token=user1_token, compare=comment1,
-         json=comment1.edit(content='Custom content'))
-
-    log('Test set comment1 content to null')
-    test(patch, f'/comments/{comment1.id}', status=422, token=user1_token,
-         json=comment1.edit(content=None, apply=False))
-
-    log('Test edit comment1 as user2')
-    test(patch, f'/comments/{comment1.id}', status=403, token=user2_token,
-         json=comment1.edit(content='User2 content', apply=False))
-
-    test_vote_entity(f'/comments/{comment1.id}', 'comment1', comment1)
-
-    log('Test get comemnts in post1 has comment1 with correct votes')
-    comments = test(get, f'/posts/{post1.id}/comments/', status=200)
-    assert any(comment1.compare(c) for c in comments)
-
-    user3 = User()
-
-    log('Test create user3')
-    test(post, f'/users/', status=201, compare=user3, json=user3.create)
-
-    log('Test login user3')
-    user3_token = test(post, '/auth/token', status=200, data=user3.login)
-    assert 'access_token' in user3_token
-
-    log('Test delete comment1_reply as user3 (neither resub owner nor comment author)')
-    test(delete, f'/comments/{comment1_reply.id}', status=403, token=user3_token)
-
-    log('Test delete comment1_reply as user2 (comment author and resub owner)')
-    test(delete, f'/comments/{comment1_reply.id}', status=204, token=user2_token)
-
-    log('Test delete comment2 as user1 (neither resub owner nor comment author)')
-    test(delete, f'/comments/{comment2.id}', status=403, token=user1_token)
-
-    log('Test delete comment2 as user2 (comment author)')
-    test(delete, f'/comments/{comment2.id}', status=204, token=user2_token)
-
-    log('Test get user2 comments no longer has comment2 and comment1_reply after deleting')
-    comments = test(get, f'/users/{user2.username}/comments', status=200)
-    assert not any(comment2.compare(c) for c in comments)
-    assert not any(comment1_reply.compare(c) for c in comments)
-
-    log('Test delete comment1_copy as user2 (resub owner)')
-    test(delete, f'/comments/{comment1_copy.id}', status=204, token=user2_token)
-
-    log('Test delete comment1 as user1 (comment author)')
-    test(delete, f'/comments/{comment1.id}', status=204, token=user1_token)
-
-    log('Test get user1 comments no longer has comment1 and comment1_copy after deleting')
-    comments = test(get, f'/users/{user1.username}/comments', status=200)
-    assert not any(comment1.compare(c) for c in comments)
-    assert not any(comment1_copy.compare(c) for c in comments)
-
-    log('Test get comments in post1 no longer has comment1, comment2, comment1_copy and comment1_reply')
-    comments = test(get, f'/posts/{post1.id}/comments/', status=200)
-    assert not any(comment1.compare(c) for c in comments)
-    assert not any(comment2.compare(c) for c in comments)
-    assert not any(comment1_copy.compare(c) for c in comments)
-    assert not any(comment1_reply.compare(c) for c in comments)
-
-    log('Test delete post2 as user1 (neither resub owner nor post author')
-    test(delete, f'/posts/{post2.id}', status=403, token=user1_token)
-
-    log('Test delete post2 as user2 (resub owner and post author)')
-    test(delete, f'/posts/{post2.id}', status=204, token=user2_token)
-
-    log('Test get post2 after deleting')
-    test(get, f'/posts/{post2.id}', status=404)
-
-    log('Test get user2 posts no longer has post2 after deleting')
-    posts = test(get, f'/users/{user2.username}/posts', status=200)
-    assert not any(post2.compare(p) for p in posts)
-
-    log('Test delete post1 as user2 (resub owner)')
-    test(delete, f'/posts/{post1.id}', status=204, token=user2_token)
-
-    log('Test get post1 after deleting')
-    test(get, f'/posts/{post1.id}', status=404)
-
-    log('Test delete post1_copy as user1 (post author)')
-    test(delete, f'/posts/{post1_copy.id}', status=204, token=user1_token)
-
-    log('Test get post1_copy after deleting')
-    test(get, f'/posts/{post1_copy.id}', status=404)
-
-    log('Test get user1 posts no longer has post1 and post1_copy after deleting')
-    posts = test(get, f'/users/{user1.username}/posts', status=200)
-    assert not any(post1.compare(p) for p in posts)
-    assert not any(post1_copy.compare(p) for p in posts)
-
-    log('Test get posts in resub1 no longer has post1, post2 and post1_copy')
-    posts = test(get, f'/resubs/{resub1.name}/posts', status=200)
-    assert not any(post1.compare(p) for p in posts)
-    assert not any(post2.compare(p) for p in posts)
-    assert not any(post1_copy.compare(p) for p in posts)
-
-    log('Test delete resub1 as user1 (previous resub owner)')
-    test(delete, f'/resubs/{resub1.name}', status=403, token=user1_token)
-
-    log('Test delete resub1 as user2 (resub owner)')
-    test(delete, f'/resubs/{resub1.name}', status=204, token=user2_token)
-
-    log('Test get resub1 after deleting')
-    test(get, f'/resubs/{resub1.name}', status=404)
-
-    log('Test get resubs no longer has resub1')
-    resubs = test(get, f'/resubs/', status=200)
-    assert not any(resub1.compare(r) for r in resubs)
-
-    log('Test get user2 resubs no longer has resub1 after deleting')
-    resubs = test(get, f'/users/{user2.username}/resubs', status=200)
-    assert not any(resub1.compare(r) for r in resubs)
+        yield from test(patch, f'{path}/vote/1', status=200, token=user2_token, compare=entity)
+
+    @scenario.step(requires=['edit_post1', 'login_user2'], tags=['votes'])
+    def vote_post1():
+        yield from test_vote_entity(f'/posts/{post1.id}', 'post1', post1)
+
+    @scenario.step(requires=['vote_post1'], tags=['votes'])
+    def get_post1_votes():
+        log('Test get post1 has correct votes')
+        yield from test(get, f'/posts/{post1.id}', status=200, compare=post1)
+
+    @scenario.step(requires=['create_post1'], tags=['comments'])
+    def get_post1_comments():
+        log('Test get comments from post1 is list')
+        comments = yield from test(get, f'/posts/{post1.id}/comments/', status=200)
+        assert type(comments) is list
+
+    @scenario.step(requires=['create_resub1'], tags=['comments'])
+    def get_comments_from_nonexistent_post():
+        log('Test get comments from nonexistent post')
+        yield from test(get, f'/resubs/{resub1.name}/posts/9999999999/comments/', status=404)
+
+    @scenario.step(requires=['create_post1'], tags=['comments', *resource_fixture])
+    def create_comment1():
+        nonlocal comment1, comment1_copy
+        comment1 = resources['comment1'] = Comment(author_username=user1.username, parent_resub_name=resub1.name,
+                                                   parent_post_id=post1.id)
+
+        log('Test create comment in post1 from user1')
+        yield from test(post, f'/posts/{post1.id}/comments/', status=201, token=user1_token, compare=comment1,
+             json=comment1.create)
+
+        comment1_copy = resources['comment1_copy'] = copy(comment1)
+
+    @scenario.step(requires=['create_comment1'], tags=['comments', *resource_fixture])
+    def create_comment1_copy():
+        log('Test create same comment in post1 from user1')
+        yield from test(post, f'/posts/{post1.id}/comments/', status=201, token=user1_token, compare=comment1_copy,
+             json=comment1_copy.create)
+
+    @scenario.step(requires=['create_comment1_copy'], tags=['comments'])
+    def get_post1_comments_has_comment1():
+        log('Test get comments in post1 has both comment1')
+        yield from test(get, f'/posts/{post1.id}/comments/', status=200, contains=[comment1, comment1_copy])
+
+    @scenario.step(requires=['create_comment1'], tags=['comments'])
+    def get_user1_comments_has_comment1():
+        log('Test get user1 comments has comment1')
+        yield from test(get, f'/users/{user1.username}/comments/', status=200, contains=[comment1])
+
+    @scenario.step(requires=['create_post1', 'login_user2'], tags=['comments'])
+    def create_comment2():
+        nonlocal comment2
+        comment2 = Comment(author_username=user2.username, parent_resub_name=resub1.name, parent_post_id=post1.id)
+
+        log('Test create comment in post1 as user2')
+        yield from test(post, f'/posts/{post1.id}/comments/', status=201, token=user2_token, compare=comment2,
+             json=comment2.create)
+
+    @scenario.step(requires=['create_comment1', 'login_user2'], tags=['comments'])
+    def create_comment1_reply():
+        nonlocal comment1_reply
+        comment1_reply = Comment(author_username=user2.username, parent_resub_name=resub1.name,
+                                 parent_post_id=post1.id, parent_comment_id=comment1.id)
+
+        log('Test create reply to comment1 as user2')
+        yield from test(post, f'/comments/{comment1.id}', status=201, token=user2_token, compare=comment1_reply,
+             json=comment1_reply.create)
+
+    @scenario.step(requires=['get_post1_comments_has_comment1', 'get_user1_comments_has_comment1'], tags=['comments'])
+    def edit_comment1():
+        log('Test edit comment1 content as user1')
+        yield from test(patch, f'/comments/{comment1.id}', status=200, token=user1_token, compare=comment1,
+             json=comment1.edit(content='Custom content'))
+
+    @scenario.step(requires=['create_comment1'], tags=['comments'])
+    def edit_comment1_content_to_null():
+        log('Test set comment1 content to null')
+        yield from test(patch, f'/comments/{comment1.id}', status=422, token=user1_token,
+             json=comment1.edit(content=None, apply=False))
+
+    @scenario.step(requires=['create_comment1', 'login_user2'], tags=['comments'])
+    def edit_comment1_as_user2():
+        log('Test edit comment1 as user2')
+        yield from test(patch, f'/comments/{comment1.id}', status=403, token=user2_token,
+             json=comment1.edit(content='User2 content', apply=False))
+
+    @scenario.step(requires=['edit_comment1', 'login_user2'], tags=['votes'])
+    def vote_comment1():
+        yield from test_vote_entity(f'/comments/{comment1.id}', 'comment1', comment1)
+
+    @scenario.step(requires=['vote_comment1'], tags=['votes'])
+    def get_post1_comments_has_comment1_votes():
+        log('Test get comemnts in post1 has comment1 with correct votes')
+        yield from test(get, f'/posts/{post1.id}/comments/', status=200, contains=[comment1])
+
+    @scenario.step(tags=['users', 'fixture'])
+    def create_user3():
+        log('Test create user3')
+        yield from test(post, f'/users/', status=201, compare=user3, json=user3.create)
+
+    @scenario.step(requires=['create_user3'], tags=['auth', 'fixture'])
+    def login_user3():
+        log('Test login user3')
+        user3_token.update((yield from test(post, '/auth/token', status=200, data=user3.login)))
+        assert 'access_token' in user3_token
+
+    @scenario.step(requires=['create_comment1_reply', 'login_user3'], tags=['deletion'])
+    def delete_comment1_reply_as_user3():
+        log('Test delete comment1_reply as user3 (neither resub owner nor comment author)')
+        yield from test(delete, f'/comments/{comment1_reply.id}', status=403, token=user3_token)
+
+    @scenario.step(requires=['delete_comment1_reply_as_user3'], tags=['deletion'])
+    def delete_comment1_reply():
+        log('Test delete comment1_reply as user2 (comment author and resub owner)')
+        yield from test(delete, f'/comments/{comment1_reply.id}', status=204, token=user2_token)
+
+    @scenario.step(requires=['create_comment2', 'transfer_resub1_to_user2'], tags=['deletion'])
+    def delete_comment2_as_user1():
+        log('Test delete comment2 as user1 (neither resub owner nor comment author)')
+        yield from test(delete, f'/comments/{comment2.id}', status=403, token=user1_token)
+
+    @scenario.step(requires=['delete_comment2_as_user1'], tags=['deletion'])
+    def delete_comment2():
+        log('Test delete comment2 as user2 (comment author)')
+        yield from test(delete, f'/comments/{comment2.id}', status=204, token=user2_token)
+
+    @scenario.step(requires=['delete_comment1_reply', 'delete_comment2'], tags=['deletion'])
+    def get_user2_comments_after_deleting():
+        log('Test get user2 comments no longer has comment2 and comment1_reply after deleting')
+        yield from test(get, f'/users/{user2.username}/comments', status=200, excludes=[comment2, comment1_reply])
+
+    @scenario.step(requires=['get_post1_comments_has_comment1', 'transfer_resub1_to_user2'], tags=['deletion'])
+    def delete_comment1_copy():
+        log('Test delete comment1_copy as user2 (resub owner)')
+        yield from test(delete, f'/comments/{comment1_copy.id}', status=204, token=user2_token)
+
+    @scenario.step(requires=['get_post1_comments_has_comment1_votes', 'edit_comment1_content_to_null',
+                             'edit_comment1_as_user2', 'delete_comment1_reply'], tags=['deletion'])
+    def delete_comment1():
+        log('Test delete comment1 as user1 (comment author)')
+        yield from test(delete, f'/comments/{comment1.id}', status=204, token=user1_token)
+
+    @scenario.step(requires=['delete_comment1_copy', 'delete_comment1'], tags=['deletion'])
+    def get_user1_comments_after_deleting():
+        log('Test get user1 comments no longer has comment1 and comment1_copy after deleting')
+        yield from test(get, f'/users/{user1.username}/comments', status=200, excludes=[comment1, comment1_copy])
+
+    @scenario.step(requires=['delete_comment1', 'delete_comment1_copy', 'delete_comment2', 'delete_comment1_reply'],
+                   tags=['deletion'])
+    def get_post1_comments_after_deleting():
+        log('Test get comments in post1 no longer has comment1, comment2, comment1_copy and comment1_reply')
+        yield from test(get, f'/posts/{post1.id}/comments/', status=200,
+             excludes=[comment1, comment2, comment1_copy, comment1_reply])
+
+    @scenario.step(requires=['get_post2', 'transfer_resub1_to_user2'], tags=['deletion'])
+    def delete_post2_as_user1():
+        log('Test delete post2 as user1 (neither resub owner nor post author')
+        yield from test(delete, f'/posts/{post2.id}', status=403, token=user1_token)
+
+    @scenario.step(requires=['delete_post2_as_user1'], tags=['deletion'])
+    def delete_post2():
+        log('Test delete post2 as user2 (resub owner and post author)')
+        yield from test(delete, f'/posts/{post2.id}', status=204, token=user2_token)
+
+    @scenario.step(requires=['delete_post2'], tags=['deletion'])
+    def get_post2_after_deleting():
+        log('Test get post2 after deleting')
+        yield from test(get, f'/posts/{post2.id}', status=404)
+
+    @scenario.step(requires=['delete_post2'], tags=['deletion'])
+    def get_user2_posts_after_deleting():
+        log('Test get user2 posts no longer has post2 after deleting')
+        yield from test(get, f'/users/{user2.username}/posts', status=200, excludes=[post2])
+
+    @scenario.step(requires=['get_post1_votes', 'edit_post1_as_user2', 'edit_post1_title_to_null',
+                             'get_post1_comments', 'get_user2_comments_after_deleting',
+                             'get_user1_comments_after_deleting', 'get_post1_comments_after_deleting'],
+                   tags=['deletion'])
+    def delete_post1():
+        log('Test delete post1 as user2 (resub owner)')
+        yield from test(delete, f'/posts/{post1.id}', status=204, token=user2_token)
+
+    @scenario.step(requires=['delete_post1'], tags=['deletion'])
+    def get_post1_after_deleting():
+        log('Test get post1 after deleting')
+        yield from test(get, f'/posts/{post1.id}', status=404)
+
+    @scenario.step(requires=['get_post1_copy', 'get_resub1_posts_has_post1'], tags=['deletion'])
+    def delete_post1_copy():
+        log('Test delete post1_copy as user1 (post author)')
+        yield from test(delete, f'/posts/{post1_copy.id}', status=204, token=user1_token)
+
+    @scenario.step(requires=['delete_post1_copy'], tags=['deletion'])
+    def get_post1_copy_after_deleting():
+        log('Test get post1_copy after deleting')
+        yield from test(get, f'/posts/{post1_copy.id}', status=404)
+
+    @scenario.step(requires=['delete_post1', 'delete_post1_copy'], tags=['deletion'])
+    def get_user1_posts_after_deleting():
+        log('Test get user1 posts no longer has post1 and post1_copy after deleting')
+        yield from test(get, f'/users/{user1.username}/posts', status=200, excludes=[post1, post1_copy])
+
+    @scenario.step(requires=['delete_post1', 'delete_post2', 'delete_post1_copy'], tags=['deletion'])
+    def get_resub1_posts_after_deleting():
+        log('Test get posts in resub1 no longer has post1, post2 and post1_copy')
+        yield from test(get, f'/resubs/{resub1.name}/posts', status=200, excludes=[post1, post2, post1_copy])
+
+    @scenario.step(requires=['transfer_resub1_to_user2'], tags=['deletion'])
+    def delete_resub1_as_user1():
+        log('Test delete resub1 as user1 (previous resub owner)')
+        yield from test(delete, f'/resubs/{resub1.name}', status=403, token=user1_token)
+
+    @scenario.step(requires=['delete_resub1_as_user1', 'create_resub1_again', 'edit_nonexistent_resub',
+                             'edit_resub1_as_previous_owner', 'get_user2_resubs_after_transfer', 'get_resub1_posts',
+                             'get_nonexistent_post_in_resub1', 'get_comments_from_nonexistent_post',
+                             'get_post1_after_deleting', 'get_post1_copy_after_deleting', 'get_post2_after_deleting',
+                             'get_user2_posts_after_deleting', 'get_user1_posts_after_deleting',
+                             'get_resub1_posts_after_deleting'], tags=['deletion'])
+    def delete_resub1():
+        log('Test delete resub1 as user2 (resub owner)')
+        yield from test(delete, f'/resubs/{resub1.name}', status=204, token=user2_token)
+
+    @scenario.step(requires=['delete_resub1'], tags=['deletion'])
+    def get_resub1_after_deleting():
+        log('Test get resub1 after deleting')
+        yield from test(get, f'/resubs/{resub1.name}', status=404)
+
+    @scenario.step(requires=['delete_resub1'], tags=['deletion'])
+    def get_resubs_after_deleting():
+        log('Test get resubs no longer has resub1')
+        yield from test(get, f'/resubs/', status=200, excludes=[resub1])
+
+    @scenario.step(requires=['delete_resub1'], tags=['deletion'])
+    def get_user2_resubs_after_deleting():
+        log('Test get user2 resubs no longer has resub1 after deleting')
+        yield from test(get, f'/users/{user2.username}/resubs', status=200, excludes=[resub1])
 
     def test_delete_user(user_model_name: str, user: User, user_token):
         log(f'Test delete {user_model_name}')
-        test(delete, f'/users/me', status=204, token=user_token)
+        yield from test(delete, f'/users/me', status=204, token=user_token)
 
         log(f'Test get {user_model_name} after deleting')
-        test(get, f'/users/{user.username}', status=404)
+        yield from test(get, f'/users/{user.username}', status=404)
 
         log(f'Test get current user with {user_model_name} token is unauthorized (test invalid token)')
-        test(get, f'/users/me', status=401, token=user_token)
+        yield from test(get, f'/users/me', status=401, token=user_token)
 
         log(f'Test login as {user_model_name} no longer possible')
-        test(post, f'/auth/token', status=400, data=user.login)
+        yield from test(post, f'/auth/token', status=400, data=user.login)
 
-    test_delete_user('user3', user3, user3_token)
-    test_delete_user('user2', user2, user2_token)
-    test_delete_user('user1', user1, user1_token)
+    # Users are deleted last, when every other step is done
+    @scenario.step(requires=['login_user3'], tags=['teardown'], cleanup=True)
+    def delete_user3():
+        yield from test_delete_user('user3', user3, user3_token)
 
-    stats.elapsed_seconds = (datetime.now() - started).total_seconds()
-    return stats
+    @scenario.step(requires=['login_user2'], tags=['teardown'], cleanup=True)
+    def delete_user2():
+        yield from test_delete_user('user2', user2, user2_token)
+
+    @scenario.step(requires=['login_user1'], tags=['teardown'], cleanup=True)
+    def delete_user1():
+        yield from test_delete_user('user1', user1, user1_token)
+
+    return scenario
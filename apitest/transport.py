@@ -0,0 +1,225 @@
+import zlib
+from threading import local
+from time import perf_counter
+from typing import Iterator
+
+from requests import RequestException, Session
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import HTTPError
+from urllib3.util.retry import Retry
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Errors sending a request or reading its response, such as timeouts and refused or reset connections.
+# Streamed responses are read with urllib3, whose errors are not wrapped by requests
+TRANSPORT_ERRORS = (RequestException, HTTPError, OSError)
+
+# Seconds spent opening connections during the current request of every thread
+_connect_seconds = local()
+
+
+class TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        started = perf_counter()
+        super().connect()
+        _connect_seconds.value = getattr(_connect_seconds, 'value', 0) + perf_counter() - started
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        started = perf_counter()
+        super().connect()
+        _connect_seconds.value = getattr(_connect_seconds, 'value', 0) + perf_counter() - started
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """An HTTPAdapter that measures the time spent opening new connections."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': TimedHTTPConnectionPool,
+                                                   'https': TimedHTTPSConnectionPool}
+
+
+class Decoder:
+    """Decompresses a body encoded with the codings of a Content-Encoding header.
+
+    Brotli needs the optional brotli package.
+    """
+
+    def __init__(self, content_encoding: str = None):
+        # Pairs of decompress and flush functions, in the order to decode with
+        self.decoders = []
+        for coding in reversed((content_encoding or '').split(',')):
+            coding = coding.strip().lower()
+            if coding in ('gzip', 'x-gzip'):
+                decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                self.decoders.append((decoder.decompress, decoder.flush))
+            elif coding == 'deflate':
+                decoder = zlib.decompressobj()
+                self.decoders.append((decoder.decompress, decoder.flush))
+            elif coding == 'br':
+                if brotli is None:
+                    raise ValueError('decoding brotli responses needs the brotli package')
+                self.decoders.append((brotli.Decompressor().process, lambda: b''))
+            elif coding not in ('', 'identity'):
+                raise ValueError(f'unknown content encoding {coding}')
+
+    def decompress(self, data: bytes) -> bytes:
+        for decompress, _ in self.decoders:
+            data = decompress(data)
+        return data
+
+    def flush(self) -> bytes:
+        data = b''
+        for decompress, flush in self.decoders:
+            data = decompress(data) + flush() if data else flush()
+        return data
+
+
+def iter_decoded(response, chunk_size: int) -> Iterator[bytes]:
+    """Iterate over the decompressed body of a streamed response.
+
+    When done, the sizes of the response are in response.sizes, and the
+    time spent decompressing in response.phases['decompress']. Responses
+    that are not streamed from a socket have been decompressed already, and
+    are iterated as they are.
+    """
+    if getattr(response, 'raw', None) is None:
+        yield from response.iter_content(chunk_size)
+        return
+
+    decoder = Decoder(response.headers.get('Content-Encoding'))
+    received = decoded = 0
+    seconds = 0
+    for chunk in response.raw.stream(chunk_size, decode_content=False):
+        received += len(chunk)
+        started = perf_counter()
+        chunk = decoder.decompress(chunk)
+        seconds += perf_counter() - started
+        decoded += len(chunk)
+        if chunk:
+            yield chunk
+
+    started = perf_counter()
+    chunk = decoder.flush()
+    seconds += perf_counter() - started
+    decoded += len(chunk)
+    response.sizes.update(response=received, decoded=decoded)
+    response.phases['decompress'] = seconds
+    if chunk:
+        yield chunk
+
+
+class Transport:
+    """Sends the HTTP requests of a test run.
+
+    By default requests go through a single keep-alive session with a
+    connection pool, so a transport can be shared by every call in a run, or
+    by every run in a benchmark. With pooled=False, every request opens a new
+    connection like the module level requests functions do.
+
+    Every response has the seconds spent in each phase of the request in
+    response.phases: connect (zero when a pooled connection was reused),
+    ttfb (from sending the request to receiving the headers) and download
+    (reading the body) and decompress. The body is not read with stream=True,
+    so download is then left to the caller, e.g. iter_decoded.
+
+    Every response also has its sizes in bytes in response.sizes: request
+    (the request body), response (the body as received, maybe compressed)
+    and decoded (the decompressed body). By default, the compressions
+    requests can decode are accepted, and accept_encoding replaces the
+    Accept-Encoding header, e.g. with identity to turn compression off.
+    """
+
+    def __init__(self, pooled: bool = True, pool_size: int = 10, keep_alive: bool = True, retries: int = 0,
+                 accept_encoding: str = None):
+        self.pooled = pooled
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.retries = retries
+        self.accept_encoding = accept_encoding
+        self.session = None
+
+        if pooled:
+            self.session = self._create_session()
+
+    def _create_session(self) -> Session:
+        # Only connection errors are retried, as retrying a request the
+        # server has already seen would change the outcome of the test
+        retry = Retry(total=self.retries, connect=self.retries, read=0, status=0, redirect=0)
+        adapter = TimedHTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+
+        session = Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        if self.accept_encoding:
+            session.headers['Accept-Encoding'] = self.accept_encoding
+
+        return session
+
+    def __repr__(self):
+        if not self.pooled:
+            return 'Transport(pooled=False)'
+
+        encoding = f', accept_encoding={self.accept_encoding!r}' if self.accept_encoding else ''
+        return (f'Transport(pool_size={self.pool_size}, keep_alive={self.keep_alive}, '
+                f'retries={self.retries}{encoding})')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def request(self, method: str, url: str, **kwargs):
+        """Send a request and return the response."""
+        if self.session is None:
+            # A new session for every request, like the module level requests functions
+            with self._create_session() as session:
+                return self._timed_request(session, method, url, **kwargs)
+
+        return self._timed_request(self.session, method, url, **kwargs)
+
+    @staticmethod
+    def _timed_request(session: Session, method: str, url: str, stream: bool = False, **kwargs):
+        _connect_seconds.value = 0
+        started = perf_counter()
+        # The body is read separately to time the download
+        response = session.request(method, url, stream=True, **kwargs)
+        headers_received = perf_counter()
+        connect = _connect_seconds.value
+        response.phases = {'connect': connect, 'ttfb': headers_received - started - connect}
+        body = response.request.body
+        response.sizes = {'request': len(body) if body else 0}
+        if not stream:
+            # The body is read as received and decompressed separately to time both
+            received = response.raw.read(decode_content=False) or b''
+            decompressing = perf_counter()
+            response.phases['download'] = decompressing - headers_received
+            decoder = Decoder(response.headers.get('Content-Encoding'))
+            response._content = decoder.decompress(received) + decoder.flush()
+            response._content_consumed = True
+            response.phases['decompress'] = perf_counter() - decompressing
+            response.sizes.update(response=len(received), decoded=len(response._content))
+
+        return response
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
@@ -0,0 +1,112 @@
+"""Generating large comment trees, and benchmarking fetching the comments of a post as the tree grows."""
+import argparse
+from time import perf_counter
+from typing import List, Iterator
+
+from apitest.jsonstream import find_models
+from apitest.schemas import User, Post, Comment
+from apitest.seed import Seeder, ScalePoint, growth_exponent
+from apitest.transport import Transport
+
+
+def grow_comment_tree(seeder: Seeder, post: Post, authors: List[User], depth: int, branching: int,
+                      size: int) -> Iterator[List[Comment]]:
+    """Create a tree of comments on a post one level at a time.
+
+    Every comment gets branching replies, down to the given depth, until
+    there are size comments in total. The comments of a level are created
+    concurrently by the seeder. All comments created so far are yielded
+    after every level.
+    """
+    comments = []
+    parents = [None]
+    for _ in range(depth):
+        count = min(len(parents) * branching, size - len(comments))
+        if count <= 0:
+            return
+
+        def create(i):
+            parent = parents[i // branching]
+            comment = Comment(author_username=authors[i % len(authors)].username,
+                              parent_resub_name=post.parent_resub_name, parent_post_id=post.id,
+                              parent_comment_id=parent.id if parent else None)
+            endpoint = f'/comments/{parent.id}' if parent else f'/posts/{post.id}/comments/'
+            comment.id = seeder.request('POST', endpoint, 201, username=comment.author_username,
+                                        json=comment.create).json()['id']
+            return comment
+
+        parents = seeder.map(create, count)
+        comments.extend(parents)
+        yield comments
+
+
+def verify_comments(seeder: Seeder, post: Post, comments: List[Comment]) -> List[Comment]:
+    """Return the comments missing from the comments of the post, or with different fields.
+
+    The response is checked while it is downloaded, and every element is
+    only compared to the comment with the same id.
+    """
+    r = seeder.request('GET', f'/posts/{post.id}/comments/', 200, stream=True)
+    found = find_models(r.iter_content(chunk_size=65536), comments)
+    return [comment for comment, is_found in zip(comments, found) if not is_found]
+
+
+def benchmark_comment_tree(seeder: Seeder, depth: int = 5, branching: int = 10, size: int = 100000,
+                           samples: int = 5) -> List[ScalePoint]:
+    """Measure the latency and response size of getting the comments of a post after every level of a tree.
+
+    Every created comment is verified after every level.
+    """
+    user, = seeder.create_users(1)
+    resub, = seeder.create_resubs([user], 1)
+    post, = seeder.create_posts([resub], [user], 1)
+
+    points = []
+    for comments in grow_comment_tree(seeder, post, [user], depth, branching, size):
+        point = ScalePoint(len(comments))
+        for _ in range(samples):
+            started = perf_counter()
+            r = seeder.request('GET', f'/posts/{post.id}/comments/', 200)
+            point.latency.record(round((perf_counter() - started) * 1_000_000))
+            point.response_bytes = len(r.content)
+
+        started = perf_counter()
+        missing = verify_comments(seeder, post, comments)
+        print(f'{len(comments)} comments: p50 {point.latency.value_at_quantile(0.5) / 1000:.2f} ms, '
+              f'{point.response_bytes} bytes, verified in {perf_counter() - started:.2f} seconds')
+        assert not missing, f'{len(missing)} comments are missing or wrong, e.g. {missing[0]}'
+        points.append(point)
+
+    return points
+
+
+def print_comment_tree(points: List[ScalePoint]):
+    exponent = growth_exponent(points, lambda p: p.latency.value_at_quantile(0.5))
+    size_exponent = growth_exponent(points, lambda p: p.response_bytes)
+    print(f'\nGET /posts/{{id}}/comments grows with N comments as latency ~ N^{exponent:.2f}, '
+          f'response size ~ N^{size_exponent:.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a large comment tree on a post, and measure getting the '
+                                                 'comments of the post as the tree grows.')
+    parser.add_argument('url', help='The base URL of the API.')
+    parser.add_argument('--depth', type=int, default=5, help='Number of levels of replies.')
+    parser.add_argument('--branching', type=int, default=10, help='Number of replies to every comment.')
+    parser.add_argument('--size', type=int, default=100000, help='Maximum number of comments.')
+    parser.add_argument('--samples', type=int, default=5, help='Requests per level.')
+    parser.add_argument('--concurrency', type=int, default=16, help='Number of requests to send at the same time.')
+    parser.add_argument('--keep', action='store_true', help='Keep the created data.')
+    args = parser.parse_args()
+
+    with Transport(pool_size=args.concurrency) as transport:
+        seeder = Seeder(args.url, transport, concurrency=args.concurrency)
+        try:
+            print_comment_tree(benchmark_comment_tree(seeder, args.depth, args.branching, args.size, args.samples))
+        finally:
+            if not args.keep:
+                seeder.delete_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+"""Load made of a weighted mix of operations, with think time between them, to resemble real traffic.
+
+Every virtual user is a small state machine: it has to browse the resubs
+before it can open one, open a resub before it can read or create its
+posts, and read a post before it can vote on or comment it. Every step, the
+user picks an operation with a probability proportional to its weight in
+the mix, and does it, or first the operation it requires. After every
+operation, the user thinks for a while.
+"""
+import random
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from threading import Lock
+from time import perf_counter, sleep
+from typing import Dict, List, Iterable, Callable, Tuple
+
+from apitest.schemas import User, Post, Comment
+from apitest.seed import Seeder
+from apitest.test import TestStats, Observer
+
+# Default weights of the operations, mostly reads like the traffic of a typical forum
+MIX = {
+    'browse_resubs': 10,
+    'browse_resub': 35,
+    'read_post': 50,
+    'vote': 3,
+    'comment': 1.5,
+    'create_post': 0.5,
+}
+THINK_TIMES = ('none', 'constant', 'uniform', 'exponential')
+
+
+@dataclass
+class ThinkTime:
+    """Seconds a virtual user waits between operations.
+
+    Constant waits a seconds, uniform between a and b seconds, and
+    exponential a seconds on average.
+    """
+    distribution: str = 'none'
+    a: float = 0
+    b: float = 0
+
+    @classmethod
+    def parse(cls, s: str) -> 'ThinkTime':
+        """Parse e.g. none, constant:1, uniform:0.5:2 or exponential:1."""
+        distribution, *params = s.split(':')
+        if distribution not in THINK_TIMES:
+            raise ValueError(f'unknown think time {distribution}, choose from {", ".join(THINK_TIMES)}')
+
+        return cls(distribution, *map(float, params))
+
+    def sample(self, rng: random.Random) -> float:
+        if self.distribution == 'constant':
+            return self.a
+        if self.distribution == 'uniform':
+            return rng.uniform(self.a, self.b)
+        if self.distribution == 'exponential':
+            return rng.expovariate(1 / self.a) if self.a else 0
+
+        return 0
+
+
+def parse_mix(s: str) -> Dict[str, float]:
+    """Parse weights such as read_post=80,vote=20.
+
+    Operations that are not given are only done when another operation
+    requires them.
+    """
+    mix = {}
+    for item in s.split(','):
+        name, weight = item.split('=')
+        if name not in OPERATIONS:
+            raise ValueError(f'unknown operation {name}, choose from {", ".join(OPERATIONS)}')
+        mix[name] = float(weight)
+
+    return mix
+
+
+class VirtualUser:
+    """The state of one user of the workload, and the requests it sends."""
+
+    def __init__(self, url: str, transport, user: User, token: str, rng: random.Random,
+                 observers: Iterable[Observer] = ()):
+        self.url = url
+        self.transport = transport
+        self.user = user
+        self.headers = {'Authorization': 'Bearer ' + token}
+        self.rng = rng
+        self.observers = observers
+        self.stats = TestStats()
+        self.errors = 0
+        # What the user has seen so far
+        self.resubs: List[str] = []
+        self.resub: str = None
+        self.posts: List[int] = []
+        self.post: int = None
+
+    def request(self, method: str, endpoint: str, status: int, **kwargs):
+        """Send a request and return the response, or None if it did not have the expected status."""
+        started = perf_counter()
+        r = self.transport.request(method, f'{self.url}/api{endpoint}', headers=self.headers, **kwargs)
+        seconds = perf_counter() - started
+        self.stats.count += 1
+        self.stats.record(method, endpoint, r.status_code, seconds)
+        for observer in self.observers:
+            observer.request(method, endpoint, r.status_code, status, seconds)
+
+        if r.status_code != status:
+            self.errors += 1
+            return None
+
+        return r
+
+    def browse_resubs(self):
+        r = self.request('GET', '/resubs/', 200)
+        if r:
+            self.resubs = [resub['name'] for resub in r.json()]
+
+    def browse_resub(self):
+        self.resub = self.rng.choice(self.resubs)
+        r = self.request('GET', f'/resubs/{self.resub}/posts/', 200)
+        if r:
+            self.posts = [post['id'] for post in r.json()]
+
+    def read_post(self):
+        self.post = self.rng.choice(self.posts)
+        self.request('GET', f'/posts/{self.post}', 200)
+        self.request('GET', f'/posts/{self.post}/comments/', 200)
+
+    def vote(self):
+        self.request('PATCH', f'/posts/{self.post}/vote/{self.rng.choice((-1, 0, 1))}', 200)
+
+    def comment(self):
+        comment = Comment(author_username=self.user.username, parent_resub_name=self.resub, parent_post_id=self.post)
+        self.request('POST', f'/posts/{self.post}/comments/', 201, json=comment.create)
+
+    def create_post(self):
+        post = Post(author_username=self.user.username, parent_resub_name=self.resub)
+        r = self.request('POST', f'/resubs/{self.resub}/posts/', 201, json=post.create)
+        if r:
+            self.post = r.json()['id']
+            self.posts.append(self.post)
+
+
+# Whether the user can do an operation by name, and the operation to do first otherwise
+OPERATIONS: Dict[str, Tuple[Callable[[VirtualUser], bool], str]] = {
+    'browse_resubs': (lambda user: True, None),
+    'browse_resub': (lambda user: bool(user.resubs), 'browse_resubs'),
+    'read_post': (lambda user: bool(user.posts), 'browse_resub'),
+    'vote': (lambda user: user.post is not None, 'read_post'),
+    'comment': (lambda user: user.post is not None, 'read_post'),
+    'create_post': (lambda user: user.resub is not None, 'browse_resub'),
+}
+
+
+@dataclass
+class WorkloadResult:
+    users: int
+    elapsed_seconds: float = 0
+    operations: Dict[str, int] = field(default_factory=dict)
+    errors: int = 0
+    stats: TestStats = field(default_factory=TestStats)
+
+    @property
+    def requests_per_second(self) -> float:
+        return self.stats.count / self.elapsed_seconds if self.elapsed_seconds else 0
+
+    @property
+    def read_share(self) -> float:
+        """Share of the requests that were reads."""
+        reads = sum(h.count for (method, _, _), h in self.stats.latencies.items() if method == 'GET')
+        return reads / self.stats.count if self.stats.count else 0
+
+
+def run_workload(seeder: Seeder, users: int, duration: float, mix: Dict[str, float] = None,
+                 think_time: ThinkTime = ThinkTime(), resubs: int = 10, posts: int = 100, seed: int = None,
+                 observers: Iterable[Observer] = ()) -> WorkloadResult:
+    """Run users virtual users doing operations of the mix for duration seconds.
+
+    The users, resubs and posts to start from are created with the seeder,
+    and deleted again with seeder.delete_all(), along with everything the
+    virtual users created. Every operation is passed to the observers as a
+    run, which failed if a request did not have the expected status.
+    """
+    mix = mix or MIX
+    rng = random.Random(seed)
+    accounts = seeder.create_users(users)
+    created_resubs = seeder.create_resubs(accounts, resubs)
+    seeder.create_posts(created_resubs, accounts, posts)
+
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    result = WorkloadResult(users=users, operations=dict.fromkeys(OPERATIONS, 0))
+    lock = Lock()
+    started = perf_counter()
+    deadline = started + duration
+
+    def virtual_user(account: User, user_seed: int):
+        user = VirtualUser(seeder.url, seeder.transport, account, seeder.tokens[account.username]['access_token'],
+                           random.Random(user_seed), observers)
+        operations = dict.fromkeys(OPERATIONS, 0)
+        total = TestStats()
+        while perf_counter() < deadline:
+            name = user.rng.choices(names, weights)[0]
+            possible, required = OPERATIONS[name]
+            while not possible(user):
+                name = required
+                possible, required = OPERATIONS[name]
+
+            user.stats, errors = TestStats(), user.errors
+            operation_started = perf_counter()
+            getattr(user, name)()
+            user.stats.elapsed_seconds = perf_counter() - operation_started
+            error = AssertionError(f'{name}: unexpected status') if user.errors > errors else None
+            for observer in observers:
+                observer.run(user.stats, error)
+            total.merge(user.stats)
+            operations[name] += 1
+            sleep(max(0.0, min(think_time.sample(user.rng), deadline - perf_counter())))
+
+        with lock:
+            result.errors += user.errors
+            result.stats.merge(total)
+            for name, count in operations.items():
+                result.operations[name] += count
+
+    with ThreadPoolExecutor(max_workers=users) as executor:
+        for future in [executor.submit(virtual_user, account, rng.getrandbits(32)) for account in accounts]:
+            future.result()
+
+    result.elapsed_seconds = perf_counter() - started
+    return result
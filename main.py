@@ -1,29 +1,94 @@
 import argparse
 import statistics
+import sys
+from functools import partial
+from typing import List
 
-from apitest.test import test_everything
+from apitest.adaptive import STATISTICS, run_adaptive
+from apitest.aio import run_async_users
+from apitest.baseline import save_baseline, load_baseline, compare_to_baseline
+from apitest.budget import BudgetCheck, BudgetObserver, check_budgets, load_budgets
+from apitest.fake import FakeTransport, start_server
+from apitest.load import run_concurrent, find_degradation, run_open_loop, run_processes
+from apitest.metrics import InFlightTransport, MetricsObserver, serve_metrics
+from apitest.registry import Registry, RegistryTransport, registered_transport, reap
+from apitest.replay import RecordingTransport, load_recording, replay
+from apitest.sink import ResultSink
+from apitest.seed import Seeder
+from apitest.test import PHASES, SIZES, SUITES, TestStats, test_everything
+from apitest.transport import Transport, brotli
+from apitest.workload import ThinkTime, parse_mix, run_workload
 
 
-def test_once(url: str):
+def test_once(url: str, options: dict):
     print(f'Starting complete API test on base URL {url}')
-    stats = test_everything(url)
+    stats = test_everything(url, **options)
 
     print(f'\nExecuted {stats.count} tests')
     print(f'Passed in {stats.elapsed_seconds} seconds')
 
+    print_latencies(stats)
+    return stats
 
-def test_multiple(url: str, runs: int):
-    total_stats = []
+
+def test_multiple(url: str, runs: int, options: dict):
+    total_stats = TestStats()
+    elapsed_seconds = []
     print(f'Starting {runs} runs for complete API test on {url}')
-    for i in range(runs):
-        stats = test_everything(url, logging=False)
-        print(f'Run {i + 1} passed in {stats.elapsed_seconds} seconds')
-        total_stats.append(stats)
 
-    elapsed_seconds = [stats.elapsed_seconds for stats in total_stats]
+    # When only some suites are run, users are created once and shared by every run
+    fixtures = {} if options['only'] or options['skip'] else None
+    try:
+        for i in range(runs):
+            stats = test_everything(url, logging=False, fixtures=fixtures, **options)
+            print(f'Run {i + 1} passed in {stats.elapsed_seconds} seconds')
+            elapsed_seconds.append(stats.elapsed_seconds)
+            total_stats.merge(stats)
+    finally:
+        if fixtures:
+            total_stats.merge(test_everything(url, logging=False, fixtures=fixtures,
+                                              **dict(options, only=['teardown'], skip=[])))
 
     print(f'Executed {runs} runs in {sum(elapsed_seconds)} seconds')
-    print(f'Performed a total of {sum(stats.count for stats in total_stats)} tests')
+    print(f'Performed a total of {total_stats.count} tests')
+
+    print_statistics(elapsed_seconds)
+    print_latencies(total_stats)
+    return total_stats
+
+
+def test_adaptive(url: str, warmup: int, width: float, max_seconds: float, statistic: str, endpoint: str,
+                  confidence: float, options: dict):
+    name = f'p99 of {endpoint}' if statistic == 'p99' else f'{statistic} run time'
+    print(f'Running the complete API test on {url} until the {confidence * 100:g}% confidence interval of the '
+          f'{name} is within {width * 100:g}%, after {warmup} warmup runs')
+    try:
+        result = run_adaptive(url, warmup, width, max_seconds, statistic, endpoint, confidence, **options)
+    except ValueError as e:
+        sys.exit(f'error: {e}')
+
+    # Latencies are in microseconds
+    unit, scale = ('ms', 1000) if statistic == 'p99' else ('seconds', 1)
+    low, high = result.interval
+    print(f'Executed {len(result.warmup_seconds)} warmup runs and {len(result.run_seconds)} counted runs in '
+          f'{result.elapsed_seconds:.2f} seconds')
+    if result.run_seconds:
+        print(f'{name}: {result.estimate / scale:.4f} {unit}, {confidence * 100:g}% confidence interval '
+              f'{low / scale:.4f} to {high / scale:.4f} {unit} ({result.relative_width * 100:.1f}%)')
+    if not result.converged:
+        print(f'WARNING: the interval did not get within {width * 100:g}% in {max_seconds} seconds')
+
+    if result.run_seconds:
+        print_statistics(result.run_seconds)
+    print_latencies(result.total)
+    return result.total
+
+
+def print_statistics(elapsed_seconds: list):
+    if len(elapsed_seconds) < 2:
+        print(f'\nStats:\n'
+              f'\tmean: {statistics.mean(elapsed_seconds)}')
+        return
 
     print(f'\nStats:\n'
           f'\tmean: {statistics.mean(elapsed_seconds)}\n'
@@ -34,16 +99,603 @@ def test_multiple(url: str, runs: int):
           f'\tpopulation variance: {statistics.pvariance(elapsed_seconds)}')
 
 
+def print_latencies(stats: TestStats):
+    """Print latency percentiles in milliseconds per endpoint and per expected status."""
+    quantiles = (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('p99.9', 0.999))
+    print(f'\nLatency (ms):\n'
+          f'\t{"endpoint":<50}{"count":>8}' + ''.join(f'{name:>9}' for name, _ in quantiles) + f'{"max":>9}')
+
+    def row(name: str, histogram):
+        values = [histogram.value_at_quantile(q) for _, q in quantiles] + [histogram.max]
+        return f'\t{name:<50}{histogram.count:>8}' + ''.join(f'{value / 1000:>9.2f}' for value in values)
+
+    by_status = sorted(stats.latencies.items())
+    for (method, template), histogram in sorted(stats.endpoint_latencies().items()):
+        print(row(f'{method} {template}', histogram))
+        for (status_method, status_template, status), status_histogram in by_status:
+            if (status_method, status_template) == (method, template):
+                print(row(f'  {status}', status_histogram))
+
+    print_phases(stats)
+    print_sizes(stats)
+
+
+def print_phases(stats: TestStats):
+    """Print the mean time per phase of every endpoint in milliseconds, and the share of server and client time.
+
+    The time to first byte is the time the server took to respond, including
+    the network round trip, while connecting and downloading is network time
+    and decoding and verifying the response is time spent by the test itself.
+    """
+    if not stats.phases:
+        return
+
+    endpoints = sorted({(method, template) for method, template, _ in stats.phases})
+    print(f'\nMean time per phase (ms):\n\t{"endpoint":<50}' + ''.join(f'{phase:>12}' for phase in PHASES))
+    for method, template in endpoints:
+        means = [stats.phases[method, template, phase].mean / 1000 if (method, template, phase) in stats.phases
+                 else 0 for phase in PHASES]
+        print(f'\t{f"{method} {template}":<50}' + ''.join(f'{mean:>12.2f}' for mean in means))
+
+    totals = {phase: sum(histogram.total for (_, _, p), histogram in stats.phases.items() if p == phase)
+              for phase in PHASES}
+    total = sum(totals.values()) or 1
+    server = totals['ttfb']
+    network = totals['connect'] + totals['download']
+    client = totals['decompress'] + totals['decode'] + totals['verify']
+    print(f'\nServer (time to first byte): {server / 1000:.2f} ms ({server / total * 100:.1f}%), '
+          f'network (connect and download): {network / 1000:.2f} ms ({network / total * 100:.1f}%), '
+          f'client (decompress, decode and verify): {client / 1000:.2f} ms ({client / total * 100:.1f}%)')
+
+
+def print_sizes(stats: TestStats):
+    """Print the mean size of the requests and responses of every endpoint in bytes.
+
+    Responses are counted as received, compressed when the server compressed
+    them, and as decoded. Endpoints with large decoded responses may need
+    pagination, and those with large responses received uncompressed may
+    need compression.
+    """
+    if not stats.sizes:
+        return
+
+    def totals(method: str = None, template: str = None) -> dict:
+        return {size: sum(histogram.total for (m, t, s), histogram in stats.sizes.items()
+                          if s == size and method in (None, m) and template in (None, t)) for size in SIZES}
+
+    print(f'\nMean size (bytes):\n\t{"endpoint":<50}' + ''.join(f'{size:>12}' for size in SIZES) +
+          f'{"max decoded":>14}{"compressed":>12}')
+    for method, template in sorted({(method, template) for method, template, _ in stats.sizes}):
+        means = [stats.sizes[method, template, size].mean if (method, template, size) in stats.sizes else 0
+                 for size in SIZES]
+        decoded = stats.sizes.get((method, template, 'decoded'))
+        endpoint = totals(method, template)
+        saved = 1 - endpoint['response'] / endpoint['decoded'] if endpoint['decoded'] else 0
+        print(f'\t{f"{method} {template}":<50}' + ''.join(f'{mean:>12.0f}' for mean in means) +
+              f'{decoded.max if decoded else 0:>14}{saved * 100:>11.1f}%')
+
+    total = totals()
+    saved = 1 - total['response'] / total['decoded'] if total['decoded'] else 0
+    print(f'\nSent {total["request"]} bytes of request bodies, received {total["response"]} bytes of responses '
+          f'decoding to {total["decoded"]} bytes ({saved * 100:.1f}% saved by compression)')
+
+
+def test_concurrent(url: str, concurrency: int, runs: int, options: dict):
+    print(f'Starting {concurrency} concurrent virtual users with {runs} runs each on {url}')
+    result = run_concurrent(url, concurrency, runs_per_user=runs, **options)
+
+    print(f'Executed {len(result.run_seconds)} runs in {result.elapsed_seconds} seconds')
+    print(f'Performed a total of {result.total.count} tests')
+    print(f'Throughput: {result.scenarios_per_second:.2f} runs/sec, {result.requests_per_second:.2f} requests/sec')
+
+    print_statistics(result.run_seconds)
+    print_latencies(result.total)
+    return result.total
+
+
+def test_async(url: str, users: int, runs: int, limit: int, keep_alive: bool, on_response, accept_encoding: str,
+               in_flight, options: dict):
+    print(f'Starting {users} virtual users on an asyncio event loop with {runs} runs each and at most {limit} '
+          f'requests in flight on {url}')
+    result = run_async_users(url, users, runs_per_user=runs, limit=limit, keep_alive=keep_alive,
+                             on_response=on_response, accept_encoding=accept_encoding, in_flight=in_flight,
+                             workers=options['workers'], observers=options['observers'], only=options['only'],
+                             skip=options['skip'])
+
+    print(f'Executed {len(result.run_seconds)} runs in {result.elapsed_seconds} seconds')
+    print(f'Performed a total of {result.total.count} tests')
+    print(f'Throughput: {result.scenarios_per_second:.2f} runs/sec, {result.requests_per_second:.2f} requests/sec')
+
+    print_statistics(result.run_seconds)
+    print_latencies(result.total)
+    return result.total
+
+
+def test_processes(url: str, processes: int, concurrency: int, runs: int, duration: float, ramp_up: float,
+                   transport_factory, options: dict):
+    length = f'for {duration} seconds' if duration else f'with {runs} runs each'
+    print(f'Starting {concurrency} concurrent virtual users in {processes} processes {length} on {url}')
+    result = run_processes(url, processes, concurrency, runs_per_user=None if duration else runs, duration=duration,
+                           ramp_seconds=ramp_up, transport_factory=transport_factory, observers=options['observers'],
+                           workers=options['workers'], only=options['only'], skip=options['skip'])
+
+    print(f'Executed {len(result.run_seconds)} runs in {result.elapsed_seconds} seconds, '
+          f'{result.failed_runs} runs failed')
+    print(f'Runs per process: {", ".join(str(runs) for runs in result.runs_by_process.values())}')
+    print(f'Performed a total of {result.total.count} tests')
+    print(f'Throughput: {result.scenarios_per_second:.2f} runs/sec, {result.requests_per_second:.2f} requests/sec')
+
+    print_statistics(result.run_seconds)
+    print_latencies(result.total)
+    return result.total
+
+
+def test_ramp(url: str, steps: list, runs: int, options: dict):
+    print(f'Starting ramp with {", ".join(map(str, steps))} concurrent virtual users on {url}')
+    results = []
+    for concurrency in steps:
+        result = run_concurrent(url, concurrency, runs_per_user=runs, **options)
+        print(f'{concurrency} users: {result.scenarios_per_second:.2f} runs/sec, '
+              f'{result.requests_per_second:.2f} requests/sec, mean run {result.mean_run_seconds} seconds')
+        results.append(result)
+
+    degraded = find_degradation(results)
+    if degraded:
+        print(f'\nThroughput stopped scaling at {degraded.concurrency} concurrent users')
+    else:
+        print(f'\nThroughput scaled up to {steps[-1]} concurrent users')
+
+    total_stats = TestStats()
+    for result in results:
+        total_stats.merge(result.total)
+    return total_stats
+
+
+def test_open_loop(url: str, rate: float, duration: float, users: int, options: dict):
+    print(f'Starting {rate} requests/sec for {duration} seconds with {users} virtual users on {url}')
+    result = run_open_loop(url, rate, duration, users, **options)
+    paced = result.paced
+
+    print(f'Sent {paced.sent} requests at {result.requests_per_second:.2f} requests/sec')
+    print(f'Completed {len(result.runs.run_seconds)} runs, {result.failed_runs} runs failed')
+    if result.errors:
+        print('Failed runs by error: ' + ', '.join(f'{name} {count}' for name, count in sorted(result.errors.items())))
+    print(f'Lag (ms): p50 {paced.lag.value_at_quantile(0.5) / 1000:.2f}, '
+          f'p99 {paced.lag.value_at_quantile(0.99) / 1000:.2f}, max {(paced.lag.max or 0) / 1000:.2f}')
+    if paced.late:
+        print(f'WARNING: the generator fell behind schedule for {paced.late} requests '
+              f'({paced.late / paced.sent * 100:.1f}%). Latencies include the time waiting for a '
+              f'virtual user, consider using more --concurrency')
+
+    print('\nLatency is measured from the planned send time of every request')
+    print_latencies(result.stats)
+    return result.stats
+
+
+def test_workload(url: str, users: int, duration: float, mix: dict, think_time: ThinkTime, options: dict):
+    print(f'Starting {users} virtual users doing a workload mix for {duration} seconds on {url}')
+    seeder = Seeder(url, options['transport'], concurrency=max(users, 16))
+    try:
+        result = run_workload(seeder, users, duration, mix, think_time, observers=options['observers'])
+    finally:
+        seeder.delete_all()
+
+    operations = sum(result.operations.values())
+    print(f'Performed {operations} operations with {result.stats.count} requests in {result.elapsed_seconds:.2f} '
+          f'seconds ({result.requests_per_second:.2f} requests/sec), {result.errors} requests failed')
+    print(f'Reads: {result.read_share * 100:.1f}% of requests')
+    print('\nOperations:')
+    for name, count in result.operations.items():
+        print(f'\t{name:<20}{count:>8}{count / (operations or 1) * 100:>8.1f}%')
+
+    print_latencies(result.stats)
+    return result.stats
+
+
+def test_replay(url: str, path: str, runs: int, concurrency: int, speed: float, rate: float, check_status: bool,
+                options: dict):
+    requests = load_recording(path)
+    pace = f'{rate} requests/sec' if rate else f'{speed}x the recorded speed'
+    print(f'Replaying {len(requests)} requests {runs} times with {concurrency} concurrent users at {pace} on {url}')
+    result = replay(url, requests, options['transport'], iterations=runs, concurrency=concurrency, speed=speed,
+                    rate=rate, check_status=check_status, observers=options['observers'])
+
+    print(f'Sent {result.stats.count} requests in {result.elapsed_seconds:.2f} seconds '
+          f'({result.requests_per_second:.2f} requests/sec)')
+    if check_status:
+        print(f'{result.errors} requests got another status than recorded')
+
+    print_latencies(result.stats)
+    return result.stats
+
+
+def check_baseline(stats: TestStats, directory: str, name: str, threshold: float, significance: float) -> bool:
+    """Compare the stats to a saved baseline and return whether any endpoint regressed."""
+    comparisons = compare_to_baseline(load_baseline(directory, name), stats, threshold, significance)
+
+    print(f'\nComparison with baseline {name} (ms):\n'
+          f'\t{"endpoint":<50}{"p50":>9}{"change":>9}{"p99":>9}{"change":>9}{"p-value":>10}')
+    for c in comparisons:
+        print(f'\t{f"{c.method} {c.endpoint}":<50}{c.current.value_at_quantile(0.5) / 1000:>9.2f}'
+              f'{c.p50_change * 100:>8.1f}%{c.current.value_at_quantile(0.99) / 1000:>9.2f}{c.p99_change * 100:>8.1f}%'
+              f'{c.p_value:>10.4f}' + ('  REGRESSED' if c.regressed else ''))
+
+    regressed = [c for c in comparisons if c.regressed]
+    if regressed:
+        print(f'\n{len(regressed)} endpoints regressed more than {threshold * 100:.0f}% '
+              f'(significance level {significance})')
+    else:
+        print('\nNo endpoints regressed')
+
+    return bool(regressed)
+
+
+def print_budgets(checks: List[BudgetCheck], window: int) -> bool:
+    """Print the latency budgets with the measured values, and the distribution of breached budgets.
+
+    Returns whether any budget was breached, or matched no requests, which
+    usually means its endpoint or status is wrong.
+    """
+    per = f' per {window} runs' if window else ''
+    print(f'\nLatency budgets{per} (ms):\n\t{"budget":<60}{"count":>8}{"actual":>9}')
+    for check in checks:
+        if check.unmatched:
+            result = 'NO REQUESTS'
+        elif check.breached:
+            result = f'BREACHED in {check.breached_windows} of {check.windows} windows' if window else 'BREACHED'
+        else:
+            result = 'ok'
+        print(f'\t{str(check.budget):<60}{check.histogram.count:>8}{check.value_ms:>9.2f}  {result}')
+
+    breached = [check for check in checks if check.breached]
+    for check in breached:
+        h = check.histogram
+        worst = ' in the worst window' if window else ''
+        print(f'\n{check.budget} breached{worst}: p50 {h.value_at_quantile(0.5) / 1000:.2f}, '
+              f'p90 {h.value_at_quantile(0.9) / 1000:.2f}, p95 {h.value_at_quantile(0.95) / 1000:.2f}, '
+              f'p99 {h.value_at_quantile(0.99) / 1000:.2f}, max {(h.max or 0) / 1000:.2f} ms '
+              f'over {h.count} requests')
+
+    unmatched = [check for check in checks if check.unmatched]
+    if unmatched:
+        print(f'\n{len(unmatched)} latency budgets matched no requests, check their endpoints and statuses: '
+              + ', '.join(str(check.budget) for check in unmatched))
+    if breached:
+        print(f'\n{len(breached)} of {len(checks)} latency budgets were breached')
+    elif not unmatched:
+        print('\nAll latency budgets were met')
+
+    return bool(breached or unmatched)
+
+
+def compare_pooling(url: str, runs: int, options: dict, create_transport):
+    """Run the test with and without connection pooling and compare the timings.
+
+    The transports are created by create_transport, with pooled=False for the unpooled runs.
+    """
+    print(f'Comparing {runs} runs with and without connection pooling on {url}')
+    timings = {}
+    phases = (('unpooled', 'a new connection for every request', {'pooled': False}),
+              ('pooled', 'a pool of keep-alive connections', {'pooled': True}))
+    for name, description, transport_options in phases:
+        with create_transport(**transport_options) as transport:
+            elapsed_seconds = [test_everything(url, logging=False, **dict(options, transport=transport)).elapsed_seconds
+                               for _ in range(runs)]
+
+        timings[name] = statistics.mean(elapsed_seconds)
+        print(f'{name} ({description}): mean {timings[name]} seconds')
+
+    saved = timings['unpooled'] - timings['pooled']
+    print(f'\nConnection pooling saved {saved} seconds per run '
+          f'({saved / timings["unpooled"] * 100:.1f}% of the unpooled run time)')
+
+
+def compare_compression(url: str, runs: int, options: dict, create_transport):
+    """Run the test with and without compressed responses and compare the sizes and timings of every endpoint.
+
+    The transports are created by create_transport with every accept_encoding.
+    """
+    encodings = ('identity', 'gzip', 'br') if brotli else ('identity', 'gzip')
+    print(f'Comparing {runs} runs with Accept-Encoding {", ".join(encodings)} on {url}')
+    results = {}
+    for encoding in encodings:
+        stats = TestStats()
+        with create_transport(accept_encoding=encoding) as transport:
+            for _ in range(runs):
+                stats.merge(test_everything(url, logging=False, **dict(options, transport=transport)))
+
+        results[encoding] = stats
+        received = sum(histogram.total for (_, _, size), histogram in stats.sizes.items() if size == 'response')
+        print(f'{encoding}: mean {stats.elapsed_seconds / runs} seconds and {received / runs:.0f} bytes received '
+              f'per run')
+
+    def mean(histograms: dict, key: tuple, scale: float = 1) -> float:
+        return histograms[key].mean / scale if key in histograms else 0
+
+    print(f'\nMean bytes received, and time downloading and decompressing (ms):\n\t{"endpoint":<50}' +
+          ''.join(f'{f"{encoding} bytes":>16}{"download":>10}{"decompress":>12}' for encoding in encodings))
+    for method, template in sorted({(method, template) for method, template, _ in results['identity'].sizes}):
+        print(f'\t{f"{method} {template}":<50}' + ''.join(
+            f'{mean(stats.sizes, (method, template, "response")):>16.0f}'
+            f'{mean(stats.phases, (method, template, "download"), 1000):>10.2f}'
+            f'{mean(stats.phases, (method, template, "decompress"), 1000):>12.2f}' for stats in results.values()))
+
+
+def wrapped_transport(transport_factory, url: str, record: str = None, metrics: MetricsObserver = None,
+                      **options):
+    """Create a transport with the wrappers of the test, passing the options on to the transport factory."""
+    transport = transport_factory(**options)
+    if record:
+        transport = RecordingTransport(transport, record, url)
+    if metrics:
+        transport = InFlightTransport(transport, metrics)
+    return transport
+
+
+def delete_leftovers(url: str, registry: Registry, transport_factory):
+    """Delete the resources the test created and did not delete, e.g. because a run failed.
+
+    The events of the deleted resources are then dropped from the registry,
+    along with the passwords of deleted users.
+    """
+    left = sum(len(resources) for resources in registry.live(registry.session).values())
+    if left:
+        print(f'\nDeleting {left} resources left by the test')
+        with transport_factory() as transport:
+            outcomes = reap(url, transport, registry, registry.session)
+        print(f'Deleted {outcomes["deleted"]} resources, {outcomes["gone"]} were already gone, '
+              f'{outcomes["failed"]} could not be deleted')
+
+    registry.compact(registry.session)
+
+
+def suites(s: str) -> list:
+    names = s.split(',')
+    for name in names:
+        if name not in SUITES:
+            raise argparse.ArgumentTypeError(f'unknown suite {name}, choose from {", ".join(SUITES)}')
+
+    return names
+
+
 def main():
     parser = argparse.ArgumentParser(description='Run a full test of a Repost API.')
-    parser.add_argument('url', help='The base URL of the API.')
+    parser.add_argument('url', nargs='?', help='The base URL of the API.')
+    parser.add_argument('--fake', choices=('transport', 'server'),
+                        help='Test an in-memory fake API instead, either directly or served over local HTTP.')
     parser.add_argument('--runs', type=int, default=1, help='Number of full test runs.')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='Number of virtual users running the test at the same time.')
+    parser.add_argument('--ramp', type=lambda s: [int(step) for step in s.split(',')],
+                        help='Comma separated concurrency levels to run in turn, e.g. 1,2,4,8.')
+    parser.add_argument('--rps', type=float,
+                        help='Send requests at a constant rate, using --concurrency virtual users.')
+    parser.add_argument('--duration', type=float,
+                        help='Seconds to send requests for with --rps (default 60), or to run for with --processes '
+                             'instead of a number of runs.')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='Number of processes to spread the --concurrency virtual users over.')
+    parser.add_argument('--ramp-up', type=float, default=0,
+                        help='Seconds over which to start the virtual users evenly with --processes.')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='Run the test until the confidence interval of --ci-statistic is narrower than '
+                             '--ci-width, instead of a fixed number of runs.')
+    parser.add_argument('--warmup', type=int, default=2, help='Number of runs not counted with --adaptive.')
+    parser.add_argument('--ci-statistic', choices=STATISTICS, default='mean',
+                        help='Statistic to estimate with --adaptive: the mean or median run time, or the p99 '
+                             'latency of --ci-endpoint.')
+    parser.add_argument('--ci-endpoint', help='Endpoint for the p99 statistic, e.g. "GET /posts/{id}".')
+    parser.add_argument('--ci-width', type=float, default=0.05,
+                        help='Width of the confidence interval relative to the estimate to stop at.')
+    parser.add_argument('--confidence', type=float, default=0.95, help='Confidence level of the interval.')
+    parser.add_argument('--max-time', type=float, default=300, help='Seconds to run for at most with --adaptive.')
+    parser.add_argument('--engine', choices=('threads', 'asyncio'), default='threads',
+                        help='Run the --concurrency virtual users on threads, or as coroutines on an asyncio event '
+                             'loop, which scales to thousands of users.')
+    parser.add_argument('--limit', type=int, default=100,
+                        help='Maximum number of requests in flight, and of connections, with --engine asyncio.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of independent steps of a run to execute at the same time.')
+    parser.add_argument('--only', type=suites, default=[],
+                        help=f'Comma separated suites to run, out of {", ".join(SUITES)}. The steps they depend on '
+                             f'are run as well, and with --runs, the users are only created once.')
+    parser.add_argument('--skip', type=suites, default=[], help='Comma separated suites not to run.')
+    parser.add_argument('--workload', action='store_true',
+                        help='Instead of the test, have --concurrency virtual users do a weighted mix of mostly '
+                             'reads for --duration seconds (default 60).')
+    parser.add_argument('--mix', type=parse_mix,
+                        help='Weights of the --workload operations, e.g. browse_resub=35,read_post=50,vote=3,'
+                             'comment=1.5,create_post=0.5,browse_resubs=10.')
+    parser.add_argument('--think-time', type=ThinkTime.parse, default=ThinkTime(),
+                        help='Time virtual users wait between --workload operations: none, constant:SECONDS, '
+                             'uniform:MIN:MAX or exponential:MEAN.')
+    parser.add_argument('--record', metavar='FILE', help='Record every request of the test to a file.')
+    parser.add_argument('--replay', metavar='FILE',
+                        help='Send the requests of a recording --runs times instead of running the test, using '
+                             '--concurrency users and --rps or --speed.')
+    parser.add_argument('--speed', type=float, default=1, help='Speed relative to the recording with --replay.')
+    parser.add_argument('--no-check', action='store_true', help='Do not check response statuses with --replay.')
+    parser.add_argument('--registry', default='.apitest-registry.jsonl',
+                        help='File to track every created resource in, so resources left by failed or aborted runs '
+                             'can be deleted with python -m apitest.registry.')
+    parser.add_argument('--no-registry', action='store_true', help='Do not track created resources.')
+    parser.add_argument('--pool-size', type=int, default=10, help='Maximum number of pooled connections.')
+    parser.add_argument('--retries', type=int, default=0, help='Number of retries on connection errors.')
+    parser.add_argument('--no-keep-alive', action='store_true', help='Close connections after every request.')
+    parser.add_argument('--no-pool', action='store_true', help='Open a new connection for every request.')
+    parser.add_argument('--compare-pooling', action='store_true',
+                        help='Compare run times with and without connection pooling.')
+    parser.add_argument('--accept-encoding', metavar='ENCODINGS',
+                        help='Accept-Encoding header of every request, e.g. identity, gzip or br, '
+                             'instead of the compressions requests can decode.')
+    parser.add_argument('--compare-compression', action='store_true',
+                        help='Compare response sizes and timings with and without compression.')
+    parser.add_argument('--output', help='Append every request and run to a JSON lines file as they happen.')
+    parser.add_argument('--no-output-requests', action='store_true',
+                        help='Only write runs and per-second rollups to the --output file.')
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                        help='Serve live metrics of the test in the Prometheus text format at /metrics on this port.')
+    parser.add_argument('--metrics-host', default='127.0.0.1', help='Address to serve the metrics on.')
+    parser.add_argument('--save-baseline', metavar='NAME', help='Save the latencies of the test as a named baseline.')
+    parser.add_argument('--baseline', metavar='NAME',
+                        help='Compare the latencies to a named baseline, and fail if any endpoint regressed.')
+    parser.add_argument('--budget', metavar='FILE',
+                        help='JSON file of latency budgets per endpoint, and fail if any is breached.')
+    parser.add_argument('--budget-window', type=int, default=0, metavar='RUNS',
+                        help='Check the budgets over every window of this many runs instead of all runs together.')
+    parser.add_argument('--baseline-dir', default='baselines', help='Directory of saved baselines.')
+    parser.add_argument('--regression-threshold', type=float, default=0.1,
+                        help='Relative increase in p50 or p99 latency that counts as a regression.')
+    parser.add_argument('--significance', type=float, default=0.01,
+                        help='Significance level of the Mann-Whitney U test for regressions.')
     args = parser.parse_args()
 
-    if args.runs > 1:
-        test_multiple(args.url, args.runs)
-    else:
-        test_once(args.url)
+    if args.fake == 'server':
+        # The fake only compresses when asked to, as the API does not by default
+        compress = args.accept_encoding or args.compare_compression
+        args.url = start_server(compress_min_size=500 if compress else None).url
+    elif args.fake == 'transport':
+        args.url = 'http://fake'
+    elif args.url is None:
+        parser.error('the url is required unless using --fake')
+    if args.engine == 'asyncio' and args.fake == 'transport':
+        parser.error('--engine asyncio sends requests over HTTP, use --fake server')
+    if args.compare_pooling and args.fake == 'transport':
+        parser.error('--compare-pooling sends requests over HTTP, use --fake server')
+    if args.compare_compression and args.fake == 'transport':
+        parser.error('--compare-compression sends requests over HTTP, use --fake server')
+    # The test runs in one of these modes, see run. Replays are paced by --rps
+    modes = [name for name, given in (('--compare-pooling', args.compare_pooling),
+                                      ('--compare-compression', args.compare_compression),
+                                      ('--replay', args.replay), ('--workload', args.workload),
+                                      ('--rps', args.rps and not args.replay),
+                                      ('--processes', args.processes > 1), ('--ramp', args.ramp),
+                                      ('--adaptive', args.adaptive)) if given]
+    if len(modes) > 1:
+        parser.error(f'{" and ".join(modes)} cannot be combined')
+    if args.engine == 'asyncio' and modes:
+        parser.error(f'--engine asyncio cannot be combined with {modes[0]}')
+    if args.concurrency > 1 and modes and modes[0] in ('--compare-pooling', '--compare-compression', '--ramp',
+                                                       '--adaptive'):
+        parser.error(f'--concurrency cannot be combined with {modes[0]}')
+    # Only the transport of the test in this process is recorded
+    if args.record and args.processes > 1:
+        parser.error('--record cannot record the requests of --processes')
+    if args.record and args.engine == 'asyncio':
+        parser.error('--record cannot record the requests of --engine asyncio')
+    if args.record and (args.compare_pooling or args.compare_compression):
+        parser.error('--record cannot record the requests of compared transports')
+    if 'br' in (args.accept_encoding or '') and not brotli:
+        parser.error('brotli responses need the brotli package')
+    if args.adaptive and args.ci_statistic == 'p99' and not args.ci_endpoint:
+        parser.error('--ci-endpoint is required for the p99 statistic')
+
+    # Every worker may send a request and its two authorization tests at the same time
+    max_concurrency = max(args.ramp) if args.ramp else args.concurrency
+    if args.workers > 1:
+        max_concurrency *= 3 * args.workers
+
+    transport_factory = partial(Transport, pooled=not args.no_pool, pool_size=max(args.pool_size, max_concurrency),
+                                keep_alive=not args.no_keep_alive, retries=args.retries,
+                                accept_encoding=args.accept_encoding)
+    if args.fake == 'transport':
+        transport_factory = FakeTransport
+
+    # The resources of the in-memory fake are gone with the process
+    registry = None
+    unregistered_factory = transport_factory
+    if not args.no_registry and args.fake != 'transport':
+        registry = Registry(args.registry)
+        transport_factory = partial(registered_transport, transport_factory, args.registry, args.url,
+                                    registry.session)
+    metrics = MetricsObserver() if args.metrics_port is not None else None
+    metrics_server = None
+    if metrics:
+        metrics_server = serve_metrics(metrics, args.metrics_host, args.metrics_port)
+        print(f'Serving metrics on {metrics_server.url}')
+    transport = wrapped_transport(transport_factory, args.url, args.record, metrics)
+    # Transports to compare are created like the transport of the test, but not recorded
+    create_transport = partial(wrapped_transport, transport_factory, args.url, metrics=metrics)
+
+    # Keyword arguments for test_everything
+    options = {'transport': transport, 'workers': args.workers, 'observers': [], 'only': args.only,
+               'skip': args.skip}
+    if metrics:
+        options['observers'].append(metrics)
+    if args.output:
+        options['observers'].append(ResultSink(args.output, requests=not args.no_output_requests))
+    budgets = load_budgets(args.budget) if args.budget else []
+    budget_observer = None
+    if budgets and args.budget_window:
+        budget_observer = BudgetObserver(budgets, args.budget_window)
+        options['observers'].append(budget_observer)
+
+    try:
+        stats = run(args, options, transport_factory, create_transport,
+                    on_response=RegistryTransport(None, registry, args.url).register if registry else None,
+                    in_flight=metrics.sending if metrics else None)
+    finally:
+        for observer in options['observers']:
+            observer.close()
+        if registry:
+            delete_leftovers(args.url, registry, unregistered_factory)
+        if metrics_server:
+            metrics_server.shutdown()
+
+    if stats is None:
+        return
+
+    if args.save_baseline:
+        save_baseline(args.baseline_dir, args.save_baseline, stats, url=args.url)
+        print(f'\nSaved baseline {args.save_baseline}')
+
+    failed = False
+    if args.baseline and check_baseline(stats, args.baseline_dir, args.baseline, args.regression_threshold,
+                                        args.significance):
+        failed = True
+
+    if budgets:
+        checks = budget_observer.finish() if budget_observer else check_budgets(budgets, stats)
+        failed |= print_budgets(checks, args.budget_window)
+
+    if failed:
+        sys.exit(1)
+
+
+def run(args: argparse.Namespace, options: dict, transport_factory, create_transport, on_response=None,
+        in_flight=None) -> TestStats:
+    if args.compare_pooling:
+        compare_pooling(args.url, args.runs, options, create_transport)
+        return None
+    if args.compare_compression:
+        compare_compression(args.url, args.runs, options, create_transport)
+        return None
+
+    with options['transport']:
+        if args.replay:
+            return test_replay(args.url, args.replay, args.runs, args.concurrency, args.speed, args.rps,
+                               not args.no_check, options)
+        elif args.workload:
+            return test_workload(args.url, args.concurrency, args.duration or 60, args.mix, args.think_time, options)
+        elif args.rps:
+            return test_open_loop(args.url, args.rps, args.duration or 60, args.concurrency, options)
+        elif args.processes > 1:
+            return test_processes(args.url, args.processes, args.concurrency, args.runs, args.duration, args.ramp_up,
+                                  transport_factory, options)
+        elif args.ramp:
+            return test_ramp(args.url, args.ramp, args.runs, options)
+        elif args.engine == 'asyncio':
+            return test_async(args.url, args.concurrency, args.runs, args.limit, not args.no_keep_alive, on_response,
+                              args.accept_encoding or 'identity', in_flight, options)
+        elif args.concurrency > 1:
+            return test_concurrent(args.url, args.concurrency, args.runs, options)
+        elif args.adaptive:
+            return test_adaptive(args.url, args.warmup, args.ci_width, args.max_time, args.ci_statistic,
+                                 args.ci_endpoint, args.confidence, options)
+        elif args.runs > 1:
+            return test_multiple(args.url, args.runs, options)
+        else:
+            return test_once(args.url, options)
 
 
 if __name__ == '__main__':
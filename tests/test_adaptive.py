@@ -0,0 +1,25 @@
+import pytest
+
+from apitest.adaptive import run_adaptive, selected_endpoints
+
+
+class NoTransport:
+    def request(self, method: str, url: str, **kwargs):
+        raise AssertionError('No request should be sent')
+
+
+def test_unknown_endpoint_before_any_run():
+    with pytest.raises(ValueError, match='No requests to GET /postz/{id}'):
+        run_adaptive('http://fake', statistic='p99', endpoint='GET /postz/{id}', transport=NoTransport())
+
+
+def test_endpoint_outside_selected_suites_before_any_run():
+    with pytest.raises(ValueError, match='No requests to GET /posts/{id}'):
+        run_adaptive('http://fake', statistic='p99', endpoint='GET /posts/{id}', transport=NoTransport(),
+                     only=['auth'])
+
+
+def test_selected_endpoints():
+    assert 'GET /posts/{id}' in selected_endpoints()
+    assert 'POST /auth/token' in selected_endpoints(only=['auth'])
+    assert 'GET /posts/{id}' not in selected_endpoints(only=['auth'])
@@ -0,0 +1,57 @@
+import pytest
+
+from apitest.baseline import mann_whitney, compare_to_baseline
+from apitest.histogram import Histogram
+from apitest.test import TestStats as Stats
+
+
+def histogram(values) -> Histogram:
+    h = Histogram()
+    for value in values:
+        h.record(value)
+    return h
+
+
+def test_mann_whitney_without_ties():
+    # U = 9 of 9 pairs, variance 3 * 3 / 12 * 7, z = 4.5 / sqrt(5.25)
+    assert mann_whitney(histogram([1, 2, 3]), histogram([4, 5, 6])) == pytest.approx(0.024767, abs=1e-6)
+
+
+def test_mann_whitney_with_ties():
+    # U = 8.5, three pairs of ties so the variance is 3 * 3 / 12 * (7 - 18 / 30), z = 4 / sqrt(4.8)
+    assert mann_whitney(histogram([1, 1, 2]), histogram([2, 3, 3])) == pytest.approx(0.033945, abs=1e-6)
+
+
+def test_mann_whitney_is_one_sided():
+    slower, faster = histogram(range(100, 200)), histogram(range(50, 150))
+
+    assert mann_whitney(faster, slower) < 0.01
+    assert mann_whitney(slower, faster) > 0.99
+    assert mann_whitney(slower, slower) == pytest.approx(0.5)
+
+
+def test_mann_whitney_without_values_or_variance():
+    assert mann_whitney(Histogram(), histogram([1])) == 1.0
+    assert mann_whitney(histogram([5, 5]), histogram([5, 5, 5])) == 1.0
+
+
+def stats(method: str, endpoint: str, seconds) -> Stats:
+    s = Stats()
+    for value in seconds:
+        s.record(method, endpoint, 200, value)
+    return s
+
+
+def test_compare_to_baseline():
+    baseline = stats('GET', '/posts/1', [0.010 + i / 100_000 for i in range(200)])
+    baseline.merge(stats('GET', '/resubs', [0.005] * 10))
+    current = stats('GET', '/posts/2', [0.015 + i / 100_000 for i in range(200)])
+    current.merge(stats('POST', '/users', [0.001] * 10))
+
+    comparison, = compare_to_baseline(baseline, current, threshold=0.1)
+
+    assert (comparison.method, comparison.endpoint) == ('GET', '/posts/{id}')
+    assert comparison.p50_change == pytest.approx(0.45, abs=0.02)
+    assert comparison.regressed
+    assert not compare_to_baseline(baseline, current, threshold=0.5)[0].regressed
+    assert not compare_to_baseline(current, baseline)[0].regressed
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+from apitest.budget import Budget, BudgetObserver, load_budgets, check_budgets
+from apitest.test import TestStats as Stats
+
+
+def write(tmp_path, budgets) -> str:
+    path = tmp_path / 'budgets.json'
+    path.write_text(json.dumps({'budgets': budgets}))
+    return str(path)
+
+
+def test_load_budgets(tmp_path):
+    budgets = load_budgets(write(tmp_path, [
+        {'endpoint': 'get /posts/{id}/', 'quantile': 'p99.9', 'ms': 40},
+        {'endpoint': 'POST /auth/token', 'status': 200, 'quantile': 'max', 'ms': 150},
+    ]))
+
+    assert budgets == [Budget('GET', '/posts/{id}', 'p99.9', 40), Budget('POST', '/auth/token', 'max', 150, 200)]
+
+
+@pytest.mark.parametrize('quantile', ['p0', 'p101', '99', 'median'])
+def test_load_budgets_invalid_quantile(tmp_path, quantile):
+    with pytest.raises(ValueError):
+        load_budgets(write(tmp_path, [{'endpoint': 'GET /resubs', 'quantile': quantile, 'ms': 1}]))
+
+
+def stats(seconds, status: int = 200) -> Stats:
+    s = Stats()
+    for value in seconds:
+        s.record('GET', '/posts/1', status, value)
+    return s
+
+
+def test_check_budgets():
+    s = stats([0.001 * i for i in range(1, 101)])
+    s.merge(stats([1] * 5, status=404))
+
+    checks = check_budgets([Budget('GET', '/posts/{id}', 'p50', 60), Budget('GET', '/posts/{id}', 'p50', 40, 200),
+                            Budget('GET', '/posts/{id}', 'max', 500, 200), Budget('GET', '/postz/{id}', 'max', 1)],
+                           s)
+
+    assert [(check.breached, check.unmatched) for check in checks] == [(False, False), (True, False),
+                                                                        (False, False), (False, True)]
+    assert checks[0].histogram.count == 105
+    assert checks[1].value_ms == pytest.approx(50, rel=0.01)
+
+
+def test_budget_windows():
+    observer = BudgetObserver([Budget('GET', '/posts/{id}', 'max', 10)], window=2)
+    for seconds in (0.001, 0.002, 0.050, 0.001, 0.003):
+        observer.run(stats([seconds]))
+
+    check, = observer.finish()
+
+    assert (check.windows, check.breached_windows) == (3, 1)
+    assert check.value_ms == pytest.approx(50, rel=0.01)
@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+from apitest.histogram import Histogram
+
+
+def histogram(values) -> Histogram:
+    h = Histogram()
+    for value in values:
+        h.record(value)
+    return h
+
+
+def test_small_values_are_exact():
+    h = histogram(range(256))
+
+    assert list(h.buckets()) == [(value, 1) for value in range(256)]
+    # The 128th of the 256 values
+    assert h.value_at_quantile(0.5) == 127
+    assert h.value_at_quantile(1) == 255
+    assert (h.min, h.max, h.count, h.total) == (0, 255, 256, sum(range(256)))
+
+
+@pytest.mark.parametrize('value', [256, 1000, 12345, 999_999, 10 ** 9])
+def test_large_values_within_precision(value):
+    h = histogram([value, value + 1])
+    h.record(0)
+
+    # The middle of a bucket is within 1% of every value in it
+    (middle, count), = [(v, c) for v, c in h.buckets() if v]
+    assert count == 2
+    assert abs(middle - value) / value < 0.01
+
+
+def test_quantiles():
+    h = histogram(range(1, 101))
+
+    assert h.value_at_quantile(0) == 1
+    assert h.value_at_quantile(0.5) == 50
+    assert h.value_at_quantile(0.99) == 99
+    assert h.value_at_quantile(1) == 100
+    assert h.mean == 50.5
+    assert Histogram().value_at_quantile(0.5) == 0
+
+
+def test_quantile_is_clamped_to_recorded_values():
+    h = histogram([1000])
+
+    assert h.value_at_quantile(0.5) == 1000
+
+
+def test_merge_is_recording_both():
+    a, b = histogram([1, 500, 70_000]), histogram([3, 500, 2_000_000])
+    a.merge(b)
+
+    expected = histogram([1, 500, 70_000, 3, 500, 2_000_000])
+    assert a.counts == expected.counts
+    assert (a.count, a.total, a.min, a.max) == (expected.count, expected.total, expected.min, expected.max)
+
+
+def test_merge_different_precision():
+    with pytest.raises(ValueError):
+        Histogram().merge(Histogram(precision_bits=4))
+
+
+def test_negative_value():
+    with pytest.raises(ValueError):
+        Histogram().record(-1)
+
+
+def test_dict_round_trip():
+    h = histogram([0, 7, 300, 123_456])
+
+    copy = Histogram.from_dict(json.loads(json.dumps(h.to_dict())))
+
+    assert copy.counts == h.counts
+    assert (copy.count, copy.total, copy.min, copy.max) == (h.count, h.total, h.min, h.max)
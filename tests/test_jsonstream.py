@@ -0,0 +1,48 @@
+import json
+
+import pytest
+
+from apitest.jsonstream import iter_json_array, find_models
+from apitest.schemas import User
+
+DOCUMENT = json.dumps([
+    {'name': 'ø, [æ]', 'id': 1},
+    12345.678,
+    'a "quoted" ] string',
+    [1, [2, 3]],
+    None,
+    True,
+    -0.5e10,
+], ensure_ascii=False, indent=1).encode()
+
+
+def chunked(data: bytes, size: int):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 64, 100_000])
+def test_elements_across_chunk_boundaries(size):
+    assert list(iter_json_array(chunked(DOCUMENT, size))) == json.loads(DOCUMENT)
+
+
+def test_every_split_point():
+    for i in range(len(DOCUMENT)):
+        assert list(iter_json_array([DOCUMENT[:i], DOCUMENT[i:]])) == json.loads(DOCUMENT)
+
+
+def test_empty_array():
+    assert list(iter_json_array([b' [ ', b' ] '])) == []
+
+
+@pytest.mark.parametrize('document', [b'', b'{}', b'[1,]', b'[1', b'[1 2]', b'[1] 2', b'[,1]', b'["abc'])
+def test_invalid(document):
+    with pytest.raises(ValueError):
+        list(iter_json_array(chunked(document, 1)))
+
+
+def test_find_models():
+    users = [User(), User(), User()]
+    document = json.dumps([{'username': 'someone else'}] + [{'username': user.username, 'bio': user.bio}
+                                                            for user in users[:2]]).encode()
+
+    assert find_models(chunked(document, 5), users) == [True, True, False]
@@ -0,0 +1,15 @@
+from apitest.fake import FakeTransport
+from apitest.replay import replay
+
+
+def test_replay_unexpected_status_without_check():
+    requests = [
+        {'t': 0, 'm': 'GET', 'p': '/users/nobody', 's': 200, 'x': {'username': 'username'}},
+        {'t': 0, 'm': 'GET', 'p': '/users/${username}', 's': 200},
+    ]
+
+    result = replay('http://fake', requests, FakeTransport(), check_status=False)
+
+    assert result.sequences == 1
+    assert result.errors == 1
+    assert result.stats.count == 2
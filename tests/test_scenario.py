@@ -0,0 +1,41 @@
+from apitest.scenario import Scenario
+
+
+def scenario() -> Scenario:
+    s = Scenario()
+    s.add('create_user', lambda: None, tags=['users', 'fixture'])
+    s.add('get_user', lambda: None, requires=['create_user'], tags=['users'])
+    s.add('create_post', lambda: None, requires=['create_user'], tags=['posts'])
+    s.add('edit_post', lambda: None, requires=['create_post'], tags=['posts'])
+    s.add('vote_post', lambda: None, requires=['edit_post'], tags=['votes'])
+    s.add('delete_post', lambda: None, requires=['create_post'], tags=['posts'], cleanup=True)
+    s.add('delete_user', lambda: None, requires=['create_user'], tags=['teardown'], cleanup=True)
+    return s
+
+
+def test_select_everything():
+    assert scenario().select() == ['create_user', 'get_user', 'create_post', 'edit_post', 'vote_post',
+                                   'delete_post', 'delete_user']
+
+
+def test_only_includes_required_steps_in_order():
+    assert scenario().select(only=['votes']) == ['create_user', 'create_post', 'edit_post', 'vote_post',
+                                                 'delete_post', 'delete_user']
+
+
+def test_only_leaves_out_cleanup_of_unselected_steps():
+    assert scenario().select(only=['users']) == ['create_user', 'get_user', 'delete_user']
+
+
+def test_skip_keeps_steps_required_by_selected_steps():
+    assert scenario().select(skip=['posts']) == ['create_user', 'get_user', 'create_post', 'edit_post',
+                                                 'vote_post', 'delete_user']
+
+
+def test_skip_leaves_out_skipped_steps_nobody_requires():
+    assert scenario().select(skip=['votes', 'teardown']) == ['create_user', 'get_user', 'create_post',
+                                                             'edit_post', 'delete_post']
+
+
+def test_done_steps_are_not_run_again():
+    assert scenario().select(only=['users'], done=['create_user']) == ['get_user', 'delete_user']